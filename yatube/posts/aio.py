@@ -0,0 +1,77 @@
+"""
+Асинхронные view поверх синхронного ORM.
+
+Django 2.2 не умеет вызывать async def view, поэтому async_view превращает
+корутину в обычную функцию: она выполняется в своём цикле событий прямо
+в потоке, который обрабатывает запрос (поток воркера ASGI-сервера или WSGI).
+Внутри корутины независимые запросы к базе запускаются одновременно:
+
+    profile, page = await asyncio.gather(db(get_profile), db(paginator.get_page))
+
+db() выполняет функцию в общем пуле потоков; у каждого потока своё соединение,
+которое после вызова закрывается или возвращается в пул по тем же правилам,
+что и в конце обычного запроса (CONN_MAX_AGE, DATABASE_POOL). Внутри транзакции
+(ATOMIC_REQUESTS, TestCase) другие соединения её данных не видят, поэтому там
+функция выполняется сразу в текущем потоке.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from yatube.db_router import replica_reads, replica_reads_allowed
+
+_local = threading.local()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # после fork потоки пула остались в родительском процессе
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(settings.ASYNC_DB_THREADS, thread_name_prefix='async-db')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _call(func, args, kwargs, replicas):
+    try:
+        with replica_reads_allowed(replicas):
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def db(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию с запросами к базе, не блокируя цикл событий.
+    """
+    if any(connection.in_atomic_block for connection in connections.all()):
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool(), partial(_call, func, args, kwargs, replica_reads()))
+
+
+def _loop():
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+    return loop
+
+
+def async_view(view):
+    """
+    Декоратор async def view: снаружи это обычная view-функция, поэтому
+    над ним работают login_required, conditional и query_budget.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return _loop().run_until_complete(view(request, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,204 @@
+"""
+JSON API только для чтения: те же ленты и посты, что и HTML-страницы posts.views.
+
+Параметр fields=id,text,author ограничивает набор полей, cursor - курсор
+соседней страницы из полей next/previous. Ответы поддерживают условные
+запросы через ETag, см. posts.conditional.
+"""
+from functools import wraps
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+
+from .conditional import conditional
+from .counters import stats_for
+from .models import User, Post, Group, Comment
+from .paginator import CursorPaginator
+from .profiling import query_budget
+from .threads import attach_replies, depth, replies_paginator, root_paginator
+from .timeline import FollowFeedPaginator
+
+POST_FIELDS = {
+    'id': lambda post: post.id,
+    'text': lambda post: post.text,
+    'html': lambda post: post.rendered_text,
+    'pub_date': lambda post: post.pub_date.isoformat(),
+    'author': lambda post: post.author.username,
+    'group': lambda post: post.group.slug if post.group_id else None,
+    'image': lambda post: post.image.url if post.image else None,
+    'thumbnails': lambda post: post.thumbnail_urls,
+    'comment_count': lambda post: post.comment_count,
+    'url': lambda post: reverse('post', args=[post.author.username, post.id]),
+}
+
+COMMENT_FIELDS = {
+    'id': lambda comment: comment.id,
+    'parent': lambda comment: comment.parent_id,
+    'author': lambda comment: comment.author.username,
+    'author_url': lambda comment: reverse('profile', args=[comment.author.username]),
+    'text': lambda comment: comment.text,
+    'html': lambda comment: comment.rendered_text,
+    'created': lambda comment: comment.created.isoformat(),
+    'depth': depth,
+    'reply_count': lambda comment: comment.reply_count,
+}
+
+
+class FieldError(Exception):
+    pass
+
+
+def selected_fields(request, available):
+    """
+    Поля из параметра fields в порядке запроса; без параметра - все поля.
+    """
+    fields = [name for name in request.GET.get('fields', '').split(',') if name]
+    if not fields:
+        return list(available)
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise FieldError('Неизвестные поля: %s' % ', '.join(unknown))
+    return fields
+
+
+def serialize(obj, fields, available):
+    return {name: available[name](obj) for name in fields}
+
+
+def api_view(view):
+    """
+    Превращает словарь из view в JSON-ответ, а ошибки в полях - в ответ 400.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            data = view(request, *args, **kwargs)
+        except FieldError as exc:
+            return JsonResponse({'error': str(exc)}, status=400, json_dumps_params={'ensure_ascii': False})
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+    return wrapper
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Нужно войти на сайт'}, status=401, json_dumps_params={'ensure_ascii': False})
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def post_page(request, paginator):
+    fields = selected_fields(request, POST_FIELDS)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return {
+        'results': [serialize(post, fields, POST_FIELDS) for post in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def feed(queryset):
+    return queryset.select_related('author', 'group').order_by('-pub_date', '-id')
+
+
+@query_budget(4)
+@conditional(lambda request: Post.objects.all())
+@api_view
+def index(request):
+    return post_page(request, CursorPaginator(feed(Post.objects.all()), 10))
+
+
+@query_budget(5)
+@conditional(lambda request, slug: Post.objects.filter(group__slug=slug))
+@api_view
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    data = post_page(request, CursorPaginator(feed(group.posts.all()), 10))
+    data['group'] = {'slug': group.slug, 'title': group.title, 'description': group.description}
+    return data
+
+
+@query_budget(6)
+@conditional(lambda request, username: Post.objects.filter(author__username=username))
+@api_view
+def profile(request, username):
+    profile = get_object_or_404(User.objects.select_related('stats'), username=username)
+    stats = stats_for(profile)
+    data = post_page(request, CursorPaginator(feed(profile.posts.all()), 10))
+    data['author'] = {
+        'username': profile.username,
+        'full_name': profile.get_full_name(),
+        'post_count': stats.post_count,
+        'follower_count': stats.follower_count,
+        'following_count': stats.following_count,
+    }
+    return data
+
+
+@query_budget(5)
+@conditional(lambda request, username, post_id: Post.objects.filter(pk=post_id))
+@api_view
+def post_view(request, username, post_id):
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id, author__username=username,
+    )
+    fields = selected_fields(request, dict(POST_FIELDS, comments=None))
+    data = serialize(post, [name for name in fields if name != 'comments'], POST_FIELDS)
+    if 'comments' in fields:
+        # первая страница комментариев верхнего уровня, продолжение - через comments
+        page = root_paginator(post).get_page()
+        data['comments'] = [serialize(comment, COMMENT_FIELDS, COMMENT_FIELDS) for comment in page]
+        data['comments_next'] = page.next_cursor
+    return data
+
+
+def get_post(username, post_id):
+    return get_object_or_404(Post.objects.only('id', 'author_id'), pk=post_id, author__username=username)
+
+
+@query_budget(5)
+@conditional(lambda request, username, post_id: Post.objects.filter(pk=post_id))
+@api_view
+def comments(request, username, post_id):
+    """
+    Страница комментариев верхнего уровня по (created, id) с первыми ответами.
+    """
+    post = get_post(username, post_id)
+    page = root_paginator(post).get_page(request.GET.get('cursor'))
+    results = []
+    for comment in attach_replies(page):
+        item = serialize(comment, COMMENT_FIELDS, COMMENT_FIELDS)
+        item['replies'] = [serialize(reply, COMMENT_FIELDS, COMMENT_FIELDS) for reply in comment.thread]
+        # ссылки «Показать все ответы» для веток, показанных не целиком
+        item['more_replies'] = comment.more_replies
+        item['thread_url'] = reverse('comment_thread', args=[username, post_id, comment.id])
+        item['replies_url'] = reverse('api_comment_replies', args=[username, post_id, comment.id])
+        results.append(item)
+    return {'results': results, 'next': page.next_cursor, 'previous': page.previous_cursor}
+
+
+@query_budget(5)
+@conditional(lambda request, username, post_id, comment_id: Post.objects.filter(pk=post_id))
+@api_view
+def comment_replies(request, username, post_id, comment_id):
+    """
+    Поддерево ответов на комментарий одним запросом по материализованному пути.
+    """
+    post = get_post(username, post_id)
+    comment = get_object_or_404(Comment.objects.only('id', 'post_id', 'path'), pk=comment_id, post=post)
+    page = replies_paginator(comment).get_page(request.GET.get('cursor'))
+    return {
+        'results': [serialize(reply, COMMENT_FIELDS, COMMENT_FIELDS) for reply in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+@query_budget(5)
+@api_login_required
+@conditional(lambda request: Post.objects.filter(author__following__user=request.user), private=True)
+@api_view
+def follow_index(request):
+    return post_page(request, FollowFeedPaginator(request.user, 10))
@@ -0,0 +1,83 @@
+"""
+Асинхронные версии view для чтения, их подключает ASGI-вход (yatube.asgi).
+Данные и контекст шаблонов собирают те же функции posts.pages, что и
+в posts.views, бюджеты запросов те же, но независимые запросы выполняются
+одновременно, см. posts.aio.
+"""
+from asyncio import gather
+
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render
+
+from . import pages
+from .aio import async_view, db
+from .conditional import conditional
+from .models import Post
+from .pagecache import page_cache
+from .profiling import query_budget
+
+
+@query_budget(4)
+@page_cache
+@conditional(lambda request: Post.objects.all())
+@async_view
+async def index(request):
+    paginator = pages.index_paginator(request)
+    page = await db(paginator.get_page, request.GET.get('cursor'))
+    context = await db(pages.index_context, request, paginator, page)
+    return render(request, 'index.html', context)
+
+
+@query_budget(5)
+@page_cache
+@conditional(lambda request, slug: Post.objects.filter(group__slug=slug))
+@async_view
+async def group_posts(request, slug):
+    paginator = pages.group_paginator(request, slug)
+    # группа и страница её постов не зависят друг от друга
+    group, page = await gather(
+        db(pages.get_group, slug),
+        db(paginator.get_page, request.GET.get('cursor')),
+    )
+    context = await db(pages.group_context, request, group, paginator, page)
+    return render(request, 'group.html', context)
+
+
+@query_budget(6)
+@page_cache
+@conditional(lambda request, username: Post.objects.filter(author__username=username))
+@async_view
+async def profile(request, username):
+    # ключ автора для кэша страниц ставится по его id, поэтому посты
+    # читаются после автора, а не одновременно с ним
+    profile = await db(pages.get_profile, request, username)
+    paginator = pages.profile_paginator(username)
+    page = await db(paginator.get_page, request.GET.get('cursor'))
+    context = await db(pages.profile_context, request, profile, paginator, page)
+    return render(request, 'profile.html', context)
+
+
+@query_budget(8)
+@page_cache
+@conditional(lambda request, username, post_id: Post.objects.filter(pk=post_id))
+@async_view
+async def post_view(request, username, post_id):
+    paginator = pages.comments_paginator(request, post_id)
+    profile, post, page = await gather(
+        db(pages.get_profile, request, username),
+        db(pages.get_post, username, post_id),
+        db(paginator.get_page, request.GET.get('cursor')),
+    )
+    context = await db(pages.post_context, request, profile, post, paginator, page)
+    return render(request, 'post.html', context)
+
+
+@query_budget(5)
+@login_required
+@conditional(lambda request: Post.objects.filter(author__following__user=request.user), private=True)
+@async_view
+async def follow_index(request):
+    paginator = pages.follow_paginator(request)
+    page = await db(paginator.get_page, request.GET.get('cursor'))
+    context = await db(pages.follow_context, request, paginator, page)
+    return render(request, 'follow.html', context)
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.template.loader import render_to_string
+
+from .models import Post
+
+# в кэшированной карточке на этом месте подставляется ссылка «Редактировать»
+EDIT_LINK_PLACEHOLDER = '<!-- post-edit-link -->'
+
+
+def card_key(post):
+    # pub_date защищает от повторно выданного id удалённого поста
+    return 'post_card:%s:%s:%d' % (post.pk, post.version, post.pub_date.timestamp() * 1000000)
+
+
+def prefetch_cards(posts):
+    """
+    Достаёт из кэша карточки всех постов страницы одним запросом к кэшу.
+    """
+    posts = list(posts)
+    cached = cache.get_many([card_key(post) for post in posts])
+    for post in posts:
+        post.card_html = cached.get(card_key(post))
+
+
+def render_card(post):
+    """
+    Общая для всех посетителей часть карточки поста.
+    """
+    html = getattr(post, 'card_html', None)
+    if html is None:
+        key = card_key(post)
+        html = cache.get(key)
+        if html is None:
+            html = render_to_string('post_card.html', {'post': post})
+            cache.set(key, html, settings.POST_CARD_CACHE_TIMEOUT)
+        post.card_html = html
+    return html
+
+
+def invalidate_posts(posts):
+    """
+    Сдвигает версию карточек: старые ключи больше не читаются и истекают сами.
+    """
+    posts.update(version=F('version') + 1)
+
+
+def invalidate_post(post_id):
+    invalidate_posts(Post.objects.filter(pk=post_id))
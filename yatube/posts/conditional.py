@@ -0,0 +1,104 @@
+"""
+Условные GET-запросы (If-None-Match / If-Modified-Since) для лент и постов.
+
+Сильный ETag строится из адреса с параметрами, пользователя, даты самого
+свежего поста выборки и общей версии контента. Версия хранится в кэше
+и сдвигается сигналами при любом изменении постов, комментариев, групп,
+подписок и пользователей, см. posts.signals.
+
+Версия в кэше годится, только если кэш общий для всех воркеров: с отдельным
+LocMemCache в каждом процессе правка сдвинула бы версию лишь в одном из них,
+а остальные продолжали бы отвечать 304. Поэтому без CONDITIONAL_GET
+(по умолчанию он включается вместе с CACHE_URL) ETag не выдаётся.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+VERSION_KEY = 'content_version'
+CHANGED_KEY = 'content_changed'
+
+
+def content_state():
+    """
+    Текущая версия контента и время последнего изменения (unix time).
+    """
+    state = cache.get_many([VERSION_KEY, CHANGED_KEY])
+    if VERSION_KEY not in state:
+        # после сброса кэша версия начинается с текущего времени в миллисекундах,
+        # а не с единицы, чтобы не совпасть со старыми ETag у клиентов
+        now = time.time()
+        cache.add(VERSION_KEY, int(now * 1000), None)
+        cache.add(CHANGED_KEY, now, None)
+        state = cache.get_many([VERSION_KEY, CHANGED_KEY])
+    return state.get(VERSION_KEY, 0), state.get(CHANGED_KEY, 0)
+
+
+def bump_content_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+    cache.set(CHANGED_KEY, time.time(), None)
+
+
+def conditional(newest_posts, private=False):
+    """
+    Декоратор view: отдаёт 304, если у клиента актуальная копия.
+    newest_posts(request, *args, **kwargs) возвращает выборку постов,
+    по самой свежей дате которой (вместе с версией контента) считается ETag.
+    private=True - ответ зависит от пользователя и не кэшируется общими кэшами
+    даже для анонимных посетителей.
+    """
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_state'):
+            newest = (
+                newest_posts(request, *args, **kwargs)
+                .order_by('-pub_date').values_list('pub_date', flat=True).first()
+            )
+            request._conditional_state = (newest,) + content_state()
+        return request._conditional_state
+
+    def etag(request, *args, **kwargs):
+        newest, version, _ = state(request, *args, **kwargs)
+        parts = [
+            request.get_full_path(),
+            str(request.user.pk),
+            newest.isoformat() if newest else '',
+            str(version),
+            # в странице есть CSRF-токен формы: после нового входа токен и ключ сессии
+            # меняются, и старая копия страницы с устаревшим токеном не должна подойти
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            (request.session.session_key or '') if request.user.is_authenticated else '',
+        ]
+        return '"%s"' % hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        newest, _, changed = state(request, *args, **kwargs)
+        changed = datetime.fromtimestamp(changed, timezone.utc)
+        return max(newest, changed) if newest else changed
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if settings.CONDITIONAL_GET:
+                response = conditional_view(request, *args, **kwargs)
+            else:
+                response = view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                # копию можно хранить, но перед показом нужно перепроверить ETag;
+                # страницы вошедшего пользователя - только в его браузере
+                shared = not private and not request.user.is_authenticated
+                patch_cache_control(response, no_cache=True, **{'public' if shared else 'private': True})
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,6 @@
+from . import live as live_feeds
+
+
+def live(request):
+    # страницы подключают живую ленту, только если она не займёт поток воркера
+    return {'live': live_feeds.enabled(request)}
@@ -0,0 +1,71 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import User, Post, Comment, Follow, UserStats
+
+
+def bump_user(user_id, **deltas):
+    """
+    Атомарно сдвигает счётчики пользователя: bump_user(1, post_count=1).
+    Если строки со счётчиками ещё нет, её создаст stats_for при первом чтении.
+    """
+    UserStats.objects.filter(user=user_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+
+
+def bump_post(post_id, delta):
+    # счётчик виден на карточке поста, поэтому заодно сдвигаем её версию
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F('comment_count') + delta,
+        version=F('version') + 1,
+    )
+
+
+def stats_for(user):
+    """
+    Счётчики пользователя; для пользователей без строки UserStats считаются заново.
+    """
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        recount_users(User.objects.filter(pk=user.pk))
+        return UserStats.objects.get(user=user.pk)
+
+
+def _count(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def recount_users(users=None):
+    """
+    Пересчитывает счётчики пользователей по исходным таблицам.
+    """
+    users = User.objects.all() if users is None else users
+    existing = set(UserStats.objects.filter(user__in=users).values_list('user', flat=True))
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in users.values_list('pk', flat=True) if pk not in existing],
+    )
+    # первичный ключ UserStats - это user_id, поэтому OuterRef('pk') указывает на пользователя
+    UserStats.objects.filter(user__in=users).update(
+        post_count=_count(Post.objects, 'author'),
+        comment_count=_count(Comment.objects, 'author'),
+        follower_count=_count(Follow.objects, 'author'),
+        following_count=_count(Follow.objects, 'user'),
+    )
+
+
+def recount_posts(posts=None):
+    posts = Post.objects.all() if posts is None else posts
+    posts.update(comment_count=_count(Comment.objects, 'post'))
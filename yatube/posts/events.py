@@ -0,0 +1,251 @@
+"""
+Шина событий для живых лент: новые посты и комментарии.
+
+Сигналы сохранения публикуют событие после коммита в шину процесса, а она
+раскладывает его по подпискам каналов:
+    posts            - все посты (главная страница);
+    group:<id>       - посты группы;
+    author:<id>      - посты автора (лента подписок слушает всех своих авторов);
+    comments:<id>    - комментарии поста.
+
+У каждой подписки ограниченный буфер. Публикация никогда не ждёт клиента:
+если медленный клиент не успел забрать EVENTS_BUFFER_SIZE событий, буфер
+очищается, и клиент получает одно событие reset - перечитать ленту целиком.
+
+Посты и комментарии, созданные другими процессами (воркерами gunicorn,
+командой writebehind), шина узнаёт из базы: пока у процесса есть слушатели,
+фоновый поток раз в EVENTS_POLL_INTERVAL секунд читает новые строки.
+Уже опубликованное сигналами повторно не рассылается.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque, namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+
+from .api import COMMENT_FIELDS, POST_FIELDS, serialize
+from .models import Post, Comment
+
+logger = logging.getLogger(__name__)
+
+POST = 'post'
+COMMENT = 'comment'
+RESET = 'reset'
+
+# id события - первичный ключ поста или комментария, по нему клиент продолжает ленту
+Event = namedtuple('Event', 'id kind data')
+
+EVENT_POST_FIELDS = ('id', 'text', 'pub_date', 'author', 'group', 'url')
+EVENT_COMMENT_FIELDS = ('id', 'parent', 'author', 'author_url', 'text', 'created')
+
+# сколько последних опубликованных событий помнить, чтобы не разослать их дважды
+SEEN_SIZE = 10000
+
+
+def post_event(post):
+    return Event(post.pk, POST, serialize(post, EVENT_POST_FIELDS, POST_FIELDS))
+
+
+def comment_event(comment):
+    return Event(comment.pk, COMMENT, serialize(comment, EVENT_COMMENT_FIELDS, COMMENT_FIELDS))
+
+
+def post_channels(post):
+    channels = ['posts', 'author:%d' % post.author_id]
+    if post.group_id:
+        channels.append('group:%d' % post.group_id)
+    return channels
+
+
+def comment_channels(comment):
+    return ['comments:%d' % comment.post_id]
+
+
+class Subscription:
+    """
+    Подписка одного клиента. Ждать событий можно из потока (wait)
+    или из цикла событий (wait_async), публиковать - из любого потока.
+    """
+
+    def __init__(self, bus, channels, maxsize):
+        self.bus = bus
+        self.channels = frozenset(channels)
+        self.maxsize = maxsize
+        self.buffer = deque()
+        self.overflowed = False
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loop = None
+        self._async_ready = None
+
+    def push(self, event):
+        with self._lock:
+            if self.overflowed:
+                return
+            if len(self.buffer) >= self.maxsize:
+                # клиент не успевает: не копим больше и не задерживаем публикацию
+                self.buffer.clear()
+                self.overflowed = True
+            else:
+                self.buffer.append(event)
+            loop, ready = self._loop, self._async_ready
+        self._ready.set()
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # цикл событий уже закрыт, подписку скоро снимут
+                pass
+
+    def take(self):
+        """
+        Забирает накопленное: (события, был ли переполнен буфер).
+        """
+        with self._lock:
+            events, overflowed = list(self.buffer), self.overflowed
+            self.buffer.clear()
+            self.overflowed = False
+            self._ready.clear()
+        return events, overflowed
+
+    def wait(self, timeout):
+        self._ready.wait(timeout)
+        return self.take()
+
+    async def wait_async(self, timeout):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.get_running_loop()
+                self._async_ready = asyncio.Event()
+            pending = bool(self.buffer) or self.overflowed
+        if not pending:
+            try:
+                await asyncio.wait_for(self._async_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._async_ready.clear()
+        return self.take()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class Bus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = defaultdict(set)
+        self._seen = OrderedDict()
+        self._poller = None
+
+    def subscribe(self, channels, maxsize=None):
+        subscription = Subscription(self, channels, maxsize or settings.EVENTS_BUFFER_SIZE)
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+            if settings.EVENTS_POLL_INTERVAL and self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='events-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                listeners = self._channels.get(channel)
+                if listeners is not None:
+                    listeners.discard(subscription)
+                    if not listeners:
+                        del self._channels[channel]
+
+    def has_listeners(self, channels):
+        with self._lock:
+            return any(channel in self._channels for channel in channels)
+
+    def listeners(self):
+        with self._lock:
+            return len({subscription for listeners in self._channels.values() for subscription in listeners})
+
+    def publish(self, channels, event):
+        """
+        Раздаёт событие подписчикам каналов; возвращает, скольким.
+        """
+        with self._lock:
+            key = (event.kind, event.id)
+            if key in self._seen:
+                return 0
+            self._seen[key] = True
+            if len(self._seen) > SEEN_SIZE:
+                self._seen.popitem(last=False)
+            # клиент, подписанный на несколько каналов события, получает его один раз
+            subscriptions = set()
+            for channel in channels:
+                subscriptions.update(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.push(event)
+        return len(subscriptions)
+
+    def _poll(self):
+        last = None
+        while True:
+            time.sleep(settings.EVENTS_POLL_INTERVAL)
+            try:
+                if not self._channels:
+                    # без слушателей базу не читаем, а начнём с текущих строк
+                    last = None
+                    continue
+                if last is None:
+                    last = (
+                        Post.objects.aggregate(id=Max('pk'))['id'] or 0,
+                        Comment.objects.aggregate(id=Max('pk'))['id'] or 0,
+                    )
+                    continue
+                last = self.poll_once(*last)
+            except Exception:
+                logger.exception('Не удалось прочитать новые посты и комментарии')
+            finally:
+                close_old_connections()
+
+    def poll_once(self, last_post, last_comment):
+        """
+        Публикует посты и комментарии с id больше последних прочитанных.
+        """
+        limit = settings.EVENTS_BUFFER_SIZE
+        for post in Post.objects.filter(pk__gt=last_post).select_related('author', 'group').order_by('pk')[:limit]:
+            self.publish(post_channels(post), post_event(post))
+            last_post = post.pk
+        for comment in Comment.objects.filter(pk__gt=last_comment).select_related('author').order_by('pk')[:limit]:
+            self.publish(comment_channels(comment), comment_event(comment))
+            last_comment = comment.pk
+        return last_post, last_comment
+
+
+_bus = None
+_bus_pid = None
+_bus_lock = threading.Lock()
+
+
+def bus():
+    global _bus, _bus_pid
+    with _bus_lock:
+        # после fork подписки и поток чтения базы остались в родительском процессе
+        if _bus_pid != os.getpid():
+            _bus, _bus_pid = Bus(), os.getpid()
+        return _bus
+
+
+def _publish(channels, make_event):
+    # без слушателей событие не собираем: это лишние запросы к базе при каждой записи
+    if bus().has_listeners(channels):
+        bus().publish(channels, make_event())
+
+
+def publish_post(post):
+    transaction.on_commit(lambda: _publish(post_channels(post), lambda: post_event(post)))
+
+
+def publish_comment(comment):
+    transaction.on_commit(lambda: _publish(comment_channels(comment), lambda: comment_event(comment)))
@@ -0,0 +1,419 @@
+"""
+Граф подписок в памяти процесса: «подписан ли», списки и число подписок
+и подписчиков без SQL.
+
+Снимок хранится в формате CSR: авторы пользователя v - отсортированный
+отрезок targets[offsets[v]:offsets[v + 1]] массива array('i'), подписчики -
+такая же структура в обратную сторону. Проверка подписки - двоичный поиск
+по отрезку, число подписок - разность соседних offsets. На ребро уходит
+по 4 байта в каждую сторону, на пользователя - по 8.
+
+Новые подписки и отписки не перестраивают массивы, а копятся в небольшом
+наложении; когда его размер дорастает до десятой части графа, снимок
+пересобирается в фоновом потоке и подменяется целиком.
+
+Граф загружается тоже в фоновом потоке: при запуске воркера (warm() из
+yatube.wsgi и yatube.asgi) или при первом обращении. Пока он не готов,
+запросы получают ответы из SQL.
+
+Изменения попадают в граф так:
+    - сигналы Follow пишут строку FollowChange в той же транзакции, а после
+      коммита применяют изменение к графу своего процесса и сдвигают версию
+      в кэше;
+    - пока транзакция не закоммичена, её изменения видны только ей самой:
+      они читаются из очереди on_commit соединения и пропадают при откате;
+    - другие процессы перечитывают журнал, когда видят новую версию в общем
+      кэше, и не реже раза в FOLLOW_GRAPH_POLL_INTERVAL секунд.
+Внутри транзакции граф не загружается и не перечитывает журнал: он увидел
+бы чужие незакоммиченные строки. Если граф ещё не загружен, ответ даёт SQL.
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Follow, FollowChange
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'follow_graph_version'
+# столько последних записей журнала перечитывается при каждом опросе: в PostgreSQL
+# транзакция с меньшим id может закоммититься позже соседней
+REPLAY_WINDOW = 100
+# наложение меньше этого размера не сливается со снимком даже в маленьком графе
+COMPACT_MIN = 10000
+
+
+class Adjacency:
+    """
+    Списки смежности в формате CSR.
+    """
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_sorted(cls, pairs):
+        """
+        pairs - пары (вершина, сосед), упорядоченные по обоим полям, без повторов.
+        """
+        offsets, targets = array('q', [0]), array('i')
+        for source, target in pairs:
+            while len(offsets) <= source:
+                offsets.append(len(targets))
+            targets.append(target)
+        offsets.append(len(targets))
+        return cls(offsets, targets)
+
+    def reversed(self):
+        """
+        Те же рёбра в обратную сторону, сортировкой подсчётом за O(E).
+        """
+        size = max(self.targets) + 2 if self.targets else 1
+        offsets = array('q', bytes(8 * size))
+        for target in self.targets:
+            offsets[target + 1] += 1
+        for vertex in range(1, size):
+            offsets[vertex] += offsets[vertex - 1]
+        position = array('q', offsets)
+        targets = array('i', bytes(4 * len(self.targets)))
+        # источники перебираются по возрастанию, поэтому отрезки выходят отсортированными
+        for source in range(len(self.offsets) - 1):
+            for index in range(self.offsets[source], self.offsets[source + 1]):
+                target = self.targets[index]
+                targets[position[target]] = source
+                position[target] += 1
+        return Adjacency(offsets, targets)
+
+    def bounds(self, vertex):
+        if vertex < 0 or vertex + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[vertex], self.offsets[vertex + 1]
+
+    def degree(self, vertex):
+        start, end = self.bounds(vertex)
+        return end - start
+
+    def contains(self, vertex, target):
+        start, end = self.bounds(vertex)
+        index = bisect_left(self.targets, target, start, end)
+        return index < end and self.targets[index] == target
+
+    def neighbours(self, vertex):
+        start, end = self.bounds(vertex)
+        return self.targets[start:end]
+
+    @property
+    def vertices(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.offsets.itemsize * len(self.offsets) + self.targets.itemsize * len(self.targets)
+
+
+class FollowGraph:
+    def __init__(self, following):
+        self._lock = threading.RLock()
+        self._compaction = None
+        self._build(following)
+
+    def _build(self, following):
+        self.following = following
+        self.followers = following.reversed()
+        # пары, чьё состояние отличается от снимка: {пользователь: {автор: подписан}}
+        self.delta_out = {}
+        self.delta_in = {}
+        self.delta_size = 0
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        return cls(Adjacency.from_sorted(pairs))
+
+    def is_following(self, user, author):
+        with self._lock:
+            delta = self.delta_out.get(user)
+            if delta and author in delta:
+                return delta[author]
+            return self.following.contains(user, author)
+
+    def _merged(self, adjacency, delta, vertex):
+        changed = delta.get(vertex)
+        if not changed:
+            return list(adjacency.neighbours(vertex))
+        present = {target for target in adjacency.neighbours(vertex) if changed.get(target, True)}
+        present.update(target for target, follows in changed.items() if follows)
+        return sorted(present)
+
+    def followees(self, user):
+        with self._lock:
+            return self._merged(self.following, self.delta_out, user)
+
+    def followers_of(self, author):
+        with self._lock:
+            return self._merged(self.followers, self.delta_in, author)
+
+    def _count(self, adjacency, delta, vertex):
+        changed = delta.get(vertex, {})
+        return adjacency.degree(vertex) + sum(1 if follows else -1 for follows in changed.values())
+
+    def following_count(self, user):
+        with self._lock:
+            return self._count(self.following, self.delta_out, user)
+
+    def follower_count(self, author):
+        with self._lock:
+            return self._count(self.followers, self.delta_in, author)
+
+    def set_edge(self, user, author, follows):
+        """
+        Применяет подписку или отписку; повторное применение ничего не меняет.
+        """
+        with self._lock:
+            self._overlay(user, author, follows)
+            if (
+                self.delta_size > max(COMPACT_MIN, len(self.following.targets) // 10)
+                and not (self._compaction and self._compaction.is_alive())
+            ):
+                self._compaction = threading.Thread(target=self.compact, name='follow-graph-compact', daemon=True)
+                self._compaction.start()
+
+    def _overlay(self, user, author, follows):
+        if follows == self.following.contains(user, author):
+            # пара вернулась к состоянию снимка
+            if self.delta_out.get(user, {}).pop(author, None) is not None:
+                self.delta_in[author].pop(user)
+                self.delta_size -= 1
+            return
+        if author not in self.delta_out.setdefault(user, {}):
+            self.delta_size += 1
+        self.delta_out[user][author] = follows
+        self.delta_in.setdefault(author, {})[user] = follows
+
+    def compact(self):
+        """
+        Сливает наложение со снимком. Новый снимок строится без блокировки
+        из копии наложения; изменения, пришедшие за это время, остаются
+        в наложении уже поверх нового снимка.
+        """
+        with self._lock:
+            following = self.following
+            delta = {user: dict(changed) for user, changed in self.delta_out.items()}
+        users = max([following.vertices] + [user + 1 for user in delta])
+        merged = Adjacency.from_sorted(
+            (user, author) for user in range(users) for author in self._merged(following, delta, user)
+        )
+        followers = merged.reversed()
+        with self._lock:
+            changes = [
+                (user, author, follows)
+                for user, changed in self.delta_out.items() for author, follows in changed.items()
+            ]
+            self.following, self.followers = merged, followers
+            self.delta_out, self.delta_in, self.delta_size = {}, {}, 0
+            for change in changes:
+                self._overlay(*change)
+
+    @property
+    def edges(self):
+        return len(self.following.targets) + sum(
+            1 if follows else -1 for changed in self.delta_out.values() for follows in changed.values()
+        )
+
+    @property
+    def nbytes(self):
+        return self.following.nbytes + self.followers.nbytes
+
+
+class Change(namedtuple('Change', 'user author follows')):
+    """
+    Подписка или отписка, ждущая коммита в очереди on_commit соединения.
+    """
+
+    def __call__(self):
+        graph = _state.graph
+        if graph is not None and _state.pid == os.getpid():
+            graph.set_edge(self.user, self.author, self.follows)
+            version = bump_version()
+            # свою же версию перечитывать незачем, если между ними не было чужих
+            if _state.version is not None and version == _state.version + 1:
+                _state.version = version
+        else:
+            bump_version()
+
+
+def bump_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        return None
+
+
+def record(user_id, author_id, follows):
+    """
+    Вызывается сигналами Follow.
+    """
+    FollowChange.objects.create(user_id=user_id, author_id=author_id, follows=follows)
+    transaction.on_commit(Change(user_id, author_id, follows))
+
+
+def _connection():
+    return connections[router.db_for_write(Follow)]
+
+
+def _pending(user_id):
+    return [
+        func for _, func in _connection().run_on_commit
+        if isinstance(func, Change) and func.user == user_id
+    ]
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.graph = None
+        self.pid = None
+        self.last_change = 0
+        self.version = None
+        self.polled = 0
+        self.loading = None
+
+
+_state = _State()
+
+
+def load():
+    """
+    Читает граф из базы: сначала позицию журнала, затем все подписки,
+    затем журнал с этой позиции, чтобы не потерять изменения между ними.
+    Граф строится без блокировки и подменяет граф процесса целиком.
+    """
+    using = router.db_for_write(Follow)
+    version = cache.get(VERSION_KEY)
+    head = FollowChange.objects.using(using).aggregate(head=Max('pk'))['head'] or 0
+    pairs = Follow.objects.using(using).order_by('user', 'author').values_list('user', 'author')
+    graph = FollowGraph.from_pairs(pairs.iterator(chunk_size=10000))
+    with _state.lock:
+        _state.graph, _state.pid, _state.last_change = graph, os.getpid(), head
+        _state.version = version
+        poll()
+    return graph
+
+
+def _load_in_background():
+    try:
+        load()
+    except Exception:
+        logger.exception('Не удалось загрузить граф подписок')
+    finally:
+        connections.close_all()
+
+
+def warm():
+    """
+    Начинает загрузку графа в фоновом потоке, если она ещё не идёт.
+    Возвращает поток загрузки или None, если граф выключен.
+    """
+    if not settings.FOLLOW_GRAPH:
+        return None
+    with _state.lock:
+        # после fork поток родителя в дочернем процессе уже не жив
+        if _state.loading is None or not _state.loading.is_alive():
+            _state.loading = threading.Thread(target=_load_in_background, name='follow-graph-load', daemon=True)
+            _state.loading.start()
+        return _state.loading
+
+
+def poll():
+    using = router.db_for_write(Follow)
+    changes = (
+        FollowChange.objects.using(using)
+        .filter(pk__gt=_state.last_change - REPLAY_WINDOW)
+        .order_by('pk')
+        .values_list('pk', 'user_id', 'author_id', 'follows')
+    )
+    for pk, user_id, author_id, follows in changes:
+        _state.graph.set_edge(user_id, author_id, follows)
+        _state.last_change = max(_state.last_change, pk)
+    _state.polled = time.monotonic()
+
+
+def current():
+    """
+    Граф процесса, догруженный из журнала, или None, если граф выключен,
+    ещё загружается или его нельзя загрузить внутри транзакции.
+    """
+    if not settings.FOLLOW_GRAPH:
+        return None
+    if _connection().in_atomic_block:
+        return _state.graph if _state.pid == os.getpid() else None
+    with _state.lock:
+        elapsed = time.monotonic() - _state.polled
+        # журнал старше этого срока мог быть удалён prune_follow_log
+        if (
+            _state.graph is not None and _state.pid == os.getpid()
+            and elapsed <= settings.FOLLOW_GRAPH_LOG_RETENTION.total_seconds() / 2
+        ):
+            version = cache.get(VERSION_KEY)
+            if version is None:
+                bump_version()
+                version = cache.get(VERSION_KEY)
+            if version != _state.version or elapsed >= settings.FOLLOW_GRAPH_POLL_INTERVAL:
+                poll()
+            _state.version = version
+            return _state.graph
+    warm()
+    return None
+
+
+def reset():
+    loading = _state.loading
+    if loading is not None and loading.is_alive():
+        loading.join()
+    with _state.lock:
+        _state.graph = _state.pid = _state.version = _state.loading = None
+
+
+def is_following(user_id, author_id):
+    if user_id is None:
+        return False
+    for change in reversed(_pending(user_id)):
+        if change.author == author_id:
+            return change.follows
+    graph = current()
+    if graph is None:
+        return Follow.objects.filter(user=user_id, author=author_id).exists()
+    return graph.is_following(user_id, author_id)
+
+
+def followees(user_id):
+    graph = current()
+    if graph is None:
+        return list(Follow.objects.filter(user=user_id).order_by('author').values_list('author', flat=True))
+    authors = set(graph.followees(user_id))
+    for change in _pending(user_id):
+        if change.follows:
+            authors.add(change.author)
+        else:
+            authors.discard(change.author)
+    return sorted(authors)
+
+
+def prune(older_than=None):
+    """
+    Удаляет записи журнала старше FOLLOW_GRAPH_LOG_RETENTION. Процессы,
+    которые так долго не читали журнал, перезагружают граф целиком.
+    """
+    older_than = older_than or settings.FOLLOW_GRAPH_LOG_RETENTION
+    return FollowChange.objects.filter(created__lt=timezone.now() - older_than).delete()[0]
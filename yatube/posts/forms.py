@@ -1,11 +1,13 @@
-from django.forms import ModelForm
+from django.forms import HiddenInput, ModelForm
 from .models import Post, Comment
+from .uploads import BoundedImageField
 
 
 class PostForm(ModelForm):
     class Meta:
         model = Post
         fields = ['text', 'group', 'image']
+        field_classes = {'image': BoundedImageField}
 
 
 form = PostForm()
@@ -14,7 +16,9 @@ form = PostForm()
 class CommentForm(ModelForm):
     class Meta:
         model = Comment
-        fields = ['text']
+        fields = ['text', 'parent']
+        # ответ на комментарий: id подставляется ссылкой «Ответить»
+        widgets = {'parent': HiddenInput}
 
 
 form = CommentForm()
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Живые ленты: новые посты главной страницы, группы и ленты подписок,
+новые комментарии поста.
+
+Ответ - поток server-sent events; с параметром poll=1 - long-poll: JSON
+с событиями, как только они появятся, или пустой список через
+EVENTS_LONG_POLL_TIMEOUT секунд. Клиент продолжает с последнего полученного id:
+браузер сам присылает заголовок Last-Event-ID, long-poll - параметр last_id.
+
+Под ASGI (yatube.asgi) ожидание идёт в цикле событий сервера и не занимает
+потоков, поэтому один воркер держит тысячи слушателей. Под WSGI каждый
+слушатель занимает поток воркера до конца EVENTS_STREAM_MAX_AGE, поэтому там
+живые ленты включает только настройка EVENTS_ENABLED: иначе страницы не
+подключаются к потоку, а адреса событий отвечают 204, и браузер перестаёт
+переподключаться.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from . import followgraph
+from .events import RESET, bus, comment_event, post_event
+from .models import Post, Group, Comment
+from .profiling import query_budget
+
+
+class EventResponse(StreamingHttpResponse):
+    """
+    Ответ, тело которого ждёт событий подписки. ASGI-обработчик читает
+    async_content() в цикле событий, WSGI - обычный итератор в потоке.
+    backlog - пропущенные клиентом события или None, если их слишком много.
+    """
+    content_type = None
+
+    def __init__(self, subscription, backlog, last_id):
+        super().__init__(content_type=self.content_type)
+        self.subscription = subscription
+        self.backlog = backlog
+        self.last_id = last_id
+        self.streaming_content = self.sync_content()
+        self['Cache-Control'] = 'no-cache'
+        # nginx не должен копить поток в буфере
+        self['X-Accel-Buffering'] = 'no'
+
+    def fresh(self, events):
+        """
+        Отбрасывает уже отправленное: пропущенное читается из базы,
+        и те же события могут прийти ещё и из шины.
+        """
+        events = [event for event in events if self.last_id is None or event.id > self.last_id]
+        if events:
+            self.last_id = events[-1].id
+        return events
+
+    def close(self):
+        self.subscription.close()
+        super().close()
+
+
+class EventStream(EventResponse):
+    content_type = 'text/event-stream'
+
+    def sync_content(self):
+        yield self.start()
+        deadline = time.monotonic() + settings.EVENTS_STREAM_MAX_AGE
+        while time.monotonic() < deadline:
+            yield self.format(*self.subscription.wait(settings.EVENTS_HEARTBEAT))
+
+    async def async_content(self):
+        yield self.start()
+        deadline = time.monotonic() + settings.EVENTS_STREAM_MAX_AGE
+        while time.monotonic() < deadline:
+            yield self.format(*await self.subscription.wait_async(settings.EVENTS_HEARTBEAT))
+
+    def start(self):
+        # через сколько миллисекунд браузеру переподключаться после конца потока
+        retry = 'retry: %d\n\n' % (settings.EVENTS_RETRY * 1000)
+        if self.backlog is None:
+            return retry + self.format([], True)
+        return retry + self.format(self.backlog, False)
+
+    def format(self, events, overflowed):
+        if overflowed:
+            return 'event: %s\ndata: {}\n\n' % RESET
+        chunks = [
+            'id: %d\nevent: %s\ndata: %s\n\n' % (event.id, event.kind, json.dumps(event.data, ensure_ascii=False))
+            for event in self.fresh(events)
+        ]
+        # комментарий SSE не даёт прокси закрыть простаивающее соединение
+        return ''.join(chunks) or ': ping\n\n'
+
+
+class LongPoll(EventResponse):
+    content_type = 'application/json'
+
+    def sync_content(self):
+        events, overflowed = self.pending()
+        deadline = time.monotonic() + settings.EVENTS_LONG_POLL_TIMEOUT
+        while not events and not overflowed and time.monotonic() < deadline:
+            events, overflowed = self.subscription.wait(deadline - time.monotonic())
+            events = self.fresh(events)
+        yield self.format(events, overflowed)
+
+    async def async_content(self):
+        events, overflowed = self.pending()
+        deadline = time.monotonic() + settings.EVENTS_LONG_POLL_TIMEOUT
+        while not events and not overflowed and time.monotonic() < deadline:
+            events, overflowed = await self.subscription.wait_async(deadline - time.monotonic())
+            events = self.fresh(events)
+        yield self.format(events, overflowed)
+
+    def pending(self):
+        if self.backlog is None:
+            return [], True
+        return self.fresh(self.backlog), False
+
+    def format(self, events, overflowed):
+        return json.dumps({
+            'events': [{'id': event.id, 'type': event.kind, 'data': event.data} for event in events],
+            'reset': overflowed,
+            'last_id': self.last_id,
+        }, ensure_ascii=False)
+
+
+def enabled(request):
+    return settings.EVENTS_ENABLED or request.META.get('yatube.asgi', False)
+
+
+def event_response(request, channels, queryset, make_event):
+    if not enabled(request):
+        return HttpResponse(status=204)
+    value = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_id', '')
+    last_id = int(value) if value.isdigit() else None
+    # подписка раньше чтения пропущенного, чтобы между ними ничего не потерялось
+    subscription = bus().subscribe(channels)
+    backlog = []
+    if last_id is not None:
+        limit = settings.EVENTS_BUFFER_SIZE
+        missed = list(queryset.filter(pk__gt=last_id).order_by('pk')[:limit + 1])
+        backlog = [make_event(obj) for obj in missed] if len(missed) <= limit else None
+    response_class = LongPoll if request.GET.get('poll') else EventStream
+    return response_class(subscription, backlog, last_id)
+
+
+def post_feed(queryset):
+    return queryset.select_related('author', 'group')
+
+
+@query_budget(3)
+def index_events(request):
+    return event_response(request, ['posts'], post_feed(Post.objects.all()), post_event)
+
+
+@query_budget(4)
+def group_events(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return event_response(request, ['group:%d' % group.id], post_feed(Post.objects.filter(group=group)), post_event)
+
+
+@query_budget(5)
+@login_required
+def follow_events(request):
+    authors = followgraph.followees(request.user.id)
+    return event_response(
+        request,
+        ['author:%d' % author for author in authors],
+        post_feed(Post.objects.filter(author__following__user=request.user)),
+        post_event,
+    )
+
+
+@query_budget(4)
+def post_events(request, username, post_id):
+    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    comments = Comment.objects.filter(post=post).select_related('author')
+    return event_response(request, ['comments:%d' % post.id], comments, comment_event)
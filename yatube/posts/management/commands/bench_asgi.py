@@ -0,0 +1,147 @@
+import asyncio
+import io
+import random
+import statistics
+import threading
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+
+from posts.models import Post
+from yatube.asgi import ASGIHandler, build_environ
+from .loadtest import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность WSGI с синхронными view и ASGI с асинхронными '
+        'при большом числе одновременных клиентов. Медленных клиентов и задержку сети '
+        'до базы можно имитировать, тогда видно, кто из них держит потоки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='Число одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=5, help='Запросов на клиента')
+        parser.add_argument(
+            '--wsgi-workers', type=int, default=16,
+            help='Сколько запросов WSGI обслуживает одновременно (воркеры gunicorn x потоки)',
+        )
+        parser.add_argument('--client-delay', type=float, default=20, help='Сколько мс клиент принимает ответ')
+        parser.add_argument('--db-latency', type=float, default=2, help='Задержка каждого SQL-запроса, мс')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        posts = list(
+            Post.objects.filter(group__isnull=False)
+            .values_list('id', 'author__username', 'group__slug')[:500]
+        )
+        if not posts:
+            raise CommandError('В базе нет постов в группах; сначала выполните seed_yatube')
+        total = options['concurrency'] * options['requests']
+        paths = []
+        for _ in range(total):
+            post_id, username, slug = rng.choice(posts)
+            paths.append(rng.choice(['/', '/group/%s/' % slug, '/%s/' % username, '/%s/%d/' % (username, post_id)]))
+
+        latency = options['db_latency'] / 1000
+
+        def slow_database(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            if slow_database not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow_database)
+
+        if latency:
+            connection_created.connect(add_latency)
+        self.stdout.write('%-6s %9s %9s %9s %7s' % ('вход', 'p50, ms', 'p95, ms', 'запр/с', 'ошибок'))
+        try:
+            for name, run in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                timings, errors, elapsed = run(paths, options)
+                self.stdout.write('%-6s %9.2f %9.2f %9.1f %7d' % (
+                    name, statistics.median(timings), percentile(timings, 0.95), len(timings) / elapsed, errors,
+                ))
+        finally:
+            connection_created.disconnect(add_latency)
+
+    @staticmethod
+    def scope(path):
+        return {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+            'headers': [(b'host', b'localhost')], 'server': ('localhost', 80),
+        }
+
+    def run_wsgi(self, paths, options):
+        application = WSGIHandler()
+        workers = threading.Semaphore(options['wsgi_workers'])
+        delay = options['client_delay'] / 1000
+        timings, errors, lock = [], [0], threading.Lock()
+        statuses = {}
+
+        def start_response(status, headers):
+            statuses[threading.get_ident()] = int(status.split()[0])
+
+        def client(own_paths):
+            for path in own_paths:
+                started = time.perf_counter()
+                with workers:
+                    result = application(build_environ(self.scope(path), io.BytesIO()), start_response)
+                    try:
+                        for _ in result:
+                            # синхронный воркер занят, пока медленный клиент принимает ответ
+                            time.sleep(delay)
+                    finally:
+                        result.close()
+                with lock:
+                    timings.append((time.perf_counter() - started) * 1000)
+                    errors[0] += statuses[threading.get_ident()] >= 500
+
+        concurrency = options['concurrency']
+        threads = [threading.Thread(target=client, args=(paths[number::concurrency],)) for number in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return timings, errors[0], time.perf_counter() - started
+
+    def run_asgi(self, paths, options):
+        application = ASGIHandler()
+        delay = options['client_delay'] / 1000
+        timings, errors = [], [0]
+
+        async def request(path):
+            started = time.perf_counter()
+            status = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif message.get('body'):
+                    # пока клиент принимает ответ, потоки свободны для других запросов
+                    await asyncio.sleep(delay)
+
+            await application(self.scope(path), receive, send)
+            timings.append((time.perf_counter() - started) * 1000)
+            errors[0] += status[0] >= 500
+
+        async def client(own_paths):
+            for path in own_paths:
+                await request(path)
+
+        async def main():
+            concurrency = options['concurrency']
+            await asyncio.gather(*(client(paths[number::concurrency]) for number in range(concurrency)))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        application.executor.shutdown()
+        return timings, errors[0], elapsed
@@ -0,0 +1,103 @@
+import collections
+import itertools
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from posts.models import User, Post, Comment
+from posts.threads import attach_replies, fill_paths, replies_paginator, root_paginator
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает загрузку всех комментариев поста разом с курсорными страницами '
+        'веток и выборкой поддерева по материализованному пути.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=100000, help='Сколько комментариев у поста')
+        parser.add_argument('--roots', type=float, default=0.2, help='Доля комментариев верхнего уровня')
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        post = self.seed(options)
+        repeat = options['repeat']
+        legacy = Comment.objects.select_related('author').filter(post=post).order_by('created', 'id')
+        self.stdout.write('%-28s %10s %8s' % ('запрос', 'ms', 'строк'))
+        self.report('все комментарии', lambda: list(legacy.all()), repeat)
+
+        paginator = root_paginator(post)
+        roots = paginator.object_list.order_by(*paginator.ordering)
+        for number in options['pages']:
+            cursor = None
+            if number > 1:
+                # курсор берём заранее: на странице его приносит ссылка «Загрузить ещё»
+                cursor = paginator.cursor_for(roots[(number - 1) * paginator.per_page - 1])
+            self.report(
+                'страница %d с ответами' % number,
+                lambda: attach_replies(paginator.get_page(cursor)),
+                repeat,
+            )
+
+        busiest = roots.order_by('-reply_count').first()
+        self.report(
+            'поддерево (%d ответов)' % busiest.reply_count,
+            lambda: list(replies_paginator(busiest, per_page=busiest.reply_count or 1).get_page()),
+            repeat,
+        )
+
+    def seed(self, options):
+        author, _ = User.objects.get_or_create(username='bench_comments')
+        post = Post.objects.filter(author=author).first() or Post.objects.create(
+            author=author, text='Пост для замера комментариев',
+        )
+        existing = Comment.objects.filter(post=post).count()
+        missing = options['comments'] - existing
+        if missing <= 0:
+            return post
+        self.stdout.write('Создаём %d комментариев...' % missing)
+        rng = random.Random(options['seed'])
+        # id выдаёт база (явные id не сдвинули бы последовательность в PostgreSQL),
+        # поэтому сначала вставляем корни, потом ответы к ним, а пути считаем отдельно
+        roots = sum(rng.random() < options['roots'] for _ in range(missing)) or 1
+        self.bulk(
+            (Comment(post=post, author=author, text='Комментарий') for _ in range(roots)),
+            options['batch_size'],
+        )
+        parents = list(Comment.objects.filter(post=post, parent=None).values_list('id', flat=True))
+        replies = collections.Counter(rng.choice(parents) for _ in range(missing - roots))
+        self.bulk(
+            (
+                Comment(post=post, author=author, parent_id=parent_id, text='Ответ')
+                for parent_id, count in replies.items() for _ in range(count)
+            ),
+            options['batch_size'],
+        )
+        fill_paths(Comment.objects.filter(post=post))
+        for pk, count in replies.items():
+            Comment.objects.filter(pk=pk).update(reply_count=F('reply_count') + count)
+        return post
+
+    @staticmethod
+    def bulk(objects, batch_size):
+        while True:
+            batch = list(itertools.islice(objects, batch_size))
+            if not batch:
+                break
+            Comment.objects.bulk_create(batch)
+
+    def report(self, name, func, repeat):
+        timings = []
+        rows = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - started) * 1000)
+            rows = len(result) + sum(len(getattr(item, 'thread', ())) for item in result)
+        self.stdout.write('%-28s %10.2f %8d' % (name, statistics.median(timings), rows))
@@ -0,0 +1,93 @@
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+
+from posts.models import Post
+from yatube.db import pool
+from .loadtest import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает новое соединение с базой на каждый запрос с соединениями из пула '
+        'при заданном числе одновременных запросов и печатает p50/p95, запросы в секунду '
+        'и сколько соединений было открыто.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='Число одновременных запросов')
+        parser.add_argument('--requests', type=int, default=20, help='Запросов на каждый поток')
+        parser.add_argument('--pool-size', type=int, default=20)
+        parser.add_argument('--pool-timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        base = connections.databases[DEFAULT_DB_ALIAS]
+        # при DATABASE_POOL=1 в default уже бэкенд с пулом, сравниваем его с исходным
+        plain = {pooled: engine for engine, pooled in settings.POOLED_ENGINES.items()}.get(base['ENGINE'], base['ENGINE'])
+        if plain not in settings.POOLED_ENGINES:
+            raise CommandError('Для бэкенда %s нет варианта с пулом' % plain)
+        if not Post.objects.exists():
+            raise CommandError('В базе нет постов; сначала выполните seed_yatube')
+        base_options = {key: value for key, value in base.get('OPTIONS', {}).items() if key != 'POOL'}
+        connections.databases['bench_plain'] = dict(base, ENGINE=plain, OPTIONS=base_options, CONN_MAX_AGE=0)
+        connections.databases['bench_pooled'] = dict(
+            base, ENGINE=settings.POOLED_ENGINES[plain], CONN_MAX_AGE=0,
+            OPTIONS=dict(base_options, POOL={'MAX_SIZE': options['pool_size'], 'TIMEOUT': options['pool_timeout']}),
+        )
+
+        self.stdout.write('%-16s %9s %9s %9s %12s %7s' % ('режим', 'p50, ms', 'p95, ms', 'запр/с', 'соединений', 'ошибок'))
+        for alias, name in (('bench_plain', 'на каждый запрос'), ('bench_pooled', 'пул')):
+            timings, errors, elapsed, opened = self.run(alias, options['concurrency'], options['requests'])
+            if alias == 'bench_pooled':
+                opened = pool.stats()[alias]['connects']
+            self.stdout.write('%-16s %9.2f %9.2f %9.1f %12d %7d' % (
+                name, statistics.median(timings), percentile(timings, 0.95),
+                len(timings) / elapsed, opened, errors,
+            ))
+        self.stdout.write('Пул: %s' % pool.stats()['bench_pooled'])
+        pool.get_pool('bench_pooled', {}, None).close_all()
+
+    def run(self, alias, concurrency, requests):
+        timings, lock = [], threading.Lock()
+        errors = opened = 0
+        start = threading.Barrier(concurrency)
+
+        def count_connections(sender, connection, **kwargs):
+            nonlocal opened
+            if connection.alias == alias:
+                with lock:
+                    opened += 1
+
+        def client():
+            nonlocal errors
+            start.wait()
+            own = []
+            for number in range(requests):
+                started = time.perf_counter()
+                try:
+                    # один запрос страницы: чтение и close() по сигналу request_finished
+                    Post.objects.using(alias).filter(pk=number + 1).exists()
+                except Exception:
+                    with lock:
+                        errors += 1
+                finally:
+                    connections[alias].close()
+                own.append((time.perf_counter() - started) * 1000)
+            with lock:
+                timings.extend(own)
+
+        connection_created.connect(count_connections)
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        connection_created.disconnect(count_connections)
+        return timings, errors, elapsed, opened
@@ -0,0 +1,92 @@
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from posts.followgraph import FollowGraph
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит синтетический граф подписок в памяти (posts.followgraph) и печатает, '
+        'сколько он занимает по сравнению с множеством пар в Python и сколько длятся проверки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, default=10000000, help='Примерное число подписок')
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--lookups', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = options['users']
+
+        started = time.perf_counter()
+        graph = FollowGraph.from_pairs(self.pairs(rng, users, options['edges'] / users))
+        built = time.perf_counter() - started
+        edges = graph.edges
+        self.stdout.write('Подписок: %d, пользователей: %d, построение: %.1f с' % (edges, users, built))
+
+        python_set = self.set_bytes_per_edge(graph) * edges
+        self.stdout.write('%-26s %12s %12s' % ('', 'МБ', 'байт/ребро'))
+        for name, size in (
+            ('подписки (CSR)', graph.following.nbytes),
+            ('подписчики (CSR)', graph.followers.nbytes),
+            ('граф целиком', graph.nbytes),
+            ('set() пар (оценка)', python_set),
+        ):
+            self.stdout.write('%-26s %12.1f %12.1f' % (name, size / 2 ** 20, size / edges))
+
+        lookups = options['lookups']
+        samples = [(rng.randint(1, users), rng.randint(1, users)) for _ in range(lookups)]
+        # половина проверок - существующие подписки
+        for index in range(0, lookups, 2):
+            user = samples[index][0]
+            authors = graph.followees(user)
+            if authors:
+                samples[index] = (user, authors[len(authors) // 2])
+        self.stdout.write('%-26s %12s' % ('операция', 'мкс'))
+        for name, operation in (
+            ('подписан ли', lambda pair: graph.is_following(*pair)),
+            ('число подписчиков', lambda pair: graph.follower_count(pair[1])),
+            ('число подписок', lambda pair: graph.following_count(pair[0])),
+            ('список подписок', lambda pair: graph.followees(pair[0])),
+            ('подписка и отписка', lambda pair: self.toggle(graph, *pair)),
+        ):
+            started = time.perf_counter()
+            for pair in samples:
+                operation(pair)
+            self.stdout.write('%-26s %12.2f' % (name, (time.perf_counter() - started) / len(samples) * 1e6))
+
+    @staticmethod
+    def toggle(graph, user, author):
+        follows = graph.is_following(user, author)
+        graph.set_edge(user, author, not follows)
+        graph.set_edge(user, author, follows)
+
+    @staticmethod
+    def pairs(rng, users, average):
+        """
+        Пары (пользователь, автор) по порядку; число подписок распределено по Парето,
+        как в соцсетях: большинство подписано на немногих, немногие - на тысячи.
+        """
+        for user in range(1, users + 1):
+            # среднее paretovariate(1.5) равно 3
+            degree = min(users, int(rng.paretovariate(1.5) * average / 3))
+            for author in sorted(rng.sample(range(1, users + 1), degree)):
+                yield user, author
+
+    @staticmethod
+    def set_bytes_per_edge(graph, sample=100000):
+        tracemalloc.start()
+        pairs = set()
+        for user in range(graph.following.vertices):
+            for author in graph.following.neighbours(user):
+                pairs.add((user, author))
+            if len(pairs) >= sample:
+                break
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / max(len(pairs), 1)
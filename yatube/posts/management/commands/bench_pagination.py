@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+
+from posts.models import User, Post
+from posts.paginator import CursorPaginator
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку страниц ленты для Paginator (OFFSET + COUNT) '
+        'и CursorPaginator на синтетических данных.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000, help='Сколько постов должно быть в базе')
+        parser.add_argument('--per-page', type=int, default=10)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        self.seed(options['posts'], options['batch_size'])
+        queryset = Post.objects.order_by('-pub_date', '-id')
+        per_page = options['per_page']
+
+        self.stdout.write('%8s %14s %14s' % ('page', 'offset, ms', 'cursor, ms'))
+        for number in options['pages']:
+            offset_paginator = Paginator(queryset, per_page)
+            offset_ms = self.measure(
+                lambda: list(offset_paginator.page(number).object_list),
+                options['repeat'],
+                reset=lambda: offset_paginator.__dict__.pop('count', None),
+            )
+
+            cursor_paginator = CursorPaginator(queryset, per_page)
+            cursor = None
+            if number > 1:
+                # курсор берём заранее: в ленте его приносит ссылка с предыдущей страницы
+                boundary = queryset[(number - 1) * per_page - 1]
+                cursor = cursor_paginator.cursor_for(boundary)
+            cursor_ms = self.measure(
+                lambda: list(cursor_paginator.get_page(cursor)),
+                options['repeat'],
+            )
+            self.stdout.write('%8d %14.2f %14.2f' % (number, offset_ms, cursor_ms))
+
+    def seed(self, total, batch_size):
+        existing = Post.objects.count()
+        if existing >= total:
+            return
+        author, _ = User.objects.get_or_create(username='bench_paginator')
+        self.stdout.write('Создаём %d постов...' % (total - existing))
+        for start in range(existing, total, batch_size):
+            size = min(batch_size, total - start)
+            Post.objects.bulk_create(
+                Post(text='Синтетический пост %d' % (start + i), author=author)
+                for i in range(size)
+            )
+
+    @staticmethod
+    def measure(func, repeat, reset=None):
+        timings = []
+        for _ in range(repeat):
+            if reset is not None:
+                reset()
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
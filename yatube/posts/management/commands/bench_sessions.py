@@ -0,0 +1,84 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import User
+from .loadtest import percentile
+
+MODES = (
+    ('db', 'django.contrib.sessions.backends.db', 'django.contrib.auth.backends.ModelBackend'),
+    ('cached_db', 'django.contrib.sessions.backends.cached_db', 'django.contrib.auth.backends.ModelBackend'),
+    ('yatube', 'yatube.sessions', 'yatube.sessions.CachedModelBackend'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает движки сессий на запросах вошедшего пользователя: сколько SQL-запросов '
+        'уходит на сессию и пользователя и сколько всего, p50/p95 по каждой странице.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на каждую страницу')
+        parser.add_argument('--user', help='Пользователь; по умолчанию - автор с наибольшим числом подписок')
+
+    def handle(self, *args, **options):
+        user = self.pick_user(options['user'])
+        pages = [
+            ('follow_index', reverse('follow_index')),
+            ('new_post', reverse('new_post')),
+            ('profile', reverse('profile', args=[user.username])),
+        ]
+        self.stdout.write('%-10s %-13s %11s %9s %9s %9s' % (
+            'сессии', 'страница', 'сессия+user', 'всего', 'p50, ms', 'p95, ms',
+        ))
+        for name, engine, backend in MODES:
+            with override_settings(SESSION_ENGINE=engine, AUTHENTICATION_BACKENDS=[backend]):
+                client = Client()
+                client.force_login(user)
+                for page, url in pages:
+                    auth, total, timings = self.measure(client, url, options['requests'])
+                    self.stdout.write('%-10s %-13s %11.2f %9.2f %9.2f %9.2f' % (
+                        name, page, auth, total, statistics.median(timings), percentile(timings, 0.95),
+                    ))
+                client.logout()
+
+    @staticmethod
+    def pick_user(username):
+        users = User.objects.filter(is_active=True)
+        if username:
+            users = users.filter(username=username)
+        else:
+            users = users.order_by('-stats__following_count')
+        user = users.first()
+        if user is None:
+            raise CommandError('Пользователь не найден; сначала выполните seed_yatube')
+        return user
+
+    @staticmethod
+    def measure(client, url, requests):
+        """
+        Среднее число запросов к сессиям и пользователям, всего запросов и время каждого запроса.
+        """
+        # первый запрос прогревает кэши страниц, сессии и пользователя
+        client.get(url)
+        auth = total = 0
+        timings = []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError('%s ответил %d' % (url, response.status_code))
+            total += len(queries)
+            auth += sum(
+                1 for query in queries.captured_queries
+                if 'django_session' in query['sql'] or 'FROM "auth_user"' in query['sql']
+            )
+        return auth / requests, total / requests, timings
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import conditional, recommender
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рекомендации «на кого подписаться» по подпискам и комментариям, '
+        'см. posts.recommender. Запускается по расписанию, например раз в час.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Пользователей в одном матричном шаге')
+        parser.add_argument('--per-user', type=int, help='Авторов в списке; по умолчанию RECOMMENDATIONS_PER_USER')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        built = recommender.build(options['batch_size'], options['per_user'])
+        # блок рекомендаций есть на страницах с ETag
+        conditional.bump_content_version()
+        self.stdout.write('Рекомендации для %d пользователей за %.1f с' % (built, time.perf_counter() - started))
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts.models import Post
+from posts.thumbnails import generate
+
+
+class Command(BaseCommand):
+    help = 'Строит недостающие миниатюры картинок постов, например для постов, загруженных до появления пула.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--force', action='store_true', help='Пересобрать миниатюры всех постов с картинками')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'thumbnails')
+        if options['force']:
+            Post.objects.filter(pk__in=posts.values('pk')).update(thumbnails='')
+        pending = [
+            post.pk for post in posts.iterator()
+            if options['force'] or post.thumbnail_names().get('source') != post.image.name
+        ]
+
+        def build(post_id):
+            try:
+                return generate(post_id)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            built = sum(1 for names in pool.map(build, pending) if names)
+        self.stdout.write('Подготовлено миниатюр для постов: %d' % built)
@@ -0,0 +1,111 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from posts.models import User, Post, Group, Comment, Follow, TimelineEntry
+from posts.paginator import CursorPaginator
+from posts.threads import root_paginator, segment, subtree
+from posts.timeline import FollowFeedPaginator
+
+# SQLite: "SCAN posts_post" без USING INDEX - полный проход таблицы;
+# SCAN по индексу вместе с сортировкой во временном B-дереве - тоже полный проход
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(.*)')
+SQLITE_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+POSTGRES_TABLE_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN для запросов каждой ленты (SQLite и PostgreSQL) '
+        'и сообщает о планах с полным проходом таблицы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Алиас базы из DATABASES; по умолчанию все базы',
+        )
+        parser.add_argument('--verbose-plans', action='store_true', help='Печатать планы целиком')
+
+    def handle(self, *args, **options):
+        aliases = options['databases'] or list(settings.DATABASES)
+        problems = 0
+        for alias in aliases:
+            vendor = connections[alias].vendor
+            if vendor not in ('sqlite', 'postgresql'):
+                self.stdout.write('%s: %s не поддерживается, пропускаем' % (alias, vendor))
+                continue
+            self.stdout.write('== %s (%s)' % (alias, vendor))
+            for name, queryset in self.querysets():
+                plan = queryset.using(alias).explain()
+                scans = self.table_scans(vendor, plan)
+                status = 'SCAN ' + ', '.join(scans) if scans else 'ok'
+                self.stdout.write('%-28s %s' % (name, status))
+                if scans or options['verbose_plans']:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+                problems += bool(scans)
+        if problems:
+            raise CommandError('Планов с полным проходом таблицы: %d' % problems)
+
+    @staticmethod
+    def table_scans(vendor, plan):
+        tables = set()
+        for line in plan.splitlines():
+            if vendor == 'postgresql':
+                match = POSTGRES_TABLE_SCAN.search(line)
+                if match:
+                    tables.add(match.group(1))
+                continue
+            match = SQLITE_SCAN.search(line)
+            if match and ('USING' not in match.group(2) or SQLITE_SORT in plan):
+                tables.add(match.group(1))
+        return sorted(tables)
+
+    def querysets(self):
+        """
+        Те же запросы, что выполняют view из posts.views, на первой и следующей странице.
+        Значения параметров берутся из базы, а при пустой базе подставляются заглушки.
+        """
+        post = Post.objects.order_by('-pub_date').first() or Post(id=1, pub_date=timezone.now())
+        user = User(id=post.author_id or 1)
+        group = Group.objects.first() or Group(id=1)
+        comment = (
+            Comment.objects.filter(post=post.id, parent=None).first()
+            or Comment(id=1, post_id=post.id, created=timezone.now(), path=segment(1))
+        )
+        feed = Post.objects.select_related('author', 'group')
+
+        def pages(name, paginator, boundary=post):
+            first = paginator.object_list.order_by(*paginator.ordering)[:paginator.per_page + 1]
+            values = [field.value_from_object(boundary) for field in paginator.fields]
+            following = (
+                paginator.object_list
+                .filter(paginator._seek(values, False))
+                .order_by(*paginator.ordering)[:paginator.per_page + 1]
+            )
+            return [(name, first), (name + ' (cursor)', following)]
+
+        timeline = CursorPaginator(
+            TimelineEntry.objects.filter(user=user).select_related('post__author', 'post__group'),
+            5, ordering=('-pub_date', '-post'),
+        )
+        timeline_values = [post.pub_date, post.id]
+        return [
+            *pages('index', CursorPaginator(feed, 10)),
+            *pages('group_posts', CursorPaginator(feed.filter(group=group), 2)),
+            *pages('profile', CursorPaginator(feed.filter(author=user), 5)),
+            ('post_view', feed.filter(pk=post.id, author=user)),
+            *pages('post_view comments', root_paginator(post, 20), comment),
+            ('post_view replies', Comment.objects.filter(subtree(comment.path), post=post.id)
+                .select_related('author').order_by('path')[:100]),
+            ('following check', Follow.objects.filter(user=user, author=user)),
+            ('followers', Follow.objects.filter(author=user)),
+            ('follow_index', timeline.object_list.order_by(*timeline.ordering)[:6]),
+            ('follow_index (cursor)', timeline.object_list
+                .filter(timeline._seek(timeline_values, False))
+                .order_by(*timeline.ordering)[:6]),
+            ('follow_index on read', FollowFeedPaginator(user, 5).on_read().order_by('-pub_date', '-id')[:6]),
+        ]
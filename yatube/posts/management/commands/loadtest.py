@@ -0,0 +1,135 @@
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from posts.models import User, Post
+
+DEFAULT_MIX = 'index=40,profile=20,post_view=25,follow_index=10,add_comment=5'
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагружает WSGI-приложение внутри процесса смесью запросов index, profile, '
+        'post_view, follow_index и add_comment и печатает p50/p95/p99 и запросы в секунду.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=4, help='Число потоков-клиентов')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='Веса запросов, например "%s"' % DEFAULT_MIX)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--sample', type=int, default=1000, help='Сколько постов и пользователей брать в выборку')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.mix = self.parse_mix(options['mix'])
+        self.posts, self.users = self.load_targets(options['sample'])
+        if not self.posts or not self.users:
+            raise CommandError('В базе нет постов; сначала выполните seed_yatube')
+
+        self.run(options['warmup'], options['concurrency'])
+        timings, errors, elapsed = self.run(options['requests'], options['concurrency'])
+
+        total = sum(len(values) for values in timings.values())
+        self.stdout.write('%-14s %8s %9s %9s %9s' % ('endpoint', 'count', 'p50, ms', 'p95, ms', 'p99, ms'))
+        for name in sorted(timings):
+            self.write_row(name, timings[name])
+        self.write_row('all', [value for values in timings.values() for value in values])
+        self.stdout.write('Запросов в секунду: %.1f, ошибок: %d' % (total / elapsed, errors))
+
+    def write_row(self, name, values):
+        self.stdout.write('%-14s %8d %9.2f %9.2f %9.2f' % (
+            name, len(values),
+            statistics.median(values), percentile(values, 0.95), percentile(values, 0.99),
+        ))
+
+    @staticmethod
+    def parse_mix(mix):
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            if name not in ('index', 'profile', 'post_view', 'follow_index', 'add_comment'):
+                raise CommandError('Неизвестный тип запроса: %s' % name)
+            weights[name] = float(weight or 1)
+        return weights
+
+    def load_targets(self, size):
+        bounds = Post.objects.order_by('id').values_list('id', flat=True)
+        first, last = bounds.first(), bounds.last()
+        if first is None:
+            return [], []
+        ids = [self.random.randint(first, last) for _ in range(size)]
+        posts = list(Post.objects.filter(id__in=ids).values_list('id', 'author__username'))
+        # читатели с подписками, чтобы follow_index был не пустым
+        users = list(User.objects.filter(follower__isnull=False).distinct()[:size])
+        return posts, users or list(User.objects.all()[:size])
+
+    def next_request(self, generator):
+        name = generator.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        post_id, username = generator.choice(self.posts)
+        if name == 'index':
+            return name, 'get', '/', None
+        if name == 'profile':
+            return name, 'get', '/%s/' % username, None
+        if name == 'post_view':
+            return name, 'get', '/%s/%d/' % (username, post_id), None
+        if name == 'follow_index':
+            return name, 'get', '/follow/', None
+        return name, 'post', '/%s/%d/comment' % (username, post_id), {'text': 'Нагрузочный комментарий'}
+
+    def run(self, total, concurrency):
+        timings = defaultdict(list)
+        errors = []
+        counter = iter(range(total))
+        lock = threading.Lock()
+
+        def worker(seed):
+            generator = random.Random(seed)
+            client = Client()
+            client.force_login(generator.choice(self.users))
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                name, method, path, data = self.next_request(generator)
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                duration = (time.perf_counter() - started) * 1000
+                with lock:
+                    timings[name].append(duration)
+                    if response.status_code >= 400:
+                        errors.append((path, response.status_code))
+
+        def threaded_worker(seed):
+            try:
+                worker(seed)
+            finally:
+                # у каждого потока своё соединение с базой
+                connection.close()
+
+        started = time.perf_counter()
+        if concurrency == 1:
+            worker(self.random.random())
+        else:
+            threads = [
+                threading.Thread(target=threaded_worker, args=(self.random.random(),))
+                for _ in range(concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return timings, len(errors), time.perf_counter() - started
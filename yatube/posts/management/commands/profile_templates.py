@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.test import Client
+
+from posts.models import User, Post
+from posts.profiling import profile_request
+
+
+class Command(BaseCommand):
+    help = (
+        'Запрашивает страницы несколько раз и печатает, сколько стоит рендер каждого '
+        'шаблона и каждого {% include %}, а также долю SQL, рендера и разбора шаблонов '
+        'во времени ответа.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Адреса страниц; по умолчанию главная, профиль и пост')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--user', help='Имя пользователя, от которого делать запросы')
+        parser.add_argument('--cold', action='store_true', help='Сбрасывать кэш шаблонов перед каждым запросом')
+        parser.add_argument('--top', type=int, default=10, help='Сколько строк в таблицах')
+
+    def handle(self, *args, **options):
+        client = Client()
+        if options['user']:
+            try:
+                client.force_login(User.objects.get(username=options['user']))
+            except User.DoesNotExist:
+                raise CommandError('Нет пользователя %s' % options['user'])
+        for path in options['paths'] or self.default_paths():
+            self.profile(client, path, options)
+
+    @staticmethod
+    def default_paths():
+        post = Post.objects.select_related('author').order_by('-pub_date').first()
+        if post is None:
+            return ['/']
+        return ['/', '/%s/' % post.author.username, '/%s/%d/' % (post.author.username, post.id)]
+
+    def profile(self, client, path, options):
+        repeat = options['repeat']
+        loaders = engines['django'].engine.template_loaders
+        # первый запрос прогревает кэши и в замер не входит
+        client.get(path)
+        elapsed = 0.0
+        with profile_request() as profile:
+            for _ in range(repeat):
+                if options['cold']:
+                    for loader in loaders:
+                        loader.reset()
+                started = time.perf_counter()
+                response = client.get(path)
+                elapsed += time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError('%s: ответ %d' % (path, response.status_code))
+
+        def ms(seconds):
+            return seconds * 1000 / repeat
+
+        self.stdout.write('\n%s: %.2f ms на запрос' % (path, ms(elapsed)))
+        self.stdout.write('  SQL %.2f ms (%d запросов), рендер %.2f ms, разбор шаблонов %.2f ms (%d), прочее %.2f ms' % (
+            ms(profile.db_time), len(profile.queries) / repeat,
+            ms(profile.template_time), ms(profile.compile_time), len(profile.compiles) / repeat,
+            ms(elapsed - profile.template_time - profile.db_time - profile.compile_time),
+        ))
+        self.stdout.write('  %-32s %8s %10s %10s' % ('шаблон', 'рендеров', 'всего, ms', 'своё, ms'))
+        for row in profile.template_summary()[:options['top']]:
+            self.stdout.write('  %-32s %8d %10.2f %10.2f' % (
+                row['name'], row['count'] / repeat, ms(row['total']), ms(row['self']),
+            ))
+        self.stdout.write('  %-50s %8s %10s' % ('включение', 'раз', 'всего, ms'))
+        for row in profile.include_summary()[:options['top']]:
+            self.stdout.write('  %-50s %8d %10.2f' % (
+                '%s > %s' % (row['parent'], row['name']), row['count'] / repeat, ms(row['total']),
+            ))
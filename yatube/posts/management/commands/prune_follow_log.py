@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from posts import followgraph
+
+
+class Command(BaseCommand):
+    help = 'Удаляет записи журнала подписок старше FOLLOW_GRAPH_LOG_RETENTION, см. posts.followgraph.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Удалено записей: %d' % followgraph.prune())
@@ -0,0 +1,34 @@
+import itertools
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from posts import search
+from posts.models import Post, Comment, Group, SearchDocument
+
+
+class Command(BaseCommand):
+    help = 'Заново индексирует посты, комментарии и группы для полнотекстового поиска.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        documents = itertools.chain(
+            (search.post_document(post) for post in Post.objects.only('id', 'text').iterator()),
+            (search.comment_document(comment) for comment in Comment.objects.only('id', 'post_id', 'text').iterator()),
+            (search.group_document(group) for group in Group.objects.iterator()),
+        )
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            # индекс пуст, поэтому документы можно вставлять пачками без проверки на дубли
+            while True:
+                batch = list(itertools.islice(documents, options['batch_size']))
+                if not batch:
+                    break
+                SearchDocument.objects.bulk_create(batch)
+            if connection.vendor == 'sqlite':
+                # FTS5 перечитывает внешнюю таблицу целиком
+                with connection.cursor() as cursor:
+                    cursor.execute("INSERT INTO posts_search_fts(posts_search_fts) VALUES ('rebuild')")
+        self.stdout.write('Проиндексировано документов: %d' % SearchDocument.objects.count())
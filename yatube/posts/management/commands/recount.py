@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount_users, recount_posts
+from posts.models import User, Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики пользователей и постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Только для этих пользователей и их постов')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        posts = Post.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            posts = posts.filter(author__in=users)
+        recount_users(users)
+        recount_posts(posts)
+        self.stdout.write('Счётчики пересчитаны')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import cards, conditional, pagecache, rendering
+from posts.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново отрисовывает HTML текстов постов и комментариев, см. posts.rendering. '
+        'По умолчанию - только строки, отрисованные старой версией правил.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Перерисовать все тексты, например после смены TEXT_LINKS')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        for model in (Post, Comment):
+            queryset = model.objects.all()
+            if not options['all']:
+                queryset = queryset.exclude(render_version=rendering.VERSION)
+            count = self.rerender(model, queryset.only('id', 'text').order_by('pk'), options['batch_size'])
+            self.stdout.write('%s: перерисовано %d' % (model._meta.verbose_name_plural, count))
+            total += count
+        if total:
+            # страницы с комментариями не кэшируются по версии поста, сбрасываем их ETag
+            conditional.bump_content_version()
+            pagecache.purge_all()
+
+    def rerender(self, model, queryset, batch_size):
+        count, last = 0, 0
+        while True:
+            # по id, а не по смещению: перерисованные строки выпадают из выборки
+            batch = list(queryset.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                return count
+            with transaction.atomic():
+                model.objects.bulk_update(rendering.render_instances(batch), ['text_html', 'render_version'])
+                if model is Post:
+                    # в кэшированных карточках остался старый HTML
+                    cards.invalidate_posts(Post.objects.filter(pk__in=[post.pk for post in batch]))
+            count += len(batch)
+            last = batch[-1].pk
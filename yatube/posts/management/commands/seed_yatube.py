@@ -0,0 +1,133 @@
+import itertools
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from posts.models import User, Post, Group, Comment, Follow
+from posts.threads import fill_paths
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, группами, постами, комментариями '
+        'и подписками через bulk_create пачками. Популярность авторов подчиняется '
+        'степенному закону: на немногих авторов подписана большая часть пользователей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--groups', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--comments', type=int, default=2000000)
+        parser.add_argument('--follows', type=int, default=1000000)
+        parser.add_argument('--alpha', type=float, default=1.1, help='Показатель степенного закона для подписок и постов')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None, help='Зерно генератора для воспроизводимости')
+        parser.add_argument('--prefix', default='seed', help='Префикс имён пользователей и групп')
+        parser.add_argument('--skip-derived', action='store_true', help='Не пересчитывать счётчики, ленты, поисковый индекс, HTML текстов и рекомендации')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+
+        users = self.create_users(prefix, options['users'])
+        groups = self.create_groups(prefix, options['groups'])
+        # популярность авторов: веса 1 / rank^alpha в случайном порядке пользователей
+        popularity = self.power_law(users, options['alpha'])
+        posts = self.create_posts(users, groups, popularity, options['posts'])
+        self.create_comments(users, posts, options['alpha'], options['comments'])
+        self.create_follows(users, popularity, options['follows'])
+
+        if not options['skip_derived']:
+            self.step('Пересчёт счётчиков', lambda: call_command('recount', stdout=self.stdout))
+            self.step('Сборка лент', lambda: call_command('rebuild_timelines', stdout=self.stdout))
+            self.step('Поисковый индекс', lambda: call_command('rebuild_search_index', stdout=self.stdout))
+            self.step('HTML текстов', lambda: call_command('rerender_texts', stdout=self.stdout))
+            self.step('Рекомендации', lambda: call_command('build_recommendations', stdout=self.stdout))
+
+    def step(self, title, func):
+        started = time.perf_counter()
+        result = func()
+        self.stdout.write('%s: %.1f с' % (title, time.perf_counter() - started))
+        return result
+
+    def bulk(self, model, objects, **kwargs):
+        iterator = iter(objects)
+        while True:
+            batch = list(itertools.islice(iterator, self.batch_size))
+            if not batch:
+                break
+            # размер одного INSERT Django подбирает сам под ограничения базы
+            model.objects.bulk_create(batch, **kwargs)
+
+    def power_law(self, items, alpha):
+        ranked = list(items)
+        self.random.shuffle(ranked)
+        weights = [1 / (rank + 1) ** alpha for rank in range(len(ranked))]
+        return ranked, list(itertools.accumulate(weights))
+
+    def sample(self, distribution, k):
+        items, cum_weights = distribution
+        return self.random.choices(items, cum_weights=cum_weights, k=k)
+
+    def create_users(self, prefix, total):
+        password = make_password(prefix)
+        start = User.objects.filter(username__startswith=prefix + '_').count()
+        self.step('Пользователи', lambda: self.bulk(User, (
+            User(username='%s_%d' % (prefix, i), password=password)
+            for i in range(start, start + total)
+        )))
+        return list(User.objects.filter(username__startswith=prefix + '_').values_list('id', flat=True))
+
+    def create_groups(self, prefix, total):
+        start = Group.objects.filter(slug__startswith=prefix + '-').count()
+        self.step('Группы', lambda: self.bulk(Group, (
+            Group(title='Группа %d' % i, slug='%s-%d' % (prefix, i), description='Синтетическая группа')
+            for i in range(start, start + total)
+        )))
+        return list(Group.objects.filter(slug__startswith=prefix + '-').values_list('id', flat=True))
+
+    def create_posts(self, users, groups, popularity, total):
+        def posts():
+            for offset in range(0, total, self.batch_size):
+                size = min(self.batch_size, total - offset)
+                for number, author in enumerate(self.sample(popularity, size), offset):
+                    # примерно у трети постов нет группы
+                    group = self.random.choice(groups) if groups and self.random.random() > 0.3 else None
+                    yield Post(text='Синтетический пост %d' % number, author_id=author, group_id=group)
+        last_id = Post.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.step('Посты', lambda: self.bulk(Post, posts()))
+        return list(Post.objects.filter(id__gt=last_id).values_list('id', flat=True))
+
+    def create_comments(self, users, posts, alpha, total):
+        if not posts:
+            return
+        # обсуждаемость постов тоже неравномерна
+        discussed = self.power_law(posts, alpha)
+
+        def comments():
+            for offset in range(0, total, self.batch_size):
+                size = min(self.batch_size, total - offset)
+                for post in self.sample(discussed, size):
+                    yield Comment(post_id=post, author_id=self.random.choice(users), text='Комментарий')
+        self.step('Комментарии', lambda: self.bulk(Comment, comments()))
+        # bulk_create обходит сигналы, пути веток проставляем одним UPDATE
+        self.step('Пути комментариев', lambda: fill_paths(Comment.objects.all()))
+
+    def create_follows(self, users, popularity, total):
+        def follows():
+            seen = set()
+            attempts = 0
+            while len(seen) < total and attempts < total * 3:
+                size = min(self.batch_size, total - len(seen))
+                attempts += size
+                for author in self.sample(popularity, size):
+                    user = self.random.choice(users)
+                    if user != author and (user, author) not in seen:
+                        seen.add((user, author))
+                        yield Follow(user_id=user, author_id=author)
+        self.step('Подписки', lambda: self.bulk(Follow, follows(), ignore_conflicts=True))
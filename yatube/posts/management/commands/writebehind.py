@@ -0,0 +1,47 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts import writebehind
+
+logger = logging.getLogger('posts.writebehind')
+
+
+class Command(BaseCommand):
+    help = (
+        'Разбирает локальную очередь отложенных подписок, отписок и комментариев '
+        'пачками и печатает метрики очереди: глубину и задержку.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь до конца и выйти')
+        parser.add_argument('--stats', action='store_true', help='Только показать метрики очереди')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза при пустой очереди, с')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.report(writebehind.stats())
+            return
+        while True:
+            applied = writebehind.drain(options['batch_size'])
+            if applied:
+                stats = writebehind.stats()
+                self.report(stats, applied)
+                if stats['lag'] > settings.WRITE_BEHIND_MAX_LAG:
+                    logger.warning('Очередь отстаёт на %.1f с, ждут %d записей', stats['lag'], stats['depth'])
+                continue
+            if options['once']:
+                break
+            # между опросами соединение с базой может устареть, как между запросами
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def report(self, stats, applied=None):
+        line = 'depth=%(depth)d lag=%(lag).2fs applied_id=%(applied)d' % stats
+        if applied is not None:
+            line = 'batch=%d %s' % (applied, line)
+        self.stdout.write(line)
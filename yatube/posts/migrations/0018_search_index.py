@@ -0,0 +1,67 @@
+# Generated by Django 2.2 on 2026-10-17 04:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# документы существующих постов, комментариев и групп строит команда
+# rebuild_search_index: миграция не зависит от текущих правил posts.stemmer
+
+# внешний индекс FTS5 над posts_searchdocument.terms, триггеры держат его в актуальном состоянии
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE posts_search_fts USING fts5("
+    "terms, content='posts_searchdocument', content_rowid='id')",
+    "CREATE TRIGGER posts_search_ai AFTER INSERT ON posts_searchdocument BEGIN "
+    "INSERT INTO posts_search_fts(rowid, terms) VALUES (new.id, new.terms); END",
+    "CREATE TRIGGER posts_search_ad AFTER DELETE ON posts_searchdocument BEGIN "
+    "INSERT INTO posts_search_fts(posts_search_fts, rowid, terms) VALUES ('delete', old.id, old.terms); END",
+    "CREATE TRIGGER posts_search_au AFTER UPDATE ON posts_searchdocument BEGIN "
+    "INSERT INTO posts_search_fts(posts_search_fts, rowid, terms) VALUES ('delete', old.id, old.terms); "
+    "INSERT INTO posts_search_fts(rowid, terms) VALUES (new.id, new.terms); END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS posts_search_ai",
+    "DROP TRIGGER IF EXISTS posts_search_ad",
+    "DROP TRIGGER IF EXISTS posts_search_au",
+    "DROP TABLE IF EXISTS posts_search_fts",
+]
+POSTGRES_INDEX = [
+    "CREATE INDEX posts_search_body_idx ON posts_searchdocument "
+    "USING GIN (to_tsvector('russian', body))",
+]
+POSTGRES_DROP = ["DROP INDEX IF EXISTS posts_search_body_idx"]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Пост'), ('comment', 'Комментарий'), ('group', 'Группа')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('body', models.TextField()),
+                ('terms', models.TextField()),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Group')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Post')),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(
+            run({'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}),
+        ),
+    ]
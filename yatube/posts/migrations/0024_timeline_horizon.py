@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='timeline_horizon',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,13 @@
+import json
+
 from django.db import models
+from django.core.files.storage import default_storage
 from django.contrib.auth import get_user_model
 from django import forms
+from django.utils.safestring import mark_safe
+from django.template.defaultfilters import linebreaksbr
+
+from . import rendering
 
 User = get_user_model()
 
@@ -14,24 +21,107 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class RenderedText(models.Model):
+    """
+    Текст с HTML, отрисованным при сохранении, см. posts.rendering.
+    """
+    text_html = models.TextField(blank=True, default="", editable=False)
+    render_version = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "text" in update_fields:
+            self.text_html = rendering.render(self.text)
+            self.render_version = rendering.VERSION
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"text_html", "render_version"}
+        super().save(*args, **kwargs)
+
+    @property
+    def rendered_text(self):
+        if self.render_version == rendering.VERSION:
+            return mark_safe(self.text_html)
+        # строка ещё не перерисована командой rerender_texts или создана через bulk_create
+        return linebreaksbr(self.text)
+
+
+class Post(RenderedText):
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
     group = models.ForeignKey(Group, blank=True, null=True, on_delete=models.CASCADE, related_name="posts")
     # поле для картинки
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # денормализованный счётчик, обновляется сигналами из posts.counters
+    comment_count = models.PositiveIntegerField(default=0)
+    # версия отрисованной карточки поста, входит в ключ кэша, см. posts.cards
+    version = models.PositiveIntegerField(default=0)
+    # имена готовых миниатюр в JSON: {"source": ..., "card": {"jpeg": ..., "webp": ...}}, см. posts.thumbnails
+    thumbnails = models.TextField(blank=True, default="")
+
+    DENORMALIZED_FIELDS = ("comment_count", "version", "thumbnails")
+
+    class Meta:
+        # индексы под курсорную пагинацию лент: (pub_date, id) в обратном порядке
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"], name="posts_post_feed_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"], name="posts_post_group_feed_idx"),
+            models.Index(fields=["author", "-pub_date", "-id"], name="posts_post_author_feed_idx"),
+        ]
 
     def __str__(self):
         # выводим текст поста
         return self.text
 
+    def save(self, *args, **kwargs):
+        # счётчик, версию и миниатюры меняют только update() из сигналов и пула миниатюр,
+        # поэтому сохранение ранее загруженного поста не должно затирать их старыми значениями
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    def thumbnail_names(self):
+        return json.loads(self.thumbnails) if self.thumbnails else {}
+
+    @property
+    def thumbnail_urls(self):
+        """
+        URL миниатюр текущей картинки по размерам и форматам.
+        Пока пул не подготовил миниатюры, словарь пуст.
+        """
+        names = self.thumbnail_names()
+        if not self.image or names.get("source") != self.image.name:
+            return {}
+        return {
+            size: {fmt: default_storage.url(name) for fmt, name in formats.items()}
+            for size, formats in names.items() if size != "source"
+        }
+
 
-class Comment(models.Model):
+class Comment(RenderedText):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     text = models.TextField()
     created = models.DateTimeField('date_created', auto_now_add=True)
+    # ответ на другой комментарий; ветки хранятся материализованным путём, см. posts.threads
+    parent = models.ForeignKey("self", blank=True, null=True, on_delete=models.CASCADE, related_name="replies")
+    path = models.CharField(max_length=255, blank=True, default="")
+    # число всех ответов в ветке под комментарием
+    reply_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # страницы комментариев верхнего уровня по (created, id)
+            models.Index(fields=["post", "parent", "created", "id"], name="posts_comment_root_idx"),
+            # поддерево: path LIKE 'путь/%'
+            models.Index(fields=["post", "path"], name="posts_comment_path_idx"),
+        ]
 
     def __str__(self):
         # выводим текст поста
@@ -42,14 +132,125 @@ class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "author"], name="posts_follow_unique"),
+        ]
+        indexes = [
+            # подписчики автора; (user, author) уже покрыт уникальным ограничением
+            models.Index(fields=["author", "user"], name="posts_follow_author_idx"),
+        ]
+
     def __str__(self):
         return self.text
 
 
+class UserStats(models.Model):
+    """
+    Денормализованные счётчики пользователя.
+    Обновляются сигналами через F()-выражения, см. posts.counters.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # посты не новее этого момента не хранятся в TimelineEntry пользователя
+    # и читаются при показе ленты, см. posts.timeline
+    timeline_horizon = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.post_count} posts, {self.follower_count} followers"
 
 
+class TimelineEntry(models.Model):
+    """
+    Материализованная лента подписок: строка на каждый пост автора,
+    на которого подписан пользователь, не больше TIMELINE_MAX_ENTRIES самых
+    новых. Заполняется при публикации поста.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    # копия post.pub_date, чтобы лента читалась одним проходом по индексу
+    pub_date = models.DateTimeField()
 
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"], name="posts_timeline_feed_idx"),
+        ]
 
 
+class SearchDocument(models.Model):
+    """
+    Документ полнотекстового индекса: текст поста, комментария или группы.
+    Индексируется FTS5 в SQLite и GIN по to_tsvector('russian', body) в PostgreSQL,
+    см. posts.search.
+    """
+    POST = "post"
+    COMMENT = "comment"
+    GROUP = "group"
+    KINDS = ((POST, "Пост"), (COMMENT, "Комментарий"), (GROUP, "Группа"))
 
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    # пост, который показывается в выдаче для поста и комментария
+    post = models.ForeignKey(Post, blank=True, null=True, on_delete=models.CASCADE, related_name="+")
+    group = models.ForeignKey(Group, blank=True, null=True, on_delete=models.CASCADE, related_name="+")
+    body = models.TextField()
+    # основы слов body для FTS5, см. posts.stemmer
+    terms = models.TextField()
 
+    class Meta:
+        unique_together = ("kind", "object_id")
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+class QueuePosition(models.Model):
+    """
+    Последняя применённая запись локальной очереди отложенной записи.
+    Сдвигается в той же транзакции, что и сама пачка, поэтому после сбоя
+    воркер не применит записи повторно, см. posts.writebehind.
+    """
+    queue = models.CharField(max_length=100, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.queue}: {self.last_id}"
+
+
+class FollowChange(models.Model):
+    """
+    Журнал подписок и отписок, по которому другие процессы догоняют
+    свой граф подписок в памяти, см. posts.followgraph.
+    Пользователи - просто числа: запись переживает удаление пользователя.
+    """
+    user_id = models.IntegerField()
+    author_id = models.IntegerField()
+    follows = models.BooleanField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.author_id}: {self.follows}"
+
+
+class Recommendation(models.Model):
+    """
+    Автор, на которого стоит подписаться. Списки считает пакетно
+    команда build_recommendations, страницы только читают их,
+    см. posts.recommendations.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="recommendations")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ("user", "author")
+        indexes = [
+            models.Index(fields=["user", "-score"], name="posts_recommendation_top_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.author_id}: {self.score:.3f}"
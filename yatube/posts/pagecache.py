@@ -0,0 +1,192 @@
+"""
+Кэш целых страниц для анонимных посетителей.
+
+Страница хранится по пути с параметрами запроса и помечена суррогатными
+ключами того, что на ней показано:
+    posts          - главная лента;
+    post:<id>      - пост (карточка в ленте или страница поста);
+    author:<id>    - профиль автора со счётчиками;
+    group:<slug>   - лента группы;
+    *              - любая страница.
+Ключи отдаются в заголовке Surrogate-Key, чтобы их понимал и кэш перед
+сайтом (Fastly, Varnish с xkey), а Surrogate-Control разрешает ему хранить
+страницу, тогда как браузер по Cache-Control всё равно её перепроверяет.
+
+У каждого ключа в кэше есть версия; страница запоминает версии своих
+ключей и при чтении сверяет их. Версия берётся в момент, когда view ставит
+ключ, - до чтения данных, которые он покрывает: сброс, пришедший, пока
+страница собирается, сделает её устаревшей сразу, а не потеряется. Сброс ключа - увеличение версии, поэтому
+он не ищет и не удаляет сами страницы. Сигналы сохранения и удаления
+постов, комментариев и подписок сбрасывают ключи затронутых страниц,
+см. posts.signals; снаружи ключи сбрасывает POST на cache/purge/.
+
+Версии живут в кэше, поэтому, как и ETag (posts.conditional), кэш страниц
+по умолчанию включён только с общим для всех воркеров кэшем (CACHE_URL).
+"""
+import hashlib
+import hmac
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+PAGE_PREFIX = 'page:'
+KEY_PREFIX = 'page_key:'
+HEADER = 'Surrogate-Key'
+
+FEED = 'posts'
+ALL = '*'
+
+
+def post_key(post_id):
+    return 'post:%d' % post_id
+
+
+def author_key(user_id):
+    return 'author:%d' % user_id
+
+
+def group_key(slug):
+    return 'group:%s' % slug
+
+
+def post_keys(posts):
+    return [post_key(post.pk) for post in posts]
+
+
+def tag(request, *keys):
+    """
+    Помечает страницу запроса суррогатными ключами. Если страница попадёт
+    в кэш, версии новых ключей запоминаются сразу же.
+    """
+    tagged = getattr(request, 'surrogate_keys', set())
+    added = set(keys) - tagged
+    request.surrogate_keys = tagged | added
+    snapshot = getattr(request, 'surrogate_versions', None)
+    if snapshot is not None and added:
+        snapshot.update(versions(added))
+
+
+def page_key(request):
+    return PAGE_PREFIX + hashlib.sha1(request.get_full_path().encode()).hexdigest()
+
+
+def version_key(key):
+    return KEY_PREFIX + key
+
+
+def versions(keys):
+    """
+    Текущие версии ключей; ключу без версии она назначается.
+    """
+    names = {version_key(key): key for key in keys}
+    found = cache.get_many(names)
+    for name in names.keys() - found.keys():
+        # как и версия контента в posts.conditional, начинается с текущего времени
+        # в миллисекундах: после вытеснения из кэша она не совпадёт со старой
+        cache.add(name, int(time.time() * 1000), None)
+    if len(found) < len(names):
+        found = cache.get_many(names)
+    return {names[name]: version for name, version in found.items()}
+
+
+def _purge(keys):
+    for key in keys:
+        try:
+            cache.incr(version_key(key))
+        except ValueError:
+            # версии нет - значит, и страниц, которые её запомнили, не осталось
+            pass
+
+
+def purge(*keys):
+    _purge(keys)
+    # страница, собранная параллельным запросом до коммита, не должна пережить правку
+    transaction.on_commit(lambda: _purge(keys))
+
+
+def purge_all():
+    purge(ALL)
+
+
+def cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        # Set-Cookie и CSRF-токен в форме принадлежат одному посетителю
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def cached_response(request, entry):
+    response = HttpResponse(entry['content'])
+    for name, value in entry['headers']:
+        response[name] = value
+    response = get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
+    response['X-Page-Cache'] = 'HIT'
+    return response
+
+
+def page_cache(view):
+    """
+    Декоратор view: анонимный GET отдаётся из кэша, пока не сброшен ни один
+    из ключей страницы. View помечает страницу ключами через tag() до того,
+    как прочитать покрытые ими данные.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.PAGE_CACHE or request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            current = cache.get_many([version_key(name) for name in entry['versions']])
+            if all(current.get(version_key(name)) == version for name, version in entry['versions'].items()):
+                return cached_response(request, entry)
+        request.surrogate_versions = {}
+        tag(request, ALL)
+        response = view(request, *args, **kwargs)
+        response[HEADER] = ' '.join(sorted(request.surrogate_keys))
+        if cacheable(request, response):
+            response['Surrogate-Control'] = 'max-age=%d' % settings.PAGE_CACHE_TIMEOUT
+            cache.set(key, {
+                'content': response.content,
+                'headers': list(response.items()),
+                'versions': request.surrogate_versions,
+            }, settings.PAGE_CACHE_TIMEOUT)
+        response['X-Page-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+@csrf_exempt
+@require_POST
+def purge_view(request):
+    """
+    Сброс ключей для кэша перед сайтом и скриптов выкладки:
+        curl -X POST -H 'X-Purge-Token: ...' -H 'Surrogate-Key: post:1 author:2' /cache/purge/
+    Ключи - в заголовке Surrogate-Key или в поле keys через пробел.
+    Без PAGE_CACHE_PURGE_TOKEN сбрасывать может только персонал.
+    """
+    token = settings.PAGE_CACHE_PURGE_TOKEN
+    given = request.META.get('HTTP_X_PURGE_TOKEN', '')
+    if not (token and hmac.compare_digest(given, token)) and not request.user.is_staff:
+        return JsonResponse({'error': 'Нет прав на сброс кэша'}, status=403, json_dumps_params={'ensure_ascii': False})
+    keys = (request.META.get('HTTP_SURROGATE_KEY') or request.POST.get('keys', '')).split()
+    if not keys:
+        return JsonResponse({'error': 'Не указаны ключи'}, status=400, json_dumps_params={'ensure_ascii': False})
+    _purge(keys)
+    return JsonResponse({'purged': keys})
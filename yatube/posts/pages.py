@@ -0,0 +1,132 @@
+"""
+Данные страниц для чтения, общие для обычных view (posts.views) и
+асинхронных (posts.async_views).
+
+Запросы, которые не зависят друг от друга (автор и страница его постов,
+пост и страница комментариев), - отдельные функции: асинхронная view
+выполняет их одновременно, обычная - по очереди. Остальное - подсчёты,
+подписка, карточки и сам контекст шаблона - собирают функции *_context.
+
+Ключ кэша страниц (posts.pagecache), известный до чтения данных,
+ставится раньше, чем они прочитаны: версия ключа запоминается в момент
+tag(), и сброс, пришедший во время сборки страницы, её не пропустит.
+"""
+from django.shortcuts import get_object_or_404
+
+from . import followgraph, recommendations
+from .cards import prefetch_cards
+from .counters import stats_for
+from .forms import CommentForm
+from .models import User, Post, Group
+from .pagecache import FEED, author_key, group_key, post_key, post_keys, tag
+from .paginator import CursorPaginator
+from .threads import attach_replies, root_paginator
+from .timeline import FollowFeedPaginator
+
+
+def posts(**filters):
+    return Post.objects.filter(**filters).select_related('author', 'group').order_by('-pub_date').all()
+
+
+def get_group(slug):
+    return get_object_or_404(Group, slug=slug)
+
+
+def get_profile(request, username):
+    # счётчики хранятся в UserStats и обновляются сигналами, см. posts.counters
+    profile = get_object_or_404(User.objects.select_related('stats'), username=username)
+    # id автора становится известен только вместе с ним самим
+    tag(request, author_key(profile.pk))
+    return profile
+
+
+def get_post(username, post_id):
+    return get_object_or_404(Post.objects.select_related('author', 'group'), pk=post_id, author__username=username)
+
+
+def index_paginator(request):
+    tag(request, FEED)
+    return CursorPaginator(posts(), 10)  # показывать по 10 записей на странице.
+
+
+def index_context(request, paginator, page):
+    prefetch_cards(page)  # карточки постов одним запросом к кэшу
+    tag(request, *post_keys(page))
+    return {'page': page, 'paginator': paginator}
+
+
+def group_paginator(request, slug):
+    tag(request, group_key(slug))
+    return CursorPaginator(posts(group__slug=slug), 2)  # показывать по 2 записи на странице.
+
+
+def group_context(request, group, paginator, page):
+    prefetch_cards(page)
+    tag(request, *post_keys(page))
+    return {
+        'posts': paginator.object_list,
+        'group': group,
+        'page': page,
+        'paginator': paginator,
+    }
+
+
+def profile_paginator(username):
+    return CursorPaginator(posts(author__username=username), 5)  # показывать по 5 записей на странице.
+
+
+def profile_context(request, profile, paginator, page):
+    stats = stats_for(profile)
+    prefetch_cards(page)
+    tag(request, *post_keys(page))
+    return {
+        'post_list': paginator.object_list,
+        'count_post': stats.post_count,
+        'profile': profile,
+        'stats': stats,
+        'page': page,
+        'paginator': paginator,
+        'followers': stats.follower_count,
+        'follows': stats.following_count,
+        'following': followgraph.is_following(request.user.id, profile.id),
+        # готовый список из таблицы, см. posts.recommendations
+        'recommendations': recommendations.for_user(request.user, exclude=profile),
+    }
+
+
+def comments_paginator(request, post_id):
+    tag(request, post_key(post_id))
+    # комментарии верхнего уровня страницами по (created, id), ответы к ним - одним запросом
+    return root_paginator(post_id)
+
+
+def post_context(request, profile, post, paginator, page, form=None):
+    stats = stats_for(profile)
+    if form is None:
+        form = CommentForm(request.POST or None, initial={'parent': request.GET.get('reply_to')})
+    return {
+        'profile': profile,
+        'stats': stats,
+        'post': post,
+        'items': attach_replies(page),
+        'page': page,
+        'paginator': paginator,
+        'form': form,
+        'followers': stats.follower_count,
+        'follows': stats.following_count,
+        'following': followgraph.is_following(request.user.id, profile.id),
+    }
+
+
+def follow_paginator(request):
+    # лента читается из материализованной таблицы TimelineEntry, см. posts.timeline
+    return FollowFeedPaginator(request.user, 5)
+
+
+def follow_context(request, paginator, page):
+    prefetch_cards(page)
+    return {
+        'page': page,
+        'paginator': paginator,
+        'recommendations': recommendations.for_user(request.user),
+    }
@@ -0,0 +1,146 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    """
+    Страница курсорной пагинации.
+    Повторяет интерфейс django.core.paginator.Page, который нужен шаблонам,
+    но вместо номеров страниц отдаёт непрозрачные курсоры.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of %s items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Пагинация по ключу (keyset) вместо OFFSET.
+    Каждая страница - это один запрос вида
+    WHERE (pub_date, id) < (:pub_date, :id) ORDER BY pub_date DESC, id DESC LIMIT n + 1,
+    поэтому глубокие страницы стоят столько же, сколько первая, и COUNT(*) не нужен.
+    Последнее поле в ordering должно быть уникальным (обычно id).
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [
+            object_list.model._meta.get_field(name.lstrip('-'))
+            for name in self.ordering
+        ]
+
+    def get_page(self, cursor=None):
+        """
+        Возвращает страницу по курсору; битый или пустой курсор даёт первую страницу.
+        """
+        try:
+            values, backwards = self.decode_cursor(cursor)
+        except InvalidCursor:
+            values, backwards = None, False
+
+        items = self._fetch(values, backwards, self.per_page + 1)
+
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backwards:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+        if items and has_next:
+            next_cursor = self.cursor_for(items[-1])
+        if items and has_previous:
+            previous_cursor = self.cursor_for(items[0], backwards=True)
+        return CursorPage(items, self, next_cursor, previous_cursor)
+
+    def cursor_for(self, obj, backwards=False):
+        """
+        Курсор, указывающий на записи после obj (или до него, если backwards=True).
+        """
+        payload = {
+            'v': [field.value_to_string(obj) for field in self.fields],
+            'b': 1 if backwards else 0,
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            payload = json.loads(raw.decode())
+            values = [
+                field.to_python(value)
+                for field, value in zip(self.fields, payload['v'])
+            ]
+        except (ValueError, TypeError, KeyError, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+        if len(values) != len(self.fields) or None in values:
+            raise InvalidCursor(cursor)
+        return values, bool(payload.get('b'))
+
+    def _fetch(self, values, backwards, limit):
+        """
+        Выбирает до limit записей после (или до) ключа values в порядке обхода.
+        """
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+        return list(queryset.order_by(*self._ordering(backwards))[:limit])
+
+    def _ordering(self, backwards, ordering=None):
+        ordering = ordering or self.ordering
+        if not backwards:
+            return tuple(ordering)
+        return tuple(
+            name[1:] if name.startswith('-') else '-' + name
+            for name in ordering
+        )
+
+    def _seek(self, values, backwards, ordering=None):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering or self.ordering, values):
+            descending = name.startswith('-')
+            field = name.lstrip('-')
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= equal & Q(**{'%s__%s' % (field, lookup): value})
+            equal &= Q(**{field: value})
+        return condition
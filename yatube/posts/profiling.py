@@ -0,0 +1,283 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.template.loader_tags import IncludeNode
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# IN (%s, %s, %s) и IN (1, 2, 3) считаем одной формой запроса
+_IN_LIST = re.compile(r'\bIN \((?:[^()]*)\)', re.IGNORECASE)
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+def query_budget(limit):
+    """
+    Декоратор view-функции: объявляет, сколько SQL-запросов ей разрешено.
+    Бюджет проверяют QueryProfilerMiddleware и QueryBudgetMixin в тестах.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def query_shape(sql):
+    return _NUMBER.sub('?', _IN_LIST.sub('IN (...)', sql))
+
+
+class RequestProfile:
+    """
+    Что было потрачено на один запрос: SQL-запросы, время рендера шаблонов
+    и время разбора шаблонов, которых ещё не было в кэше загрузчика.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.templates = []
+        self.compiles = []
+        self._stack = []
+        # шаблон, в котором стоит выполняемый {% include %}
+        self._include_origin = None
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    @property
+    def template_time(self):
+        # время только шаблонов верхнего уровня, вложенные include уже входят в него
+        return sum(item['total'] for item in self.templates if item['depth'] == 0)
+
+    @property
+    def compile_time(self):
+        return sum(duration for _, duration in self.compiles)
+
+    def duplicates(self):
+        shapes = Counter(query_shape(sql) for sql, _ in self.queries)
+        return [
+            {'sql': shape, 'count': count}
+            for shape, count in shapes.most_common() if count > 1
+        ]
+
+    def template_summary(self):
+        """
+        Время по каждому шаблону: число рендеров, полное и собственное время (без вложенных).
+        """
+        summary = {}
+        for item in self.templates:
+            row = summary.setdefault(item['name'], {'name': item['name'], 'count': 0, 'total': 0.0, 'self': 0.0})
+            row['count'] += 1
+            row['total'] += item['total']
+            row['self'] += item['self']
+        return sorted(summary.values(), key=lambda row: row['self'], reverse=True)
+
+    def include_summary(self):
+        """
+        То же по вложениям: какой шаблон что включает и сколько это стоит.
+        """
+        summary = {}
+        for item in self.templates:
+            if item['parent'] is None:
+                continue
+            key = (item['parent'], item['name'])
+            row = summary.setdefault(key, {'parent': key[0], 'name': key[1], 'count': 0, 'total': 0.0})
+            row['count'] += 1
+            row['total'] += item['total']
+        return sorted(summary.values(), key=lambda row: row['total'], reverse=True)
+
+
+def active_profile():
+    return getattr(_local, 'profile', None)
+
+
+def _instrumented_render(original):
+    def _render(self, context):
+        profile = active_profile()
+        if profile is None:
+            return original(self, context)
+        # блоки дочернего шаблона рендерятся внутри base.html, поэтому включение
+        # относим к шаблону, где написан {% include %}, а не к вершине стека
+        parent = profile._include_origin or (profile._stack[-1]['name'] if profile._stack else None)
+        profile._include_origin = None
+        item = {
+            'name': self.name or '<string>',
+            'parent': parent,
+            'depth': len(profile._stack),
+            'self': 0.0,
+        }
+        profile._stack.append(item)
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            item['total'] = time.perf_counter() - started
+            profile._stack.pop()
+            item['self'] += item['total']
+            if profile._stack:
+                profile._stack[-1]['self'] -= item['total']
+            profile.templates.append(item)
+    _render.profiled = True
+    return _render
+
+
+def _instrumented_include(original):
+    def render(self, context):
+        profile = active_profile()
+        if profile is not None:
+            profile._include_origin = self.origin.template_name
+        return original(self, context)
+    render.profiled = True
+    return render
+
+
+def _instrumented_compile(original):
+    def compile_nodelist(self):
+        profile = active_profile()
+        if profile is None:
+            return original(self)
+        started = time.perf_counter()
+        try:
+            return original(self)
+        finally:
+            profile.compiles.append((self.name or '<string>', time.perf_counter() - started))
+    compile_nodelist.profiled = True
+    return compile_nodelist
+
+
+def install_template_hook():
+    """
+    Оборачивает Template._render так же, как это делает django.test.utils,
+    разбор шаблона (Template.compile_nodelist) и {% include %}.
+    Без активного профиля обёртки сразу вызывают исходные методы.
+    """
+    if not getattr(Template._render, 'profiled', False):
+        Template._render = _instrumented_render(Template._render)
+    if not getattr(Template.compile_nodelist, 'profiled', False):
+        Template.compile_nodelist = _instrumented_compile(Template.compile_nodelist)
+    if not getattr(IncludeNode.render, 'profiled', False):
+        IncludeNode.render = _instrumented_include(IncludeNode.render)
+
+
+class profile_request:
+    """
+    Контекстный менеджер: собирает RequestProfile для всего, что выполнено внутри.
+    """
+
+    def __enter__(self):
+        install_template_hook()
+        self.profile = RequestProfile()
+        self._previous = active_profile()
+        _local.profile = self.profile
+        self._wrappers = ExitStack()
+        for connection in connections.all():
+            self._wrappers.enter_context(connection.execute_wrapper(self.profile.record_query))
+        return self.profile
+
+    def __exit__(self, *exc_info):
+        self._wrappers.close()
+        _local.profile = self._previous
+        if self._previous is not None:
+            # SQL внешний профиль видит через свою обёртку, а шаблоны - только так
+            self._previous.templates.extend(self.profile.templates)
+            self._previous.compiles.extend(self.profile.compiles)
+
+
+class QueryProfilerMiddleware:
+    """
+    Включается настройкой QUERY_PROFILER. Для каждого запроса считает SQL-запросы,
+    время в БД, повторяющиеся формы запросов и время рендера шаблонов,
+    отдаёт их в заголовке Server-Timing и пишет строкой JSON в лог posts.profiling.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILER', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_hook()
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with profile_request() as profile:
+            response = self.get_response(request)
+            # ленивые TemplateResponse рендерятся здесь и тоже попадают в профиль
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+        total = time.perf_counter() - started
+
+        view = getattr(request, 'profiled_view', None)
+        budget = getattr(view, 'query_budget', None)
+        record = {
+            'view': getattr(view, '__module__', '') + '.' + getattr(view, '__name__', '') if view else None,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': len(profile.queries),
+            'budget': budget,
+            'db_ms': round(profile.db_time * 1000, 2),
+            'template_ms': round(profile.template_time * 1000, 2),
+            'compile_ms': round(profile.compile_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'duplicates': profile.duplicates(),
+            # самые дорогие шаблоны по собственному времени, без вложенных
+            'templates': [
+                {'name': row['name'], 'count': row['count'], 'self_ms': round(row['self'] * 1000, 2)}
+                for row in profile.template_summary()[:5]
+            ],
+        }
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.2f;desc="%d queries"' % (profile.db_time * 1000, len(profile.queries)),
+            'tpl;dur=%.2f' % (profile.template_time * 1000),
+            'tplc;dur=%.2f;desc="%d compiled"' % (profile.compile_time * 1000, len(profile.compiles)),
+            'total;dur=%.2f' % (total * 1000),
+        ])
+        if budget is not None and len(profile.queries) > budget:
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(record, ensure_ascii=False))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profiled_view = view_func
+
+
+class QueryBudgetMixin:
+    """
+    Примесь к TestCase: assertQueryBudget(url) падает, если view по этому адресу
+    сделала больше запросов, чем объявлено в @query_budget.
+    """
+
+    def assertQueryBudget(self, path, data=None, client=None):
+        view = resolve(path).func
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            self.fail('У view %s не объявлен @query_budget' % view.__name__)
+        client = client or self.client
+        # с репликами чтения уходят не в default, поэтому считаем по всем базам
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+            response = client.get(path, data or {})
+        queries = [query for context in captured for query in context.captured_queries]
+        if len(queries) > budget:
+            shapes = Counter(query_shape(query['sql']) for query in queries)
+            details = '\n'.join('%3d x %s' % (count, sql) for sql, count in shapes.most_common())
+            self.fail('%s: %d SQL-запросов при бюджете %d\n%s' % (path, len(queries), budget, details))
+        return response
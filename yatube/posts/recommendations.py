@@ -0,0 +1,47 @@
+"""
+Рекомендации «на кого подписаться».
+
+Списки лучших авторов для каждого пользователя считает пакетно команда
+build_recommendations (posts.recommender, NumPy/SciPy) и хранит в таблице
+Recommendation. Страницы только читают готовый список одним запросом по
+индексу (user, -score) - ничего не считают во время запроса. Подписка
+убирает автора из списка сразу, не дожидаясь следующего пересчёта.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import Recommendation
+
+
+def for_user(user, exclude=None, limit=None):
+    """
+    Лучшие рекомендации пользователю; exclude - автор, чья страница открыта.
+    """
+    if not user.is_authenticated:
+        return []
+    recommendations = Recommendation.objects.filter(user=user).select_related('author').order_by('-score', 'author')
+    if exclude is not None:
+        recommendations = recommendations.exclude(author=exclude)
+    return list(recommendations[:limit or settings.RECOMMENDATIONS_SHOWN])
+
+
+def store(lists, after, last):
+    """
+    Заменяет списки пользователей с id от after (не включая) до last;
+    lists - {пользователь: [(автор, оценка), ...]}, у кого в lists
+    ничего нет, тот список теряет.
+    """
+    with transaction.atomic():
+        Recommendation.objects.filter(user__gt=after, user__lte=last).delete()
+        Recommendation.objects.bulk_create(
+            Recommendation(user_id=user_id, author_id=author_id, score=score)
+            for user_id, authors in lists.items()
+            for author_id, score in authors
+        )
+
+
+def followed(user_id, author_id):
+    """
+    Вызывается сигналом подписки.
+    """
+    Recommendation.objects.filter(user=user_id, author=author_id).delete()
@@ -0,0 +1,80 @@
+"""
+HTML текстов постов и комментариев, отрисованный один раз при сохранении.
+
+Текст экранируется, переносы строк становятся <br> (как у фильтра
+linebreaksbr), а при TEXT_LINKS упоминания @username и #slug групп -
+ссылками на профиль и группу. Ссылку получают только существующие
+пользователи и группы, поэтому упоминание появившегося позже пользователя
+станет ссылкой после повторной отрисовки.
+
+Готовый HTML хранится в text_html вместе с номером VERSION. Когда правила
+меняются, VERSION увеличивается, а старые строки перерисовывает команда
+rerender_texts; до этого шаблоны показывают их через linebreaksbr.
+"""
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils.html import escape, format_html
+from django.utils.text import normalize_newlines
+
+VERSION = 1
+
+# ищутся в уже экранированном тексте: & перед # - это сущность вроде &#39;
+MENTION_RE = re.compile(r'(?<![\w@/])@([\w.+-]*\w)')
+GROUP_RE = re.compile(r'(?<![\w&#/])#([-\w]+)')
+
+
+def render_many(texts):
+    """
+    HTML для нескольких текстов; пользователи и группы из всех текстов
+    ищутся двумя запросами на всю пачку.
+    """
+    escaped = [escape(normalize_newlines(text)) for text in texts]
+    if settings.TEXT_LINKS:
+        names, slugs = set(), set()
+        for text in escaped:
+            names.update(MENTION_RE.findall(text))
+            slugs.update(GROUP_RE.findall(text))
+        users = set(
+            get_user_model().objects.filter(username__in=names).values_list('username', flat=True)
+        ) if names else set()
+        groups = set(
+            apps.get_model('posts', 'Group').objects.filter(slug__in=slugs).values_list('slug', flat=True)
+        ) if slugs else set()
+        escaped = [linkify(text, users, groups) for text in escaped]
+    return [text.replace('\n', '<br>') for text in escaped]
+
+
+def linkify(text, users, groups):
+    def mention(match):
+        name = match.group(1)
+        if name not in users:
+            return match.group(0)
+        return format_html('<a href="{}">@{}</a>', reverse('profile', args=[name]), name)
+
+    def group(match):
+        slug = match.group(1)
+        if slug not in groups:
+            return match.group(0)
+        return format_html('<a href="{}">#{}</a>', reverse('group_posts', args=[slug]), slug)
+
+    return GROUP_RE.sub(group, MENTION_RE.sub(mention, text))
+
+
+def render(text):
+    return render_many([text])[0]
+
+
+def render_instances(instances):
+    """
+    Заполняет text_html и render_version объектов, которые сохраняются
+    в обход save(): bulk_create и bulk_update.
+    """
+    instances = list(instances)
+    for instance, html in zip(instances, render_many([instance.text for instance in instances])):
+        instance.text_html = html
+        instance.render_version = VERSION
+    return instances
@@ -0,0 +1,115 @@
+"""
+Полнотекстовый поиск по постам, комментариям и группам.
+
+Каждый объект отражается строкой SearchDocument. В SQLite над ней построен
+внешний индекс FTS5 (основы слов считает posts.stemmer), в PostgreSQL - GIN
+по to_tsvector('russian', body) со встроенным русским стеммером.
+Индекс обновляется сигналами при сохранении и удалении, см. posts.signals.
+"""
+from django.db import connection, models
+
+from .models import SearchDocument
+from .paginator import CursorPaginator
+from .stemmer import terms
+
+# rank: чем меньше, тем релевантнее (bm25 в SQLite отрицательный, ts_rank берём со знаком минус)
+SQLITE_SEARCH = """
+    SELECT id, rank FROM (
+        SELECT rowid AS id, bm25(posts_search_fts) AS rank
+        FROM posts_search_fts WHERE posts_search_fts MATCH %s
+    ) AS hits
+"""
+POSTGRES_SEARCH = """
+    SELECT id, rank FROM (
+        SELECT id, -ts_rank(to_tsvector('russian', body), query)::float8 AS rank
+        FROM posts_searchdocument, plainto_tsquery('russian', %s) AS query
+        WHERE to_tsvector('russian', body) @@ query
+    ) AS hits
+"""
+
+
+def _document(kind, object_id, body, **links):
+    return SearchDocument(kind=kind, object_id=object_id, body=body, terms=terms(body), **links)
+
+
+def post_document(post):
+    return _document(SearchDocument.POST, post.pk, post.text, post_id=post.pk)
+
+
+def comment_document(comment):
+    return _document(SearchDocument.COMMENT, comment.pk, comment.text, post_id=comment.post_id)
+
+
+def group_document(group):
+    return _document(SearchDocument.GROUP, group.pk, '%s\n%s' % (group.title, group.description), group_id=group.pk)
+
+
+def _save(document):
+    values = {name: getattr(document, name) for name in ('body', 'terms', 'post_id', 'group_id')}
+    if not SearchDocument.objects.filter(kind=document.kind, object_id=document.object_id).update(**values):
+        document.save()
+
+
+def index_post(post):
+    _save(post_document(post))
+
+
+def index_comment(comment):
+    _save(comment_document(comment))
+
+
+def index_group(group):
+    _save(group_document(group))
+
+
+def unindex(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def _field(name, field):
+    field.set_attributes_from_name(name)
+    return field
+
+
+class SearchPaginator(CursorPaginator):
+    """
+    Курсорная пагинация выдачи по ключу (rank, id).
+    Возвращает SearchDocument с атрибутом rank и подгруженными post, author и group.
+    """
+
+    def __init__(self, query, per_page):
+        self.query = query
+        self.per_page = int(per_page)
+        self.ordering = ('rank', 'id')
+        self.fields = [_field('rank', models.FloatField()), _field('id', models.IntegerField())]
+
+    def _fetch(self, values, backwards, limit):
+        if connection.vendor == 'postgresql':
+            sql, query = POSTGRES_SEARCH, self.query
+        else:
+            sql, query = SQLITE_SEARCH, ' '.join('"%s"' % term for term in terms(self.query).split())
+        if not query:
+            return []
+        params = [query]
+        if values is not None:
+            lookup = '<' if backwards else '>'
+            sql += ' WHERE rank %s %%s OR (rank = %%s AND id %s %%s)' % (lookup, lookup)
+            params += [values[0], values[0], values[1]]
+        direction = 'DESC' if backwards else 'ASC'
+        sql += ' ORDER BY rank %s, id %s LIMIT %%s' % (direction, direction)
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ranks = cursor.fetchall()
+
+        documents = (
+            SearchDocument.objects
+            .select_related('post__author', 'post__group', 'group')
+            .in_bulk([pk for pk, _ in ranks])
+        )
+        items = []
+        for pk, rank in ranks:
+            if pk in documents:
+                documents[pk].rank = rank
+                items.append(documents[pk])
+        return items
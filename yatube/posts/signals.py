@@ -0,0 +1,129 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import (
+    cards, conditional, counters, events, followgraph, pagecache, recommendations, search, threads, thumbnails, timeline,
+)
+from .models import User, Post, Group, Comment, Follow, SearchDocument, UserStats
+from yatube import sessions
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+    elif not created and update_fields != frozenset(['last_login']):
+        # имя автора выводится на карточках его постов
+        cards.invalidate_posts(Post.objects.filter(author=instance))
+        pagecache.purge_all()
+    if not created:
+        # пользователь запроса кэшируется бэкендом yatube.sessions.CachedModelBackend
+        sessions.forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    sessions.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    if not created:
+        cards.invalidate_posts(Post.objects.filter(group=instance))
+        # название группы выводится на карточках во всех лентах
+        pagecache.purge_all()
+    if not raw:
+        search.index_group(instance)
+
+
+def post_page_keys(post, load_group=True):
+    keys = [pagecache.FEED, pagecache.post_key(post.pk), pagecache.author_key(post.author_id)]
+    if post.group_id and (load_group or Post.group.is_cached(post)):
+        keys.append(pagecache.group_key(post.group.slug))
+    return keys
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    pagecache.purge(*post_page_keys(instance))
+    if created:
+        counters.bump_user(instance.author_id, post_count=1)
+        timeline.fan_out_post(instance)
+    else:
+        cards.invalidate_post(instance.pk)
+    if not raw:
+        search.index_post(instance)
+    # картинку добавили, заменили или убрали: миниатюры пересоберёт пул
+    source = instance.image.name if instance.image else ''
+    if not raw and instance.thumbnail_names().get('source', '') != source:
+        thumbnails.schedule(instance.pk)
+    if created and not raw:
+        # последним: вне транзакции событие уходит сразу
+        events.publish_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    # при каскадном удалении группа не загружена; страницы группы с этим постом
+    # и так помечены post:<id>, а лишний запрос на каждый пост не нужен
+    pagecache.purge(*post_page_keys(instance, load_group=False))
+    counters.bump_user(instance.author_id, post_count=-1)
+    thumbnails.delete_files(instance.thumbnail_names())
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    # комментарии видны на странице поста, их число - на карточке в лентах
+    pagecache.purge(pagecache.post_key(instance.post_id))
+    if created:
+        threads.assign_path(instance)
+        counters.bump_post(instance.post_id, 1)
+        counters.bump_user(instance.author_id, comment_count=1)
+    if not raw:
+        search.index_comment(instance)
+    if created and not raw:
+        events.publish_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    pagecache.purge(pagecache.post_key(instance.post_id))
+    counters.bump_post(instance.post_id, -1)
+    counters.bump_user(instance.author_id, comment_count=-1)
+    threads.bump_replies(instance.path, -1)
+    # документы постов и групп удаляются каскадом по внешним ключам
+    search.unindex(SearchDocument.COMMENT, instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    # счётчики подписчиков и подписок в профилях обоих
+    pagecache.purge(pagecache.author_key(instance.author_id), pagecache.author_key(instance.user_id))
+    if created:
+        counters.bump_user(instance.author_id, follower_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+        # посты автора дописываются в ленту после коммита, не задерживая ответ
+        timeline.schedule(timeline.add_author, instance.user_id, instance.author_id)
+        followgraph.record(instance.user_id, instance.author_id, True)
+        recommendations.followed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    pagecache.purge(pagecache.author_key(instance.author_id), pagecache.author_key(instance.user_id))
+    counters.bump_user(instance.author_id, follower_count=-1)
+    counters.bump_user(instance.user_id, following_count=-1)
+    timeline.remove_author(instance.user_id, instance.author_id)
+    timeline.follower_removed(instance.author_id)
+    followgraph.record(instance.user_id, instance.author_id, False)
+
+
+def content_changed(sender, update_fields=None, **kwargs):
+    # вход пользователя обновляет только last_login и страниц не меняет
+    if update_fields != frozenset(['last_login']):
+        conditional.bump_content_version()
+
+
+for model in (User, Post, Group, Comment, Follow):
+    post_save.connect(content_changed, sender=model, dispatch_uid='content_changed_save_%s' % model.__name__)
+    post_delete.connect(content_changed, sender=model, dispatch_uid='content_changed_delete_%s' % model.__name__)
@@ -0,0 +1,114 @@
+"""
+Стеммер Snowball для русского языка:
+https://snowballstem.org/algorithms/russian/stemmer.html
+
+Нужен индексу SQLite FTS5, у которого нет русской морфологии;
+в PostgreSQL то же самое делает конфигурация полнотекстового поиска 'russian'.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ив', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    (
+        'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+        'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+    ),
+)
+NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+    'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+WORD = re.compile(r'\w+')
+
+
+def _region(word, start=0):
+    """
+    Начало области после первого сочетания «гласная, затем согласная».
+    """
+    for index in range(start + 1, len(word)):
+        if word[index] not in VOWELS and word[index - 1] in VOWELS:
+            return index + 1
+    return len(word)
+
+
+def _strip(rv, groups):
+    """
+    Убирает самое длинное окончание. Окончания первой группы должны идти после «а» или «я».
+    Возвращает новую строку или None, если ничего не подошло.
+    """
+    if isinstance(groups[0], str):
+        groups = ((), groups)
+    best = None
+    for needs_a, endings in enumerate(groups):
+        for ending in endings:
+            if rv.endswith(ending) and (best is None or len(ending) > len(best[0])):
+                best = (ending, not needs_a)
+    if best is None:
+        return None
+    ending, needs_a = best
+    stem = rv[:-len(ending)]
+    if needs_a and not stem.endswith(('а', 'я')):
+        return None
+    return stem
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    rv_start = next((index + 1 for index, letter in enumerate(word) if letter in VOWELS), len(word))
+    r2_start = _region(word, _region(word) - 1)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # шаг 1
+    result = _strip(rv, PERFECTIVE_GERUND)
+    if result is None:
+        reflexive = _strip(rv, REFLEXIVE)
+        rv = reflexive if reflexive is not None else rv
+        result = _strip(rv, ADJECTIVE)
+        if result is not None:
+            participle = _strip(result, PARTICIPLE)
+            result = participle if participle is not None else result
+        else:
+            result = _strip(rv, VERB)
+            if result is None:
+                result = _strip(rv, NOUN)
+    rv = result if result is not None else rv
+
+    # шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # шаг 3: словообразовательные суффиксы только в R2
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and len(prefix) + len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+
+    # шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def terms(text):
+    """
+    Основы всех слов текста через пробел: то, что кладётся в индекс и ищется в нём.
+    """
+    return ' '.join(stem(word) for word in WORD.findall(text.lower()))
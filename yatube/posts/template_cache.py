@@ -0,0 +1,55 @@
+"""
+Разбор шаблонов проекта заранее, при запуске процесса.
+
+С кэширующим загрузчиком (settings.TEMPLATE_CACHE) каждый шаблон разбирается
+один раз на процесс, в том числе включаемые в цикле post_item.html и
+post_card.html. precompile() делает это до первого запроса, а с
+gunicorn --preload - один раз в мастер-процессе до fork.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.template import TemplateSyntaxError, engines
+from django.template.utils import get_app_template_dirs
+
+logger = logging.getLogger(__name__)
+
+
+def project_template_names():
+    """
+    Имена шаблонов из DIRS и из папок templates приложений проекта
+    (шаблоны сторонних приложений вроде админки разбираются по требованию).
+    """
+    engine = engines['django'].engine
+    directories = list(engine.dirs) + [
+        directory for directory in get_app_template_dirs('templates')
+        if str(directory).startswith(settings.BASE_DIR)
+    ]
+    names = set()
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for file_name in files:
+                if file_name.endswith('.html'):
+                    names.add(os.path.relpath(os.path.join(root, file_name), directory))
+    return sorted(names)
+
+
+def precompile():
+    """
+    Загружает все шаблоны проекта в кэш загрузчика; без кэша ничего не делает.
+    Возвращает число разобранных шаблонов.
+    """
+    if not settings.TEMPLATE_CACHE:
+        return 0
+    engine = engines['django'].engine
+    compiled = 0
+    for name in project_template_names():
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError:
+            # ошибку в шаблоне покажет запрос, который его использует
+            logger.exception('Не удалось разобрать шаблон %s', name)
+        else:
+            compiled += 1
+    return compiled
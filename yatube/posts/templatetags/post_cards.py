@@ -0,0 +1,21 @@
+from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.cards import EDIT_LINK_PLACEHOLDER, render_card
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    """
+    Карточка поста из кэша; ссылка на редактирование подставляется
+    отдельно для каждого посетителя и в кэш не попадает.
+    """
+    html = render_card(post)
+    user = context.get('user')
+    edit_link = ''
+    if user is not None and user.is_authenticated and user.pk == post.author_id:
+        edit_link = render_to_string('post_edit_link.html', {'post': post})
+    return mark_safe(html.replace(EDIT_LINK_PLACEHOLDER, edit_link))
@@ -1,12 +1,59 @@
+import asyncio
+import io
+import json
+import os
+import threading
+import multiprocessing
+import socket
+import sqlite3
 import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
 
-from django.test import TestCase, Client, override_settings
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 
-from .models import User, Post, Group, Follow, Comment
+from .models import (
+    User, Post, Group, Follow, FollowChange, Comment, Recommendation, TimelineEntry, UserStats, SearchDocument,
+)
 from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
 
 from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.templatetags.static import static
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from yatube.asgi import ASGIHandler
+from yatube.db import pool
+from yatube.db_router import PIN_COOKIE, PrimaryReplicaRouter
+from yatube.redis_cache import RedisCache
+from yatube.redis_server import LocalRedisServer
+from yatube.sessions import SessionStore
+
+from PIL import Image
+
+from . import thumbnails
+from .cards import card_key
+from .followgraph import Adjacency, FollowGraph
+from .forms import PostForm
+from .uploads import BoundedImageUploadHandler
+from .paginator import CursorPaginator
+from .profiling import QueryBudgetMixin, profile_request
+from .search import SearchPaginator
+from .stemmer import stem
+from . import (
+    aio, events, followgraph, pagecache, pages, recommender, rendering, template_cache, threads, timeline, writebehind,
+)
 
 
 class TestProfile(TestCase):
@@ -137,17 +184,40 @@ class ImageTest(TestCase):
 
 class CacheTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(username="test", email="w@q.com", password="1234567")
         # Создаем пост
         self.post = Post.objects.create(text="test1", author=self.user)
 
     def test_cache_index_page(self):
+        # Лента не кэшируется целиком: новый пост виден сразу, а карточки берутся из кэша
         response = self.client.get("")
         self.assertContains(response, 'test1')
-        self.post = Post.objects.create(text="test2", author=self.user)
+        self.assertIsNotNone(cache.get(card_key(self.post)))
+        Post.objects.create(text="test2", author=self.user)
         response = self.client.get("")
-        self.assertNotContains(response, 'test2')
+        self.assertContains(response, 'test2')
+
+    def test_edit_invalidates_card(self):
+        self.client.get("")
+        self.post.text = "test1 (edited)"
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertIsNone(cache.get(card_key(self.post)))
+        self.assertContains(self.client.get(""), "test1 (edited)")
+
+    def test_comment_invalidates_card(self):
+        self.client.get("")
+        Comment.objects.create(post=self.post, author=self.user, text="comment")
+        self.assertContains(self.client.get(""), "1 комментариев")
+
+    def test_edit_link_is_per_viewer(self):
+        # Первый посетитель - не автор, но автор всё равно видит ссылку на редактирование
+        edit_url = reverse("post_edit", kwargs={"username": "test", "post_id": self.post.id})
+        self.assertNotContains(self.client.get(""), edit_url)
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(""), edit_url)
 
 
 class FollowTest(TestCase):
@@ -202,3 +272,1758 @@ class CommentTest(TestCase):
         self.client.post(f'/{self.user}/{self.post.id}/comment', {"text": 'best_comment'})
         response = self.client.get(f'/{self.user}/{self.post.id}/')
         self.assertNotContains(response, "best_comment")
+
+
+class CursorPaginatorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='paginator', password='12345678q')
+        for i in range(23):
+            Post.objects.create(text=f'post_{i}', author=self.user)
+        self.queryset = Post.objects.order_by('-pub_date', '-id')
+
+    def test_walk_forward_and_back(self):
+        # Проходим ленту вперёд по курсорам и проверяем, что посты не теряются и не повторяются
+        paginator = CursorPaginator(self.queryset, 10)
+        page = paginator.get_page(None)
+        seen = list(page)
+        pages = [page]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            seen += list(page)
+            pages.append(page)
+        self.assertEqual([p.id for p in seen], [p.id for p in self.queryset])
+        self.assertEqual([len(p) for p in pages], [10, 10, 3])
+        self.assertFalse(pages[0].has_previous())
+        # Возвращаемся назад с последней страницы
+        previous = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual([p.id for p in previous], [p.id for p in pages[1]])
+        self.assertTrue(previous.has_next())
+        first = paginator.get_page(previous.previous_cursor)
+        self.assertEqual([p.id for p in first], [p.id for p in pages[0]])
+        self.assertFalse(first.has_previous())
+
+    def test_invalid_cursor_gives_first_page(self):
+        paginator = CursorPaginator(self.queryset, 10)
+        page = paginator.get_page('not-a-cursor')
+        self.assertEqual(page[0], self.queryset[0])
+
+    def test_index_uses_cursor_without_count(self):
+        response = self.client.get('/')
+        page = response.context['page']
+        self.assertTrue(page.has_next())
+        self.assertContains(response, f'?cursor={page.next_cursor}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/', {'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['page']), 10)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='author', password='12345678q')
+        self.reader = User.objects.create_user(username='reader', password='12345678q')
+        self.client.force_login(self.reader)
+
+    def test_new_post_is_fanned_out(self):
+        # Пост автора раскладывается в ленту подписчика при сохранении
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='fan_out_post', author=self.author)
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+        self.assertContains(self.client.get('/follow/'), 'fan_out_post')
+
+    def test_follow_and_unfollow_update_timeline(self):
+        Post.objects.create(text='old_post', author=self.author)
+        with mock.patch.object(timeline, 'schedule') as schedule:
+            self.client.get(f'/{self.author}/follow/')
+        # старые посты автора дописывает пул после коммита, а не запрос подписки
+        schedule.assert_called_once_with(timeline.add_author, self.reader.id, self.author.id)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        timeline.add_author(self.reader.id, self.author.id)
+        self.assertContains(self.client.get('/follow/'), 'old_post')
+        self.client.get(f'/{self.author}/unfollow/')
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertNotContains(self.client.get('/follow/'), 'old_post')
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=1)
+    def test_celebrity_posts_are_read_on_demand(self):
+        # Посты «звёзд» не раскладываются, а подмешиваются при чтении
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(7):
+            Post.objects.create(text=f'celebrity_{i}', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.client.get('/follow/')
+        self.assertEqual([p.text for p in response.context['page']], [f'celebrity_{i}' for i in range(6, 1, -1)])
+        response = self.client.get('/follow/', {'cursor': response.context['page'].next_cursor})
+        self.assertEqual([p.text for p in response.context['page']], ['celebrity_1', 'celebrity_0'])
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=2)
+    def test_posts_survive_celebrity_demotion(self):
+        # Посты, написанные «звездой», остаются в ленте, когда автор теряет подписчиков
+        other = User.objects.create_user(username='other_reader', password='12345678q')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(text='celebrity_post', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        with mock.patch.object(timeline, 'schedule', lambda func, *args: func(*args)):
+            Follow.objects.filter(user=other).delete()
+        self.assertContains(self.client.get('/follow/'), 'celebrity_post')
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3, TIMELINE_TRIM_EVERY=1)
+    def test_timeline_capped_and_older_pages_read_from_posts(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        with mock.patch.object(timeline, 'schedule', lambda func, *args: func(*args)):
+            posts = [Post.objects.create(text=f'capped_{i}', author=self.author) for i in range(12)]
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.reader).order_by('-pub_date').values_list('post', flat=True)),
+            [post.id for post in posts[:-4:-1]],
+        )
+        self.assertEqual(timeline.horizon(self.reader.id), posts[-4].pub_date)
+        pages = [self.client.get('/follow/').context['page']]
+        while pages[-1].has_next():
+            pages.append(self.client.get('/follow/', {'cursor': pages[-1].next_cursor}).context['page'])
+        self.assertEqual([post.id for page in pages for post in page], [post.id for post in reversed(posts)])
+        # назад из-за границы ленты: страница собирается из обеих выборок
+        previous = self.client.get('/follow/', {'cursor': pages[1].previous_cursor}).context['page']
+        self.assertEqual([post.id for post in previous], [post.id for post in pages[0]])
+        self.assertFalse(previous.has_previous())
+
+    @override_settings(TIMELINE_MAX_ENTRIES=2)
+    def test_follow_backfills_newest_posts_only(self):
+        posts = [Post.objects.create(text=f'backfill_{i}', author=self.author) for i in range(4)]
+        Follow.objects.create(user=self.reader, author=self.author)
+        timeline.add_author(self.reader.id, self.author.id)
+        self.assertEqual(
+            sorted(TimelineEntry.objects.filter(user=self.reader).values_list('post', flat=True)),
+            [posts[2].id, posts[3].id],
+        )
+        response = self.client.get('/follow/')
+        self.assertEqual([post.text for post in response.context['page']], [f'backfill_{i}' for i in range(3, -1, -1)])
+
+    def test_rebuild_timelines_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='rebuild', author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=io.StringIO())
+        self.assertEqual(list(TimelineEntry.objects.values_list('user', 'post')), [(self.reader.id, post.id)])
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='counted', password='12345678q')
+        self.reader = User.objects.create_user(username='counter', password='12345678q')
+
+    def test_counters_follow_signals(self):
+        post = Post.objects.create(text='counted_post', author=self.author)
+        comment = Comment.objects.create(post=post, author=self.reader, text='counted_comment')
+        Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual((author_stats.post_count, author_stats.follower_count), (1, 1))
+        reader_stats = UserStats.objects.get(user=self.reader)
+        self.assertEqual((reader_stats.comment_count, reader_stats.following_count), (1, 1))
+        comment.delete()
+        Follow.objects.filter(user=self.reader).delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+        self.assertEqual(UserStats.objects.get(user=self.author).follower_count, 0)
+
+    def test_saving_stale_post_keeps_counters(self):
+        post = Post.objects.create(text='counted_post', author=self.author)
+        stale = Post.objects.get(pk=post.pk)
+        Comment.objects.create(post=post, author=self.reader, text='counted_comment')
+        Post.objects.filter(pk=post.pk).update(thumbnails='{"source": "posts/x.jpg"}')
+        version = Post.objects.get(pk=post.pk).version
+        # правка поста, загруженного до комментария, не затирает счётчик, версию и миниатюры
+        stale.text = 'edited'
+        stale.save()
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'edited')
+        self.assertEqual(post.comment_count, 1)
+        self.assertGreaterEqual(post.version, version)
+        self.assertEqual(post.thumbnails, '{"source": "posts/x.jpg"}')
+        comment = Comment.objects.get(post=post)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_recount_repairs_drift(self):
+        post = Post.objects.create(text='counted_post', author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='counted_comment')
+        UserStats.objects.update(post_count=42, comment_count=7)
+        Post.objects.update(comment_count=9)
+        call_command('recount', stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).post_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.reader).comment_count, 1)
+
+    def test_feed_query_count_is_constant(self):
+        # Количество запросов страницы ленты не зависит от числа постов на ней
+        group = Group.objects.create(title='counted', slug='counted')
+        post = Post.objects.create(text='first', author=self.author, group=group)
+        Comment.objects.create(post=post, author=self.reader, text='comment')
+        with CaptureQueriesContext(connection) as one_post:
+            self.client.get(f'/{self.author}/')
+        for i in range(4):
+            post = Post.objects.create(text=f'more_{i}', author=self.author, group=group)
+            Comment.objects.create(post=post, author=self.reader, text='comment')
+        with CaptureQueriesContext(connection) as five_posts:
+            response = self.client.get(f'/{self.author}/')
+        self.assertContains(response, '1 комментариев')
+        self.assertEqual(len(one_post), len(five_posts))
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='budget', password='12345678q')
+        self.reader = User.objects.create_user(username='reader', password='12345678q')
+        self.group = Group.objects.create(title='budget', slug='budget')
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(12):
+            self.post = Post.objects.create(text=f'budget_{i}', author=self.author, group=self.group)
+            Comment.objects.create(post=self.post, author=self.reader, text='comment')
+        self.client.force_login(self.reader)
+
+    def test_feed_views_within_budget(self):
+        for path in ('/', '/group/budget/', '/budget/', f'/budget/{self.post.id}/', '/follow/'):
+            with self.subTest(path=path):
+                self.assertQueryBudget(path)
+
+    @override_settings(QUERY_PROFILER=True)
+    def test_profiler_middleware_emits_server_timing(self):
+        client = Client()
+        client.force_login(self.reader)
+        with self.assertLogs('posts.profiling', level='INFO') as logs:
+            response = client.get('/budget/')
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'posts.views.profile')
+        self.assertEqual(record['budget'], 6)
+        self.assertGreater(record['template_ms'], 0)
+
+
+def _incr_in_worker(location, key, times):
+    # отдельный процесс со своим пулом соединений, как воркер gunicorn
+    worker_cache = RedisCache(location, {'KEY_PREFIX': 'coherence'})
+    for _ in range(times):
+        worker_cache.incr(key)
+
+
+class SharedCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = LocalRedisServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def make_cache(self, prefix='coherence'):
+        return RedisCache(self.server.url, {'KEY_PREFIX': prefix, 'OPTIONS': {'MAX_CONNECTIONS': 4}})
+
+    def setUp(self):
+        self.worker1 = self.make_cache()
+        self.worker2 = self.make_cache()
+        self.worker1.clear()
+
+    def test_values_are_shared_between_workers(self):
+        self.worker1.set('card', {'html': '<div>'}, 30)
+        self.assertEqual(self.worker2.get('card'), {'html': '<div>'})
+        self.worker2.delete('card')
+        self.assertIsNone(self.worker1.get('card'))
+        self.worker1.set_many({'a': 1, 'b': 'two'})
+        self.assertEqual(self.worker2.get_many(['a', 'b', 'c']), {'a': 1, 'b': 'two'})
+        self.assertFalse(self.worker2.add('a', 5))
+        self.assertEqual(self.worker2.get('a'), 1)
+
+    def test_namespaces_are_isolated(self):
+        other = self.make_cache(prefix='other_site')
+        other.set('card', 'other')
+        self.worker1.set('card', 'ours')
+        self.worker1.set_many({'key_%d' % i: i for i in range(2500)})
+        self.worker1.clear()
+        self.assertIsNone(self.worker2.get('card'))
+        self.assertEqual(self.worker2.get_many(['key_0', 'key_2499']), {})
+        self.assertEqual(other.get('card'), 'other')
+
+    def test_timeouts(self):
+        self.worker1.set('short', 'value', 0.05)
+        self.worker1.set('gone', 'value', 0)
+        self.assertEqual(self.worker2.get('short'), 'value')
+        self.assertIsNone(self.worker2.get('gone'))
+        time.sleep(0.1)
+        self.assertIsNone(self.worker2.get('short'))
+
+    def test_incr_is_atomic_across_processes(self):
+        self.worker1.set('hits', 0)
+        with self.assertRaises(ValueError):
+            self.worker1.incr('missing')
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_incr_in_worker, args=(self.server.url, 'hits', 200))
+            for _ in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        for _ in range(200):
+            self.worker2.incr('hits')
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.worker1.get('hits'), 800)
+
+    def test_incr_of_missing_key_creates_nothing(self):
+        with self.assertRaises(ValueError):
+            self.worker1.incr('missing', 5)
+        self.assertFalse(self.worker2.has_key('missing'))
+        self.assertTrue(self.worker2.add('missing', 1))
+        self.assertEqual(self.worker1.incr('missing', 5), 6)
+
+    def test_commands_are_not_repeated_after_timeout(self):
+        slow = RedisCache(self.server.url, {'KEY_PREFIX': 'coherence', 'OPTIONS': {'SOCKET_TIMEOUT': 0.05}})
+        self.worker1.set('hits', 0)
+        key = slow.make_key('hits')
+        # команда дошла до сервера, а ответ опоздал: повторять её нельзя
+        with self.assertRaises(OSError):
+            slow.pool.pipeline([['INCRBY', key, 1], ['DEBUG', 'SLEEP', '0.2']])
+        time.sleep(0.3)
+        self.assertEqual(self.worker1.get('hits'), 1)
+
+    def test_exhausted_pool_fails_instead_of_waiting_forever(self):
+        options = {'MAX_CONNECTIONS': 1, 'SOCKET_TIMEOUT': 0.05}
+        stuck = RedisCache(self.server.url, {'KEY_PREFIX': 'coherence', 'OPTIONS': options})
+        # алиас с другим таймаутом не получает пул первого
+        self.assertIsNot(stuck.pool, self.worker1.pool)
+        self.assertEqual(stuck.pool.params['socket_timeout'], 0.05)
+        held = stuck.pool.get()
+        with self.assertRaises(ConnectionError):
+            stuck.get('card')
+        stuck.pool.release(held)
+        self.assertIsNone(stuck.get('card'))
+
+    def test_connections_closed_by_server_are_replaced(self):
+        self.worker1.set('alive', 1)
+        for connection in list(self.worker1.pool.idle.queue):
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.worker1.get('alive'), 1)
+
+
+class IndexesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='indexed', password='12345678q')
+        self.author = User.objects.create_user(username='indexed_author', password='12345678q')
+        self.group = Group.objects.create(title='indexed', slug='indexed')
+        Post.objects.create(text='indexed', author=self.author, group=self.group)
+
+    def test_follow_is_unique(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Follow.objects.create(user=self.user, author=self.author)
+
+    def test_feed_plans_have_no_table_scans(self):
+        out = io.StringIO()
+        call_command('explain_feeds', stdout=out)
+        self.assertNotIn('SCAN ', out.getvalue())
+
+
+class SeedAndLoadtestTest(TestCase):
+    def test_seed_and_loadtest(self):
+        call_command(
+            'seed_yatube', users=30, groups=3, posts=120, comments=200, follows=60,
+            batch_size=50, seed=1, stdout=io.StringIO(),
+        )
+        self.assertEqual(Post.objects.count(), 120)
+        self.assertEqual(Comment.objects.count(), 200)
+        self.assertEqual(Follow.objects.count(), 60)
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        # производные данные пересчитаны: bulk_create не вызывает сигналы
+        self.assertEqual(sum(UserStats.objects.values_list('post_count', flat=True)), 120)
+        self.assertTrue(TimelineEntry.objects.exists())
+        self.assertEqual(SearchDocument.objects.filter(kind=SearchDocument.COMMENT).count(), 200)
+        self.assertTrue(list(SearchPaginator("Комментарий", 10).get_page()))
+
+        out = io.StringIO()
+        call_command('loadtest', requests=40, warmup=5, concurrency=1, seed=1, stdout=out)
+        report = out.getvalue()
+        self.assertRegex(report, r'all\s+40\s')
+        self.assertIn('ошибок: 0', report)
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username="thumbs", password="123456")
+        with open('posts/test/test_image.jpg', 'rb') as img:
+            self.post = Post(text="text with image", author=self.user)
+            self.post.image.save('test_image.jpg', File(img))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    def test_generate_all_formats(self):
+        names = thumbnails.generate(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 1)
+        self.assertEqual(names["source"], self.post.image.name)
+        for fmt in thumbnails.available_formats():
+            with default_storage.open(names["card"][fmt]) as handle:
+                self.assertEqual(Image.open(handle).size, (960, 339))
+        self.assertIn("webp", names["card"])
+        # повторный вызов для той же картинки ничего не пересобирает
+        self.assertEqual(thumbnails.generate(self.post.id), names)
+
+    def test_templates_use_precomputed_urls(self):
+        response = self.client.get("")
+        self.assertContains(response, self.post.image.url)
+        self.assertNotContains(response, "<picture>")
+
+        thumbnails.generate(self.post.id)
+        self.post.refresh_from_db()
+        urls = self.post.thumbnail_urls["card"]
+        response = self.client.get("")
+        self.assertContains(response, "<picture>")
+        self.assertContains(response, urls["webp"])
+        self.assertContains(response, urls["jpeg"])
+
+    def test_replaced_image_gets_new_thumbnails(self):
+        old = thumbnails.generate(self.post.id)
+        self.post.refresh_from_db()
+        with open('posts/test/test_image.jpg', 'rb') as img:
+            self.post.image.save('other.jpg', File(img))
+        self.assertEqual(self.post.thumbnail_urls, {})
+        new = thumbnails.generate(self.post.id)
+        self.assertNotEqual(new["card"]["jpeg"], old["card"]["jpeg"])
+        self.assertFalse(default_storage.exists(old["card"]["jpeg"]))
+
+
+class UploadTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def make_image(self, size, image_format='JPEG', noise=False, **options):
+        if noise:
+            image = Image.merge('RGB', [Image.effect_noise(size, 64)] * 3)
+        else:
+            image = Image.new('RGB', size, 'navy')
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **options)
+        buffer.seek(0)
+        buffer.name = 'upload.%s' % image_format.lower()
+        return buffer
+
+    def validate(self, upload):
+        request = self.factory.post('/new/', {'text': 'text', 'image': upload})
+        request.upload_handlers = [BoundedImageUploadHandler(request)]
+        # разбор multipart и проверка формы, без сборки тела запроса тестовым клиентом
+        tracemalloc.start()
+        try:
+            form = PostForm(request.POST, request.FILES)
+            form.is_valid()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return form, peak
+
+    def test_large_upload_is_streamed_and_downscaled(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera maker'
+        upload = self.make_image((3000, 2000), noise=True, exif=exif.tobytes(), quality=95)
+        size = len(upload.getvalue())
+        form, peak = self.validate(upload)
+        self.assertTrue(form.is_valid(), form.errors)
+        # файл не читается в память Python целиком
+        self.assertLess(peak, size / 4)
+
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual(image.size, (2048, 1365))
+        self.assertNotIn('exif', image.info)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1000)
+    def test_byte_cap(self):
+        form, _ = self.validate(self.make_image((400, 400), noise=True))
+        self.assertEqual(form.errors.as_data()['image'][0].code, 'file_too_large')
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=1000000)
+    def test_pixel_cap_checked_before_decoding(self):
+        form, _ = self.validate(self.make_image((2000, 1000), 'PNG'))
+        self.assertEqual(form.errors.as_data()['image'][0].code, 'too_many_pixels')
+
+    def test_header_sniffing(self):
+        upload = io.BytesIO(b'<?php echo 1; ?>' * 100)
+        upload.name = 'image.jpg'
+        form, _ = self.validate(upload)
+        self.assertEqual(form.errors.as_data()['image'][0].code, 'invalid_image')
+
+    def test_other_uploads_not_filtered(self):
+        upload = io.BytesIO(b'name,count\n' * 100)
+        upload.name = 'report.csv'
+        request = self.factory.post('/admin/', {'file': upload})
+        self.assertEqual(request.FILES['file'].read(), b'name,count\n' * 100)
+
+    def test_image_views_still_check_csrf(self):
+        user = User.objects.create_user(username='uploader', password='12345678q')
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(user)
+        response = client.post(reverse('new_post'), {'text': 'text', 'image': self.make_image((10, 10))})
+        self.assertEqual(response.status_code, 403)
+        response = client.get(reverse('new_post'))
+        token = response.cookies['csrftoken'].value
+        response = client.post(
+            reverse('new_post'), {'text': 'csrf_text', 'image': self.make_image((10, 10)), 'csrfmiddlewaretoken': token},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Post.objects.filter(text='csrf_text').exists())
+
+
+class SearchTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="searcher", password="12345678q")
+        self.group = Group.objects.create(title="Путешествия", slug="travel", description="Рассказы о дальних странах")
+        self.post = Post.objects.create(text="Красивые горы Кавказа", author=self.user, group=self.group)
+        self.other = Post.objects.create(text="Рецепт борща", author=self.user)
+        self.comment = Comment.objects.create(post=self.other, author=self.user, text="Люблю путешествовать в горах")
+
+    def kinds(self, query):
+        response = self.client.get(reverse("search"), {"q": query})
+        return [(document.kind, document.object_id) for document in response.context["page"]]
+
+    def test_stemmer(self):
+        self.assertEqual(stem("красивые"), stem("красивая"))
+        self.assertEqual(stem("горах"), stem("горы"))
+        self.assertEqual(stem("программирование"), "программирован")
+
+    def test_search_covers_posts_comments_and_groups(self):
+        self.assertCountEqual(self.kinds("гора"), [("post", self.post.id), ("comment", self.comment.id)])
+        self.assertEqual(self.kinds("дальняя страна"), [("group", self.group.id)])
+        self.assertEqual(self.kinds("красивый"), [("post", self.post.id)])
+        self.assertEqual(self.kinds("несуществующее"), [])
+
+    def test_index_updates_on_save_and_delete(self):
+        self.other.text = "Рецепт пирога"
+        self.other.save()
+        self.assertEqual(self.kinds("борщ"), [])
+        self.assertEqual(self.kinds("пироги"), [("post", self.other.id)])
+        self.comment.delete()
+        self.assertEqual(self.kinds("путешествовать"), [])
+        self.post.delete()
+        self.assertEqual(self.kinds("гора"), [])
+
+    def test_ranked_cursor_pagination(self):
+        for i in range(25):
+            Post.objects.create(text="кот " * (1 + i % 3) + str(i), author=self.user)
+        seen = []
+        cursor = None
+        while True:
+            page = SearchPaginator("коты", 10).get_page(cursor)
+            seen += [document.object_id for document in page]
+            ranks = [document.rank for document in page]
+            self.assertEqual(ranks, sorted(ranks))
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+        previous = SearchPaginator("коты", 10).get_page(page.previous_cursor)
+        self.assertEqual(len(previous), 10)
+
+    def test_search_within_budget(self):
+        self.client.force_login(self.user)
+        response = self.assertQueryBudget("/search/", {"q": "горы"})
+        self.assertContains(response, "Красивые горы Кавказа")
+
+
+@override_settings(CONDITIONAL_GET=True)
+class ApiTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="api_author", password="12345678q")
+        self.reader = User.objects.create_user(username="api_reader", password="12345678q")
+        self.group = Group.objects.create(title="api", slug="api-group", description="d")
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(12):
+            self.post = Post.objects.create(text=f"api_{i}", author=self.author, group=self.group)
+        Comment.objects.create(post=self.post, author=self.reader, text="comment")
+
+    def test_feeds_mirror_html_views(self):
+        data = self.client.get("/api/posts/").json()
+        self.assertEqual([post["text"] for post in data["results"]], [f"api_{i}" for i in range(11, 1, -1)])
+        rest = self.client.get("/api/posts/", {"cursor": data["next"]}).json()
+        self.assertEqual([post["text"] for post in rest["results"]], ["api_1", "api_0"])
+        self.assertIsNone(rest["next"])
+
+        data = self.client.get("/api/groups/api-group/posts/").json()
+        self.assertEqual(data["group"]["title"], "api")
+        data = self.client.get("/api/users/api_author/posts/").json()
+        self.assertEqual(data["author"]["post_count"], 12)
+        data = self.client.get(f"/api/users/api_author/posts/{self.post.id}/").json()
+        self.assertEqual(data["comments"][0]["text"], "comment")
+        self.assertEqual(data["comment_count"], 1)
+
+        self.assertEqual(self.client.get("/api/follow/").status_code, 401)
+        self.client.force_login(self.reader)
+        self.assertEqual(len(self.client.get("/api/follow/").json()["results"]), 10)
+
+    def test_field_selection(self):
+        data = self.client.get("/api/posts/", {"fields": "id,author"}).json()
+        self.assertEqual(data["results"][0], {"id": self.post.id, "author": "api_author"})
+        response = self.client.get("/api/posts/", {"fields": "id,password"})
+        self.assertEqual(response.status_code, 400)
+        data = self.client.get(f"/api/users/api_author/posts/{self.post.id}/", {"fields": "text"}).json()
+        self.assertEqual(data, {"text": "api_11"})
+
+    def test_conditional_get(self):
+        for path in ("/api/posts/", f"/api/users/api_author/posts/{self.post.id}/", "/", "/api_author/"):
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                etag = response["ETag"]
+                self.assertRegex(etag, r'^"[0-9a-f]{40}"$')
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                modified = response["Last-Modified"]
+                self.assertEqual(self.client.get(path, HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+
+        etag = self.client.get("/api/posts/")["ETag"]
+        Comment.objects.create(post=self.post, author=self.author, text="one more")
+        response = self.client.get("/api/posts/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        # разные страницы и наборы полей - разные ETag
+        self.assertNotEqual(self.client.get("/api/posts/", {"fields": "id"})["ETag"], response["ETag"])
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get("/")["ETag"]
+        self.client.force_login(self.reader)
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+
+    def test_etag_changes_with_csrf_token_and_session(self):
+        # страница поста содержит форму комментария с CSRF-токеном
+        path = f"/api_author/{self.post.id}/"
+        self.client.force_login(self.reader)
+        self.client.cookies["csrftoken"] = "a" * 64
+        etag = self.client.get(path)["ETag"]
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.cookies["csrftoken"] = "b" * 64
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(path)["ETag"]
+        self.client.logout()
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(CONDITIONAL_GET=False)
+    def test_no_etag_without_shared_cache(self):
+        response = self.client.get("/api/posts/")
+        self.assertFalse(response.has_header("ETag"))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_api_within_budget(self):
+        self.client.force_login(self.reader)
+        for path in (
+            "/api/posts/", "/api/groups/api-group/posts/", "/api/users/api_author/posts/",
+            f"/api/users/api_author/posts/{self.post.id}/", "/api/follow/",
+        ):
+            with self.subTest(path=path):
+                self.assertQueryBudget(path)
+
+
+class CommentThreadTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="thread_author", password="12345678q")
+        self.post = Post.objects.create(text="thread", author=self.author)
+        self.url = f"/thread_author/{self.post.id}/"
+
+    def comment(self, text, parent=None):
+        return Comment.objects.create(post=self.post, author=self.author, text=text, parent=parent)
+
+    def test_reply_path_and_counters(self):
+        root = self.comment("root")
+        reply = self.comment("reply", root)
+        nested = self.comment("nested", reply)
+        other = self.comment("other")
+        root.refresh_from_db()
+        nested.refresh_from_db()
+        self.assertEqual(nested.path, "/".join(threads.segment(pk) for pk in (root.pk, reply.pk, nested.pk)))
+        self.assertEqual(root.reply_count, 2)
+        subtree = Comment.objects.filter(threads.subtree(root.path)).order_by("path")
+        self.assertEqual(list(subtree), [reply, nested])
+        self.assertNotIn(other, Comment.objects.filter(threads.subtree(root.path)))
+
+        nested.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 1)
+
+    @override_settings(COMMENT_MAX_DEPTH=2)
+    def test_depth_cap(self):
+        self.client.force_login(self.author)
+        root = self.comment("root")
+        reply = self.comment("reply", root)
+        self.client.post(f"{self.url}comment", {"text": "deep", "parent": reply.pk})
+        deep = Comment.objects.get(text="deep")
+        self.assertEqual(deep.parent, root)
+        self.assertEqual(threads.depth(deep), 1)
+
+    @override_settings(COMMENTS_PER_PAGE=2)
+    def test_root_pages_and_load_more(self):
+        roots = [self.comment(f"root_{i}") for i in range(3)]
+        self.comment("answer", roots[0])
+        response = self.client.get(self.url)
+        self.assertEqual([comment.text for comment in response.context["items"]], ["root_0", "root_1"])
+        self.assertEqual([reply.text for reply in response.context["items"][0].thread], ["answer"])
+
+        api = f"/api/users/thread_author/posts/{self.post.id}/comments/"
+        data = self.client.get(api).json()
+        self.assertEqual(data["results"][0]["replies"][0]["text"], "answer")
+        rest = self.client.get(api, {"cursor": data["next"]}).json()
+        self.assertEqual([comment["text"] for comment in rest["results"]], ["root_2"])
+        self.assertIsNone(rest["next"])
+
+        replies = self.client.get(f"{api}{roots[0].id}/replies/").json()
+        self.assertEqual([(reply["text"], reply["depth"]) for reply in replies["results"]], [("answer", 1)])
+
+    @override_settings(COMMENT_REPLIES_PER_PAGE=2)
+    def test_more_replies_without_javascript(self):
+        root = self.comment("root")
+        for i in range(3):
+            self.comment(f"answer_{i}", root)
+        thread_url = f"{self.url}comments/{root.id}/"
+        response = self.client.get(self.url)
+        # ссылка ведёт на HTML-страницу ветки, JSON - только в data-url
+        self.assertContains(response, f'href="{thread_url}"')
+        response = self.client.get(thread_url)
+        self.assertEqual([reply.text for reply in response.context["page"]], ["answer_0", "answer_1"])
+        response = self.client.get(thread_url, {"cursor": response.context["page"].next_cursor})
+        self.assertEqual([reply.text for reply in response.context["page"]], ["answer_2"])
+
+        data = self.client.get(f"/api/users/thread_author/posts/{self.post.id}/comments/").json()
+        self.assertTrue(data["results"][0]["more_replies"])
+        self.assertEqual(data["results"][0]["thread_url"], thread_url)
+
+    def test_fill_paths_after_bulk_create(self):
+        Comment.objects.bulk_create([Comment(post=self.post, author=self.author, text="root")])
+        root = Comment.objects.get(text="root")
+        Comment.objects.bulk_create([Comment(post=self.post, author=self.author, text="reply", parent=root)])
+        reply = Comment.objects.get(text="reply")
+        Comment.objects.bulk_create([Comment(post=self.post, author=self.author, text="nested", parent=reply)])
+        self.assertEqual(threads.fill_paths(Comment.objects.all()), 3)
+        nested = Comment.objects.get(text="nested")
+        self.assertEqual(nested.path, "/".join(threads.segment(pk) for pk in (root.pk, reply.pk, nested.pk)))
+
+    def test_comments_within_budget(self):
+        for i in range(30):
+            root = self.comment(f"root_{i}")
+            self.comment(f"answer_{i}", root)
+        api = f"/api/users/thread_author/posts/{self.post.id}/comments/"
+        for path in (self.url, api, f"{api}{root.id}/replies/", f"{self.url}comments/{root.id}/"):
+            with self.subTest(path=path):
+                self.assertQueryBudget(path)
+
+
+class WriteBehindTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.queue_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            WRITE_BEHIND="on", WRITE_BEHIND_QUEUE=f"{self.queue_dir.name}/queue.sqlite3",
+        )
+        self.settings_override.enable()
+        self.author = User.objects.create_user(username="wb_author", password="12345678q")
+        self.reader = User.objects.create_user(username="wb_reader", password="12345678q")
+        self.post = Post.objects.create(text="wb_post", author=self.author)
+        self.client.force_login(self.reader)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.queue_dir.cleanup()
+
+    def test_follows_and_comments_are_queued_and_drained(self):
+        self.client.get("/wb_author/follow/")
+        self.client.get("/wb_author/follow/")
+        self.client.post(f"/wb_author/{self.post.id}/comment", {"text": "queued"})
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        stats = writebehind.stats()
+        self.assertEqual(stats["depth"], 3)
+        self.assertGreaterEqual(stats["lag"], 0)
+
+        out = io.StringIO()
+        # ленты дописывает пул после коммита, здесь - сразу
+        with mock.patch.object(timeline, "schedule", lambda func, *args: func(*args)):
+            call_command("writebehind", once=True, stdout=out)
+        self.assertIn("batch=3 depth=0", out.getvalue())
+        self.assertEqual(Follow.objects.filter(user=self.reader, author=self.author).count(), 1)
+        # сигналы отработали так же, как при обычной записи
+        self.assertEqual(UserStats.objects.get(user=self.author).follower_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=self.post).exists())
+        comment = Comment.objects.get(text="queued")
+        self.assertEqual(comment.path, threads.segment(comment.pk))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        # разобранное не применяется повторно
+        self.assertEqual(writebehind.drain(), 0)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_last_action_per_pair_wins(self):
+        writebehind.follow(self.reader.id, self.author.id)
+        writebehind.unfollow(self.reader.id, self.author.id)
+        writebehind.follow(self.author.id, self.reader.id)
+        writebehind.drain()
+        self.assertEqual(list(Follow.objects.values_list("user", "author")), [(self.author.id, self.reader.id)])
+        writebehind.unfollow(self.author.id, self.reader.id)
+        writebehind.drain()
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(UserStats.objects.get(user=self.reader).follower_count, 0)
+
+    @override_settings(WRITE_BEHIND="off")
+    def test_direct_writes_are_idempotent(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        # подписка, которую уже успел создать параллельный запрос, не даёт ошибку 500
+        response = self.client.get("/wb_author/follow/")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.client.get("/wb_author/unfollow/")
+        self.client.get("/wb_author/unfollow/")
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(writebehind.stats()["depth"], 0)
+
+    @override_settings(WRITE_BEHIND="auto")
+    def test_auto_mode_queues_when_database_is_locked(self):
+        locked = OperationalError("database is locked")
+        with mock.patch.object(Follow.objects, "get_or_create", side_effect=locked):
+            self.assertTrue(writebehind.follow(self.reader.id, self.author.id))
+        self.assertFalse(writebehind.follow(self.author.id, self.reader.id))
+        self.assertEqual(writebehind.stats()["depth"], 1)
+        writebehind.drain()
+        self.assertEqual(Follow.objects.count(), 2)
+
+    @override_settings(WRITE_BEHIND="auto")
+    def test_auto_mode_raises_other_database_errors(self):
+        broken = OperationalError("no such table: posts_follow")
+        with mock.patch.object(Follow.objects, "get_or_create", side_effect=broken):
+            with self.assertRaises(OperationalError):
+                writebehind.follow(self.reader.id, self.author.id)
+        self.assertEqual(writebehind.stats()["depth"], 0)
+
+    def test_drain_skips_signals_for_follows_created_meanwhile(self):
+        writebehind.follow(self.reader.id, self.author.id)
+        # прямой запрос успел создать ту же подписку, пока запись ждала в очереди
+        Follow.objects.create(user=self.reader, author=self.author)
+        writebehind.drain()
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).follower_count, 1)
+        self.assertEqual(FollowChange.objects.count(), 1)
+
+
+class ReplicaRoutingTest(QueryBudgetMixin, TransactionTestCase):
+    """
+    Реплики - отдельные файлы SQLite, «репликация» - копирование основной базы
+    через backup API, поэтому между копиями реплики честно отстают.
+    """
+    replicas = ("replica_a", "replica_b")
+    databases = {"default", *replicas}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        for alias in cls.replicas:
+            connections.databases[alias] = dict(
+                connections.databases["default"], NAME=f"{cls.replica_dir.name}/{alias}.sqlite3", TEST={},
+            )
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.replicas:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        self.settings_override = override_settings(DATABASE_REPLICAS=list(self.replicas))
+        self.settings_override.enable()
+        cache.clear()
+        self.author = User.objects.create_user(username="replicated", password="12345678q")
+        self.client.force_login(self.author)
+        self.replicate()
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def replicate(self):
+        connection.ensure_connection()
+        for alias in self.replicas:
+            connections[alias].close()
+            target = sqlite3.connect(connections.databases[alias]["NAME"])
+            connection.connection.backup(target)
+            target.close()
+
+    def test_reads_go_to_replicas_until_the_user_writes(self):
+        anonymous = Client()
+        self.assertEqual(anonymous.get("/").status_code, 200)
+        self.client.post("/new/", {"text": "fresh_post"})
+        response = self.client.get("/")
+        # автор сразу видит свой пост: после записи браузер привязан к основной базе
+        self.assertContains(response, "fresh_post")
+        self.assertIn(PIN_COOKIE, self.client.cookies)
+        self.assertEqual(self.client.cookies[PIN_COOKIE]["max-age"], settings.REPLICA_PIN_SECONDS)
+        # остальные читают реплику, которая ещё не догнала основную базу
+        self.assertNotContains(anonymous.get("/"), "fresh_post")
+        self.replicate()
+        self.assertContains(anonymous.get("/"), "fresh_post")
+        # бюджет запросов учитывает и чтения с реплик
+        self.assertQueryBudget("/", client=anonymous)
+
+    def test_writes_and_code_outside_requests_use_primary(self):
+        self.assertEqual(Post.objects.all().db, "default")
+        post = Post.objects.create(text="primary", author=self.author)
+        self.assertEqual(post._state.db, "default")
+        self.assertEqual(PrimaryReplicaRouter().db_for_write(Post), "default")
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = f"{self.directory.name}/pool.sqlite3"
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def make_pool(self, **options):
+        options = dict({"max_size": 2, "max_lifetime": 60, "health_check_interval": 60, "timeout": 0.1}, **options)
+        return pool.ConnectionPool(self.connect, **options)
+
+    def test_connections_are_reused(self):
+        connections_pool = self.make_pool()
+        raw = connections_pool.acquire()
+        connections_pool.release(raw)
+        self.assertIs(connections_pool.acquire(), raw)
+        self.assertEqual(self.connects, 1)
+        stats = connections_pool.stats()
+        self.assertEqual((stats["reuses"], stats["in_use"], stats["idle"]), (1, 1, 0))
+
+    def test_full_pool_times_out(self):
+        connections_pool = self.make_pool()
+        connections_pool.acquire()
+        connections_pool.acquire()
+        with self.assertRaises(OperationalError):
+            connections_pool.acquire()
+        self.assertEqual(connections_pool.stats()["timeouts"], 1)
+
+    def test_old_and_broken_connections_are_replaced(self):
+        connections_pool = self.make_pool(max_lifetime=0.05, health_check_interval=0)
+        broken = connections_pool.acquire()
+        connections_pool.release(broken)
+        broken.close()
+        self.assertIsNot(connections_pool.acquire(), broken)
+        self.assertEqual(connections_pool.stats()["failed_checks"], 1)
+
+        old = connections_pool.acquire()
+        connections_pool.release(old)
+        time.sleep(0.1)
+        self.assertIsNot(connections_pool.acquire(), old)
+        self.assertEqual(connections_pool.stats()["recycled"], 1)
+
+    def test_health_check_runs_without_pool_lock(self):
+        connections_pool = self.make_pool(health_check_interval=0, timeout=1)
+        stuck = mock.Mock()
+        # SELECT 1 на полумёртвом сокете висит, пока не сработает таймаут сети
+        stuck.cursor.return_value.execute.side_effect = lambda sql: time.sleep(0.5)
+        connections_pool.idle.append(pool.PooledConnection(stuck))
+        checking = threading.Thread(target=connections_pool.acquire)
+        checking.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        connections_pool.release(connections_pool.acquire())
+        self.assertLess(time.monotonic() - started, 0.3)
+        checking.join()
+
+    def test_unfinished_transaction_is_rolled_back(self):
+        connections_pool = self.make_pool()
+        raw = connections_pool.acquire()
+        raw.execute("CREATE TABLE item (id INTEGER)")
+        raw.commit()
+        raw.execute("INSERT INTO item VALUES (1)")
+        connections_pool.release(raw)
+        self.assertEqual(connections_pool.acquire().execute("SELECT COUNT(*) FROM item").fetchone(), (0,))
+
+    def test_backend_returns_connection_to_pool(self):
+        alias = "pooled"
+        connections.databases[alias] = dict(
+            connections.databases["default"], ENGINE="yatube.db.backends.sqlite3", NAME=self.path,
+            OPTIONS={"POOL": {"MAX_SIZE": 1}}, TEST={},
+        )
+        self.addCleanup(connections.databases.pop, alias)
+        wrapper = connections[alias]
+        self.addCleanup(delattr, connections._connections, alias)
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        wrapper.close()
+        self.assertIsNone(wrapper.connection)
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertIs(wrapper.connection, raw)
+        self.assertEqual(pool.stats()[alias]["connects"], 1)
+        wrapper.close()
+        pool.get_pool(alias, {}, None).close_all()
+
+
+@override_settings(ROOT_URLCONF="yatube.asgi_urls")
+class AsyncViewsTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="async_author", password="12345678q")
+        self.reader = User.objects.create_user(username="async_reader", password="12345678q")
+        self.group = Group.objects.create(title="async", slug="async-group", description="d")
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(text="async_post", author=self.author, group=self.group)
+        Comment.objects.create(post=self.post, author=self.reader, text="async_comment")
+        self.client.force_login(self.reader)
+
+    def test_pages_match_sync_views(self):
+        paths = ["/", "/group/async-group/", "/async_author/", f"/async_author/{self.post.id}/", "/follow/"]
+        for path in paths:
+            with self.subTest(path=path):
+                response = self.assertQueryBudget(path)
+                self.assertContains(response, "async_post")
+                with override_settings(ROOT_URLCONF="yatube.urls"):
+                    sync_response = self.client.get(path)
+                self.assertEqual(response.context["page"].object_list, sync_response.context["page"].object_list)
+        response = self.client.get(f"/async_author/{self.post.id}/")
+        self.assertContains(response, "async_comment")
+        self.assertTrue(response.context["following"])
+        self.assertEqual(response.context["followers"], 1)
+
+    def test_missing_objects(self):
+        self.assertEqual(self.client.get("/nobody/").status_code, 404)
+        self.assertEqual(self.client.get("/group/nothing/").status_code, 404)
+        self.assertEqual(self.client.get(f"/async_reader/{self.post.id}/").status_code, 404)
+
+
+class ASGITest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="asgi_author", password="12345678q")
+        self.post = Post.objects.create(text="asgi_post", author=self.author)
+        self.application = ASGIHandler()
+        self.addCleanup(self.application.executor.shutdown)
+
+    def request(self, method, path, body=b"", headers=()):
+        messages = [
+            {"type": "http.request", "body": body[:10], "more_body": True},
+            {"type": "http.request", "body": body[10:]},
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "method": method, "path": path, "query_string": b"",
+            "headers": [(b"host", b"testserver"), *headers], "server": ("testserver", 80),
+        }
+        asyncio.run(self.application(scope, receive, send))
+        headers = [(name.decode(), value.decode()) for name, value in sent[0]["headers"]]
+        return sent[0]["status"], headers, b"".join(message.get("body", b"") for message in sent[1:])
+
+    def test_read_views_and_forms(self):
+        status, _, body = self.request("GET", f"/asgi_author/{self.post.id}/")
+        self.assertEqual(status, 200)
+        self.assertIn("asgi_post", body.decode())
+        self.assertEqual(self.request("GET", "/nobody/")[0], 404)
+
+        # форма входа: cookie и тело запроса из нескольких сообщений доходят до Django
+        _, headers, _ = self.request("GET", "/auth/login/")
+        token = next(value for name, value in headers if name == "Set-Cookie").split(";")[0].split("=")[1]
+        status, headers, _ = self.request(
+            "POST", "/auth/login/",
+            body=f"username=asgi_author&password=12345678q&csrfmiddlewaretoken={token}".encode(),
+            headers=[
+                (b"content-type", b"application/x-www-form-urlencoded"),
+                (b"cookie", f"csrftoken={token}".encode()),
+            ],
+        )
+        self.assertEqual(status, 302)
+        self.assertTrue(any(value.startswith(settings.SESSION_COOKIE_NAME + "=") for name, value in headers))
+
+    def test_queries_run_concurrently_outside_transactions(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def query():
+            # оба вызова дойдут до барьера, только если выполняются одновременно
+            barrier.wait()
+            return Post.objects.count()
+
+        async def both():
+            return await asyncio.gather(aio.db(query), aio.db(query))
+
+        self.assertEqual(asyncio.run(both()), [1, 1])
+
+
+@override_settings(EVENTS_POLL_INTERVAL=0, EVENTS_HEARTBEAT=0.1, EVENTS_LONG_POLL_TIMEOUT=0.2, EVENTS_BUFFER_SIZE=3)
+@override_settings(EVENTS_ENABLED=True)
+class LiveFeedTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="live_author", password="12345678q")
+        self.group = Group.objects.create(title="live", slug="live-group", description="d")
+        self.posts = [Post.objects.create(text=f"live_{i}", author=self.author, group=self.group) for i in range(3)]
+
+    def read(self, response, chunks=1):
+        content = iter(response.streaming_content)
+        try:
+            return b"".join(next(content) for _ in range(chunks)).decode()
+        finally:
+            response.close()
+
+    def test_bus_delivers_each_event_once(self):
+        bus = events.Bus()
+        subscription = bus.subscribe(["posts", "author:1"], maxsize=2)
+        event = events.Event(1, events.POST, {})
+        self.assertEqual(bus.publish(["posts", "author:1"], event), 1)
+        self.assertEqual(bus.publish(["posts"], event), 0)
+        self.assertEqual(subscription.take(), ([event], False))
+        # медленный клиент: буфер не растёт, вместо событий - reset
+        for number in range(2, 5):
+            bus.publish(["posts"], events.Event(number, events.POST, {}))
+        self.assertEqual(subscription.take(), ([], True))
+        subscription.close()
+        self.assertEqual(bus.listeners(), 0)
+
+    def test_posts_of_other_processes_are_read_from_database(self):
+        bus = events.Bus()
+        subscription = bus.subscribe([f"group:{self.group.id}"])
+        last = bus.poll_once(self.posts[0].id, 0)
+        self.assertEqual(last, (self.posts[-1].id, 0))
+        received, _ = subscription.take()
+        self.assertEqual([event.data["text"] for event in received], ["live_1", "live_2"])
+        # уже разосланное сигналами повторно не публикуется
+        self.assertEqual(bus.publish(events.post_channels(self.posts[1]), events.post_event(self.posts[1])), 0)
+
+    def test_long_poll_returns_missed_posts(self):
+        first = self.posts[0]
+        response = self.assertQueryBudget("/events/", {"poll": 1, "last_id": first.id})
+        data = json.loads(self.read(response))
+        self.assertEqual([event["data"]["text"] for event in data["events"]], ["live_1", "live_2"])
+        self.assertEqual(data["last_id"], self.posts[-1].id)
+        # новых постов нет: пустой ответ по таймауту
+        data = json.loads(self.read(self.client.get("/events/", {"poll": 1, "last_id": data["last_id"]})))
+        self.assertEqual((data["events"], data["reset"]), ([], False))
+
+    def test_event_stream_continues_after_last_event_id(self):
+        response = self.client.get("/group/live-group/events/", HTTP_LAST_EVENT_ID=str(self.posts[1].id))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = iter(response.streaming_content)
+        self.assertIn(f"id: {self.posts[2].id}\nevent: post\n", next(content).decode())
+        self.assertEqual(next(content), b": ping\n\n")
+        post = Post.objects.create(text="live_new", author=self.author, group=self.group)
+        events.bus().publish(events.post_channels(post), events.post_event(post))
+        self.assertIn('"text": "live_new"', next(content).decode())
+        response.close()
+        self.assertEqual(events.bus().listeners(), 0)
+
+    def test_too_many_missed_events_reset_the_client(self):
+        for i in range(4):
+            Comment.objects.create(post=self.posts[0], author=self.author, text=f"comment_{i}")
+        path = f"/live_author/{self.posts[0].id}/events/"
+        self.assertIn("event: reset", self.read(self.client.get(path, {"last_id": 0})))
+        self.assertIn("retry: ", self.read(self.assertQueryBudget(path)))
+
+    def test_pages_subscribe_to_their_feeds(self):
+        self.assertContains(self.client.get("/"), f"/events/?last_id={self.posts[-1].id}")
+        self.assertContains(self.client.get("/group/live-group/"), "/group/live-group/events/")
+        self.assertContains(self.client.get(f"/live_author/{self.posts[0].id}/"), "Новые комментарии")
+
+    @override_settings(EVENTS_ENABLED=False)
+    def test_disabled_under_wsgi(self):
+        # под WSGI поток событий держал бы поток воркера
+        self.assertNotContains(self.client.get("/"), "EventSource")
+        self.assertNotContains(self.client.get(f"/live_author/{self.posts[0].id}/"), "Новые комментарии")
+        response = self.client.get("/group/live-group/events/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(events.bus().listeners(), 0)
+
+
+@override_settings(EVENTS_POLL_INTERVAL=0, EVENTS_HEARTBEAT=5)
+class LiveFeedASGITest(TransactionTestCase):
+    def test_comment_reaches_listener_without_holding_threads(self):
+        author = User.objects.create_user(username="live_asgi", password="12345678q")
+        post = Post.objects.create(text="live_asgi_post", author=author)
+        application = ASGIHandler()
+        self.addCleanup(application.executor.shutdown)
+        disconnect = asyncio.Event()
+        received = []
+        writer = threading.Thread(
+            target=Comment.objects.create, kwargs={"post": post, "author": author, "text": "live_comment"},
+        )
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {"type": "http.request", "body": b""}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            body = message.get("body", b"").decode()
+            if message["type"] == "http.response.start":
+                self.assertEqual(message["status"], 200)
+            elif body.startswith("retry"):
+                # поток открыт: комментарий пишет другой поток, как обычный запрос
+                writer.start()
+            elif "live_comment" in body:
+                disconnect.set()
+
+        scope = {
+            "type": "http", "method": "GET", "path": f"/live_asgi/{post.id}/events/", "query_string": b"",
+            "headers": [(b"host", b"testserver")], "server": ("testserver", 80),
+        }
+
+        async def listen():
+            await asyncio.wait_for(application(scope, receive, send), 10)
+
+        asyncio.run(listen())
+        writer.join()
+        self.assertTrue(disconnect.is_set())
+        self.assertEqual(events.bus().listeners(), 0)
+
+
+class TemplateCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="tpl_author", password="12345678q")
+        for i in range(3):
+            Post.objects.create(text=f"tpl_{i}", author=self.author)
+
+    def test_templates_are_compiled_once(self):
+        loader, = engines["django"].engine.template_loaders
+        self.assertIsInstance(loader, CachedLoader)
+        loader.reset()
+        self.assertGreater(template_cache.precompile(), 10)
+        with profile_request() as profile:
+            self.client.get("/")
+        # post_item.html включён трижды, но ничего не разбирается заново
+        self.assertEqual(profile.compiles, [])
+        includes = {(row["parent"], row["name"]): row["count"] for row in profile.include_summary()}
+        self.assertEqual(includes[("index.html", "post_item.html")], 3)
+        self.assertEqual(includes[("post_item.html", "post_card.html")], 3)
+
+        loader.reset()
+        with profile_request() as profile:
+            self.client.get("/")
+        self.assertIn("post_item.html", {name for name, _ in profile.compiles})
+
+    @override_settings(QUERY_PROFILER=True)
+    def test_profiler_reports_templates(self):
+        with self.assertLogs("posts.profiling", level="INFO") as logs:
+            response = Client().get("/")
+        self.assertIn("tplc;dur=", response["Server-Timing"])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertIn("post_item.html", [row["name"] for row in record["templates"]])
+        self.assertIn("compile_ms", record)
+
+        out = io.StringIO()
+        call_command("profile_templates", "/", repeat=2, stdout=out)
+        self.assertIn("index.html > post_item.html", out.getvalue())
+
+
+class RenderedTextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="render_author", password="12345678q")
+        self.group = Group.objects.create(title="Render", slug="render-group", description="d")
+
+    def test_text_rendered_on_save(self):
+        post = Post.objects.create(
+            text="<b>жирный</b> & 'кавычки'\nпривет @render_author и @nobody в #render-group, #missing",
+            author=self.author,
+        )
+        self.assertEqual(post.render_version, rendering.VERSION)
+        html = post.text_html
+        self.assertIn("&lt;b&gt;жирный&lt;/b&gt; &amp; &#39;кавычки&#39;<br>привет", html)
+        self.assertIn('<a href="/render_author/">@render_author</a>', html)
+        self.assertIn('<a href="/group/render-group/">#render-group</a>', html)
+        self.assertIn("@nobody", html)
+        self.assertIn("#missing", html)
+        self.assertNotIn("/nobody/", html)
+
+        post.text = "новый текст"
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).text_html, "новый текст")
+
+        comment = Comment.objects.create(post=post, author=self.author, text="раз\nдва @render_author")
+        response = self.client.get(reverse("post", args=[self.author.username, post.id]))
+        self.assertContains(response, 'раз<br>два <a href="/render_author/">@render_author</a>')
+        api = self.client.get(reverse("api_comments", args=[self.author.username, post.id])).json()
+        self.assertEqual(api["results"][0]["html"], comment.text_html)
+
+    @override_settings(TEXT_LINKS=False)
+    def test_links_disabled(self):
+        post = Post.objects.create(text="@render_author\n#render-group", author=self.author)
+        self.assertEqual(post.text_html, "@render_author<br>#render-group")
+
+    def test_rerender_command(self):
+        post = Post.objects.create(text="строка\n#render-group", author=self.author)
+        # bulk_create обходит save(): до перерисовки шаблон отрисовывает текст сам
+        Comment.objects.bulk_create([Comment(post=post, author=self.author, text="a\nb")])
+        Post.objects.filter(pk=post.pk).update(render_version=0, text_html="")
+        self.assertEqual(Post.objects.get(pk=post.pk).rendered_text, "строка<br>#render-group")
+        version = Post.objects.get(pk=post.pk).version
+
+        out = io.StringIO()
+        call_command("rerender_texts", batch_size=1, stdout=out)
+        self.assertIn("перерисовано 1", out.getvalue())
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(post.render_version, rendering.VERSION)
+        self.assertIn('href="/group/render-group/"', post.rendered_text)
+        self.assertEqual(post.version, version + 1)
+        self.assertEqual(Comment.objects.get(text="a\nb").text_html, "a<br>b")
+
+        out = io.StringIO()
+        call_command("rerender_texts", stdout=out)
+        self.assertNotIn("перерисовано 1", out.getvalue())
+        call_command("rerender_texts", all=True, stdout=out)
+        self.assertIn("перерисовано 1", out.getvalue())
+
+
+class StaticFilesTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "source")
+        self.root = os.path.join(self.directory.name, "static")
+        self.media = os.path.join(self.directory.name, "media")
+        os.makedirs(os.path.join(self.source, "css"))
+        os.makedirs(os.path.join(self.media, "posts"))
+        with open(os.path.join(self.source, "css", "site.css"), "w") as handle:
+            handle.write(".card { margin: 0; }\n" * 200)
+        with open("posts/test/test_image.jpg", "rb") as image, open(os.path.join(self.media, "posts", "a.jpg"), "wb") as handle:
+            handle.write(image.read())
+        self.settings_override = override_settings(
+            STATIC_ROOT=self.root,
+            STATICFILES_DIRS=[self.source],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            MEDIA_ROOT=self.media,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def test_collectstatic_builds_hashed_compressed_files(self):
+        call_command("collectstatic", interactive=False, verbosity=0)
+        url = static("css/site.css")
+        self.assertRegex(url, r"^/static/css/site\.[0-9a-f]{12}\.css$")
+        path = os.path.join(self.root, url[len("/static/"):])
+        for suffix in ("", ".gz", ".br"):
+            self.assertTrue(os.path.exists(path + suffix), suffix)
+
+        client = Client()
+        response = client.get(url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertIn("immutable", response["Cache-Control"])
+        response.close()
+        response = client.get("/static/css/site.css")
+        self.assertNotIn("immutable", response["Cache-Control"])
+        response.close()
+        response = client.get(url, HTTP_RANGE="bytes=0-4")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b".card")
+
+    def test_missing_manifest_entry_keeps_name(self):
+        self.assertEqual(static("css/missing.css"), "/static/css/missing.css")
+
+    def test_media_served_with_ranges(self):
+        client = Client()
+        response = client.get("/media/posts/a.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Cache-Control"], "max-age=%d, public" % settings.MEDIA_MAX_AGE)
+        etag = response["ETag"]
+        response.close()
+        response = client.get("/media/posts/a.jpg", HTTP_RANGE="bytes=0-1")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"\xff\xd8")
+        self.assertEqual(client.get("/media/posts/a.jpg", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # загруженный после запуска файл тоже находится
+        with open(os.path.join(self.media, "posts", "b.jpg"), "wb") as handle:
+            handle.write(b"\xff\xd8")
+        response = client.get("/media/posts/b.jpg")
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(client.get("/media/../posts/test/test_image.jpg").status_code, 404)
+
+
+@override_settings(
+    SESSION_ENGINE="yatube.sessions",
+    AUTHENTICATION_BACKENDS=["yatube.sessions.CachedModelBackend"],
+)
+class CachedSessionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="session_user", password="12345678q")
+        self.client.force_login(self.user)
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            query["sql"] for query in queries.captured_queries
+            if "django_session" in query["sql"] or 'FROM "auth_user"' in query["sql"]
+        ]
+
+    def test_logged_in_requests_skip_session_and_user_queries(self):
+        url = reverse("follow_index")
+        self.auth_queries(url)
+        self.assertEqual(self.auth_queries(url), [])
+        # смена пароля сбрасывает кэш пользователя и разлогинивает сессию
+        self.user.set_password("another-password")
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_session_written_to_db_lazily(self):
+        session = self.client.session
+        key = session.session_key
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+        session["theme"] = "dark"
+        with self.assertNumQueries(0):
+            session.save()
+        self.assertNotIn("theme", Session.objects.get(session_key=key).get_decoded())
+
+        session = SessionStore(key)
+        self.assertEqual(session["theme"], "dark")
+        session["theme"] = "light"
+        with override_settings(SESSION_DB_WRITE_INTERVAL=0):
+            session.save()
+        self.assertEqual(Session.objects.get(session_key=key).get_decoded()["theme"], "light")
+
+        # без кэша сессия читается из базы
+        cache.clear()
+        self.assertEqual(SessionStore(key)["theme"], "light")
+
+    def test_clear_expired_keeps_sessions_alive_in_cache(self):
+        alive = self.client.session.session_key
+        stale = SessionStore()
+        stale.create()
+        Session.objects.update(expire_date=timezone.now() - timedelta(days=1))
+        cache.delete(SessionStore.cache_key_prefix + stale.session_key)
+        self.assertEqual(SessionStore.clear_expired(batch_size=1), 1)
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), [alive])
+
+
+@override_settings(PAGE_CACHE=True)
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="page_author", password="12345678q")
+        self.reader = User.objects.create_user(username="page_reader", password="12345678q")
+        self.group = Group.objects.create(title="Pages", slug="pages", description="d")
+        self.grouped = Post.objects.create(text="page_grouped", author=self.author, group=self.group)
+        self.other = Post.objects.create(text="page_other", author=self.reader)
+
+    def get(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertCached(self, url):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(url)["X-Page-Cache"], "HIT")
+
+    def test_anonymous_pages_cached_until_purged(self):
+        index, group = reverse("index"), reverse("group_posts", args=["pages"])
+        profile = reverse("profile", args=["page_author"])
+        post = reverse("post", args=["page_author", self.grouped.id])
+        for url in (index, group, profile, post):
+            self.assertEqual(self.get(url)["X-Page-Cache"], "MISS")
+            self.assertCached(url)
+        keys = self.get(group)[pagecache.HEADER].split()
+        self.assertEqual(keys, ["*", "group:pages", "post:%d" % self.grouped.id])
+        self.assertEqual(
+            self.get(post)[pagecache.HEADER].split(),
+            ["*", "author:%d" % self.author.id, "post:%d" % self.grouped.id],
+        )
+
+        # комментарий к посту вне группы не трогает страницы группы и автора
+        Comment.objects.create(post=self.other, author=self.reader, text="c")
+        self.assertEqual(self.get(index)["X-Page-Cache"], "MISS")
+        for url in (group, profile, post):
+            self.assertCached(url)
+
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.get(profile)["X-Page-Cache"], "MISS")
+        self.assertEqual(self.get(post)["X-Page-Cache"], "MISS")
+        self.assertCached(group)
+
+        Post.objects.create(text="page_new", author=self.reader, group=self.group)
+        self.assertContains(self.get(group), "page_new")
+        self.assertCached(profile)
+
+        self.grouped.delete()
+        self.assertNotContains(self.get(group), "page_grouped")
+
+    def test_logged_in_and_personal_responses_not_cached(self):
+        self.client.force_login(self.reader)
+        response = self.get(reverse("index"))
+        self.assertNotIn("X-Page-Cache", response)
+        self.client.logout()
+        self.get(reverse("index"))
+        self.assertEqual(self.get(reverse("index"), HTTP_COOKIE="sessionid=x")["X-Page-Cache"], "HIT")
+        self.assertEqual(self.client.get(reverse("profile", args=["nobody"])).status_code, 404)
+        User.objects.create_user(username="nobody", password="12345678q")
+        self.assertEqual(self.get(reverse("profile", args=["nobody"]))["X-Page-Cache"], "MISS")
+
+    def test_purge_during_render_outdates_the_page(self):
+        index_context = pages.index_context
+
+        def purged_meanwhile(request, paginator, page):
+            # новый пост закоммичен и сбросил ленту после того, как страница прочитана
+            pagecache.purge(pagecache.FEED)
+            return index_context(request, paginator, page)
+
+        with mock.patch.object(pages, "index_context", purged_meanwhile):
+            self.assertEqual(self.get(reverse("index"))["X-Page-Cache"], "MISS")
+        self.assertEqual(self.get(reverse("index"))["X-Page-Cache"], "MISS")
+        self.assertCached(reverse("index"))
+
+    @override_settings(CONDITIONAL_GET=True)
+    def test_cached_page_answers_conditional_requests(self):
+        etag = self.get(reverse("index"))["ETag"]
+        response = self.client.get(reverse("index"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["X-Page-Cache"], "HIT")
+
+    @override_settings(PAGE_CACHE_PURGE_TOKEN="secret")
+    def test_purge_endpoint(self):
+        url = reverse("cache_purge")
+        page = reverse("post", args=["page_author", self.grouped.id])
+        self.get(page)
+        self.assertEqual(self.client.post(url, HTTP_SURROGATE_KEY="post:%d" % self.grouped.id).status_code, 403)
+        self.assertEqual(self.client.post(url, HTTP_X_PURGE_TOKEN="secret").status_code, 400)
+        response = self.client.post(url, HTTP_X_PURGE_TOKEN="secret", HTTP_SURROGATE_KEY="post:%d" % self.grouped.id)
+        self.assertEqual(response.json(), {"purged": ["post:%d" % self.grouped.id]})
+        self.assertEqual(self.get(page)["X-Page-Cache"], "MISS")
+        self.assertEqual(self.get(reverse("index"))["X-Page-Cache"], "MISS")
+        self.assertEqual(self.get(reverse("index"))["X-Page-Cache"], "HIT")
+
+
+class FollowGraphTest(TestCase):
+    def tearDown(self):
+        followgraph.reset()
+
+    def test_adjacency_lookups(self):
+        following = Adjacency.from_sorted([(1, 2), (1, 5), (1, 9), (4, 1), (4, 2)])
+        self.assertTrue(following.contains(1, 5))
+        self.assertFalse(following.contains(1, 4))
+        self.assertFalse(following.contains(2, 5))
+        self.assertFalse(following.contains(100, 1))
+        self.assertEqual(list(following.neighbours(1)), [2, 5, 9])
+        self.assertEqual(following.degree(3), 0)
+        followers = following.reversed()
+        self.assertEqual(list(followers.neighbours(2)), [1, 4])
+        self.assertEqual(list(followers.neighbours(1)), [4])
+        self.assertEqual(following.nbytes, 6 * 8 + 5 * 4)
+
+    def test_changes_overlay_the_snapshot(self):
+        graph = FollowGraph.from_pairs([(1, 2), (1, 3), (2, 3)])
+        graph.set_edge(1, 2, False)
+        graph.set_edge(1, 7, True)
+        graph.set_edge(1, 7, True)
+        graph.set_edge(5, 3, True)
+        self.assertFalse(graph.is_following(1, 2))
+        self.assertEqual(graph.followees(1), [3, 7])
+        self.assertEqual(graph.followers_of(3), [1, 2, 5])
+        self.assertEqual((graph.following_count(1), graph.follower_count(3), graph.edges), (2, 3, 4))
+        # возврат к снимку убирает пару из наложения
+        graph.set_edge(1, 2, True)
+        self.assertEqual(graph.delta_size, 2)
+        graph.compact()
+        self.assertEqual((graph.delta_size, graph.edges), (0, 5))
+        self.assertEqual(graph.followees(1), [2, 3, 7])
+        self.assertEqual(graph.followers_of(3), [1, 2, 5])
+
+    def test_compaction_keeps_changes_made_meanwhile(self):
+        graph = FollowGraph.from_pairs([(1, 2), (2, 3)])
+        reversed_ = Adjacency.reversed
+
+        def unfollow_meanwhile(adjacency):
+            # снимок строится без блокировки: подписки в это время не ждут
+            applying = threading.Thread(target=graph.set_edge, args=(1, 3, True))
+            applying.start()
+            applying.join(timeout=1)
+            self.assertFalse(applying.is_alive())
+            graph.set_edge(2, 3, False)
+            return reversed_(adjacency)
+
+        with mock.patch("posts.followgraph.COMPACT_MIN", 1):
+            graph.set_edge(4, 2, True)
+            with mock.patch.object(Adjacency, "reversed", unfollow_meanwhile):
+                graph.set_edge(5, 2, True)
+                graph._compaction.join()
+        self.assertEqual(graph.delta_size, 2)
+        self.assertEqual(graph.followees(1), [2, 3])
+        self.assertEqual(graph.followers_of(2), [1, 4, 5])
+        self.assertEqual(graph.followers_of(3), [1])
+        self.assertEqual(graph.edges, 4)
+
+    def test_uncommitted_follow_visible_only_to_its_transaction(self):
+        reader = User.objects.create_user(username="graph_reader", password="12345678q")
+        author = User.objects.create_user(username="graph_author", password="12345678q")
+        follow = Follow.objects.create(user=reader, author=author)
+        # внутри транзакции граф не загружается: подписку видно из очереди on_commit
+        self.assertTrue(followgraph.is_following(reader.id, author.id))
+        self.assertEqual(followgraph.followees(reader.id), [author.id])
+        self.assertIsNone(followgraph._state.graph)
+        follow.delete()
+        self.assertFalse(followgraph.is_following(reader.id, author.id))
+        self.assertEqual(
+            list(FollowChange.objects.values_list("user_id", "author_id", "follows")),
+            [(reader.id, author.id, True), (reader.id, author.id, False)],
+        )
+
+
+@override_settings(FOLLOW_GRAPH_POLL_INTERVAL=60)
+class FollowGraphLogTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        followgraph.reset()
+        # пул лент писал бы в базу одновременно с тестом, а ленты здесь не нужны
+        schedule = mock.patch.object(timeline, "schedule")
+        schedule.start()
+        self.addCleanup(schedule.stop)
+        self.reader = User.objects.create_user(username="log_reader", password="12345678q")
+        self.author = User.objects.create_user(username="log_author", password="12345678q")
+        Follow.objects.create(user=self.author, author=self.reader)
+
+    def tearDown(self):
+        followgraph.reset()
+
+    def test_graph_loaded_in_background(self):
+        # пока граф грузится, отвечает SQL
+        self.assertIsNone(followgraph.current())
+        self.assertEqual(followgraph.followees(self.author.id), [self.reader.id])
+        followgraph._state.loading.join()
+        with self.assertNumQueries(0):
+            self.assertEqual(followgraph.current().followees(self.author.id), [self.reader.id])
+
+    def test_follow_applied_on_commit_without_queries(self):
+        followgraph.load()
+        self.assertEqual(followgraph.followees(self.author.id), [self.reader.id])
+        Follow.objects.create(user=self.reader, author=self.author)
+        with self.assertNumQueries(0):
+            self.assertTrue(followgraph.is_following(self.reader.id, self.author.id))
+            self.assertEqual(followgraph.current().follower_count(self.author.id), 1)
+
+    def test_rolled_back_follow_forgotten(self):
+        followgraph.load()
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Follow.objects.create(user=self.reader, author=self.author)
+                self.assertTrue(followgraph.is_following(self.reader.id, self.author.id))
+                raise IntegrityError
+        self.assertFalse(followgraph.is_following(self.reader.id, self.author.id))
+
+    def test_other_processes_changes_read_from_log(self):
+        followgraph.load()
+        # другой процесс: строки в базе и новая версия в кэше, сигналов здесь нет
+        Follow.objects.bulk_create([Follow(user=self.reader, author=self.author)])
+        FollowChange.objects.create(user_id=self.reader.id, author_id=self.author.id, follows=True)
+        self.assertFalse(followgraph.is_following(self.reader.id, self.author.id))
+        followgraph.bump_version()
+        self.assertTrue(followgraph.is_following(self.reader.id, self.author.id))
+
+    def test_profile_reads_graph(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+        self.client.get(reverse("profile", args=["log_author"]))
+        followgraph._state.loading.join()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("profile", args=["log_author"]))
+        self.assertTrue(response.context["following"])
+        self.assertFalse([query for query in queries.captured_queries if "posts_follow" in query["sql"]])
+
+    def test_prune_keeps_recent_changes(self):
+        FollowChange.objects.update(created=timezone.now() - timedelta(days=2))
+        Follow.objects.create(user=self.reader, author=self.author)
+        out = io.StringIO()
+        call_command("prune_follow_log", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Удалено записей: 1")
+        self.assertEqual(FollowChange.objects.count(), 1)
+
+
+class RecommendationTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader, self.friend, self.star, self.talker, self.twin = [
+            User.objects.create_user(username=name, password="12345678q")
+            for name in ("rec_reader", "rec_friend", "rec_star", "rec_talker", "rec_twin")
+        ]
+        Follow.objects.create(user=self.reader, author=self.friend)
+        # звезду читает друг, а ещё близнец, у которого те же подписки, что у читателя
+        Follow.objects.create(user=self.friend, author=self.star)
+        Follow.objects.create(user=self.twin, author=self.friend)
+        Follow.objects.create(user=self.twin, author=self.star)
+        post = Post.objects.create(text="rec_post", author=self.talker)
+        Comment.objects.create(post=post, author=self.reader, text="rec_comment")
+
+    def recommended(self, user):
+        return list(Recommendation.objects.filter(user=user).order_by("-score").values_list("author__username", flat=True))
+
+    def test_build_scores_unfollowed_authors(self):
+        out = io.StringIO()
+        call_command("build_recommendations", stdout=out)
+        self.assertIn("Рекомендации для 1 пользователей", out.getvalue())
+        self.assertEqual(self.recommended(self.reader), ["rec_star", "rec_talker"])
+        # близнецу нечего советовать: читателя никто не читает, а комментатора он не комментирует
+        self.assertEqual(self.recommended(self.twin), [])
+        self.assertEqual(self.recommended(self.friend), [])
+
+    def test_pages_read_stored_list(self):
+        recommender.build()
+        self.client.force_login(self.reader)
+        response = self.assertQueryBudget(reverse("follow_index"))
+        self.assertEqual([item.author for item in response.context["recommendations"]], [self.star, self.talker])
+        self.assertContains(response, reverse("profile_follow", args=["rec_star"]))
+        response = self.assertQueryBudget(reverse("profile", args=["rec_star"]))
+        self.assertEqual([item.author for item in response.context["recommendations"]], [self.talker])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("profile", args=["rec_star"])).context["recommendations"], [])
+
+    def test_follow_and_rebuild_update_lists(self):
+        recommender.build()
+        Follow.objects.create(user=self.reader, author=self.star)
+        self.assertEqual(self.recommended(self.reader), ["rec_talker"])
+        Comment.objects.all().delete()
+        Follow.objects.filter(user=self.reader).delete()
+        recommender.build(batch_size=1)
+        self.assertEqual(self.recommended(self.reader), [])
+        self.assertEqual(Recommendation.objects.count(), 0)
+
+    def test_top_per_row(self):
+        matrix = recommender.sparse.csr_matrix([[0, 3, 1, 2], [0, 0, 0, 0], [5, 0, 0, 0]])
+        self.assertEqual(recommender.top_per_row(matrix, 2).toarray().tolist(), [[0, 3, 0, 2], [0, 0, 0, 0], [5, 0, 0, 0]])
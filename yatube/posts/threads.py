@@ -0,0 +1,128 @@
+"""
+Ветки комментариев на материализованном пути.
+
+Comment.path - это id всех предков и самого комментария через '/',
+каждый id дополнен нулями до PATH_WIDTH цифр. Поэтому поддерево
+комментария - это один запрос по диапазону индекса (post, path),
+а сортировка по path даёт обход ветки в глубину в порядке написания.
+"""
+from django.conf import settings
+from django.db.models import CharField, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+from .models import Comment
+from .paginator import CursorPaginator
+
+PATH_WIDTH = 10
+
+
+def segment(pk):
+    return '%0*d' % (PATH_WIDTH, pk)
+
+
+def depth(comment):
+    return comment.path.count('/')
+
+
+def reply_parent(parent):
+    """
+    Комментарий, к которому на самом деле прикрепится ответ:
+    слишком глубокие ответы уходят к ближайшему предку допустимой глубины.
+    """
+    while parent is not None and depth(parent) >= settings.COMMENT_MAX_DEPTH - 1:
+        parent = parent.parent
+    return parent
+
+
+def assign_path(comment):
+    """
+    Записывает путь только что созданного комментария и увеличивает
+    счётчик ответов у всех его предков.
+    """
+    if comment.parent_id:
+        parent_path = Comment.objects.filter(pk=comment.parent_id).values_list('path', flat=True).first()
+        comment.path = '%s/%s' % (parent_path or segment(comment.parent_id), segment(comment.pk))
+    else:
+        comment.path = segment(comment.pk)
+    Comment.objects.filter(pk=comment.pk).update(path=comment.path)
+    bump_replies(comment.path, 1)
+
+
+def subtree(path):
+    # все пути вида 'путь/...' лежат в диапазоне ('путь/', 'путь0'): '0' идёт в ASCII сразу за '/'.
+    # В отличие от LIKE 'путь/%' такое условие использует индекс и в SQLite, и в PostgreSQL
+    return Q(path__gt=path + '/', path__lt=path + '0')
+
+
+def ancestors(path):
+    return [int(part) for part in path.split('/')[:-1]]
+
+
+def bump_replies(path, delta):
+    if '/' in path:
+        Comment.objects.filter(pk__in=ancestors(path)).update(reply_count=F('reply_count') + delta)
+
+
+def fill_paths(comments):
+    """
+    Проставляет пути комментариям, созданным через bulk_create без сигналов:
+    сначала корням, затем ответам уровень за уровнем по уже готовым путям родителей.
+    Счётчики ответов не трогает.
+    """
+    segment_sql = LPad(Cast('pk', CharField()), PATH_WIDTH, Value('0'))
+    filled = comments.filter(path='', parent=None).update(path=segment_sql)
+    parent_path = Comment.objects.filter(pk=OuterRef('parent')).values('path')[:1]
+    while True:
+        level = comments.filter(path='', parent__isnull=False).exclude(parent__path='').update(
+            path=Concat(Subquery(parent_path), Value('/'), segment_sql, output_field=CharField()),
+        )
+        if not level:
+            return filled
+        filled += level
+
+
+def root_paginator(post, per_page=None):
+    """
+    Курсорная пагинация комментариев верхнего уровня по (created, id).
+    """
+    roots = Comment.objects.filter(post=post, parent=None).select_related('author')
+    return CursorPaginator(roots, per_page or settings.COMMENTS_PER_PAGE, ordering=('created', 'id'))
+
+
+def replies_paginator(comment, per_page=None):
+    """
+    Всё поддерево комментария в порядке обхода в глубину, курсор - путь.
+    """
+    replies = Comment.objects.filter(subtree(comment.path), post=comment.post_id)
+    return CursorPaginator(
+        replies.select_related('author'), per_page or settings.COMMENT_REPLIES_PER_PAGE, ordering=('path',),
+    )
+
+
+def attach_replies(roots, limit=None):
+    """
+    Подгружает ответы к комментариям страницы одним запросом.
+    Всего берётся не больше limit ответов; у веток, показанных не целиком,
+    флаг more_replies, остальное догружается через replies_paginator.
+    """
+    roots = list(roots)
+    for root in roots:
+        root.thread = []
+        root.more_replies = False
+    threaded = [root for root in roots if root.reply_count]
+    if not threaded:
+        return roots
+    condition = Q()
+    for root in threaded:
+        condition |= subtree(root.path)
+    replies = (
+        Comment.objects.filter(condition, post=threaded[0].post_id)
+        .select_related('author').order_by('path')[:limit or settings.COMMENT_REPLIES_PER_PAGE]
+    )
+    by_root = {root.pk: root for root in threaded}
+    for reply in replies:
+        reply.depth = depth(reply)
+        by_root[int(reply.path.split('/')[0])].thread.append(reply)
+    for root in threaded:
+        root.more_replies = len(root.thread) < root.reply_count
+    return roots
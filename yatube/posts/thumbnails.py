@@ -0,0 +1,151 @@
+"""
+Фоновая подготовка миниатюр картинок постов.
+
+Миниатюры всех размеров из settings.THUMBNAIL_SIZES и во всех форматах
+из settings.THUMBNAIL_FORMATS, которые умеет Pillow, строятся пулом потоков
+после коммита транзакции, сохранившей пост. Имена файлов записываются
+в Post.thumbnails, поэтому шаблоны только подставляют готовые URL
+и никогда не декодируют картинку во время запроса.
+"""
+import hashlib
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F, Q
+from PIL import Image, ImageOps
+
+from . import pagecache
+from .conditional import bump_content_version
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# формат Pillow и расширение файла
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+    'avif': ('AVIF', 'avif'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def available_formats():
+    """
+    Форматы из настроек, которые умеет сохранять установленный Pillow:
+    WebP нужна libwebp, AVIF - Pillow 11.2+ или pillow-avif-plugin.
+    """
+    Image.init()
+    return [name for name in settings.THUMBNAIL_FORMATS if FORMATS[name][0] in Image.SAVE]
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def schedule(post_id):
+    """
+    Ставит пост в очередь пула после коммита текущей транзакции,
+    чтобы воркер прочитал уже сохранённую картинку.
+    """
+    transaction.on_commit(lambda: executor().submit(_run, post_id))
+
+
+def _run(post_id):
+    try:
+        generate(post_id)
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры поста %s', post_id)
+    finally:
+        # у каждого потока пула своё соединение с базой
+        connection.close()
+
+
+def thumbnail_name(post, source, size, fmt):
+    digest = hashlib.md5(source.encode()).hexdigest()[:8]
+    return 'thumbs/%d/%s_%s.%s' % (post.pk, digest, size, FORMATS[fmt][1])
+
+
+def render(image, geometry, crop, fmt):
+    """
+    Аналог {% thumbnail image "960x339" crop="center" upscale=True %} из sorl.
+    """
+    width, height = (int(value) for value in geometry.split('x'))
+    if crop:
+        thumb = ImageOps.fit(image, (width, height), Image.LANCZOS, centering=(0.5, 0.5))
+    else:
+        thumb = image.copy()
+        thumb.thumbnail((width, height), Image.LANCZOS)
+    pil_format = FORMATS[fmt][0]
+    if pil_format == 'JPEG' and thumb.mode != 'RGB':
+        thumb = thumb.convert('RGB')
+    elif thumb.mode not in ('RGB', 'RGBA'):
+        thumb = thumb.convert('RGBA' if 'A' in thumb.getbands() else 'RGB')
+    buffer = io.BytesIO()
+    thumb.save(buffer, pil_format, quality=settings.THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def generate(post_id):
+    """
+    Строит все миниатюры поста и записывает их имена в Post.thumbnails.
+    Версия карточки сдвигается, чтобы в ленты попали новые URL.
+    """
+    post = Post.objects.filter(pk=post_id).only('id', 'image', 'thumbnails').first()
+    if post is None:
+        return {}
+    source = post.image.name if post.image else ''
+    previous = post.thumbnail_names()
+    if previous.get('source') == source:
+        return previous
+
+    names = {'source': source}
+    if source:
+        with post.image.open('rb') as handle:
+            image = Image.open(handle)
+            # JPEG можно декодировать сразу в уменьшенном масштабе
+            image.draft('RGB', max(
+                tuple(int(value) for value in geometry.split('x'))
+                for geometry, _ in settings.THUMBNAIL_SIZES.values()
+            ))
+            image = ImageOps.exif_transpose(image)
+            image.load()
+        for size, (geometry, crop) in settings.THUMBNAIL_SIZES.items():
+            names[size] = {}
+            for fmt in available_formats():
+                name = thumbnail_name(post, source, size, fmt)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                names[size][fmt] = default_storage.save(name, ContentFile(render(image, geometry, crop, fmt)))
+
+    # картинку могли заменить, пока строились миниатюры: тогда результат выбрасываем
+    same_image = Q(image=source) if source else Q(image='') | Q(image__isnull=True)
+    updated = Post.objects.filter(same_image, pk=post_id).update(
+        thumbnails=json.dumps(names), version=F('version') + 1,
+    )
+    if updated:
+        bump_content_version()
+        pagecache.purge(pagecache.post_key(post_id))
+    delete_files(names if not updated else previous)
+    return names if updated else previous
+
+
+def delete_files(names):
+    for formats in names.values():
+        if isinstance(formats, dict):
+            for name in formats.values():
+                default_storage.delete(name)
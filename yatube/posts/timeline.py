@@ -0,0 +1,247 @@
+"""
+Материализованная лента подписок (fan-out on write).
+
+В TimelineEntry пользователя хранятся только самые новые посты - примерно
+TIMELINE_MAX_ENTRIES. Посты не новее границы UserStats.timeline_horizon
+FollowFeedPaginator читает из Follow и Post (fan-out on read) тем же
+запросом, что и посты «звёзд», которые не раскладываются вовсе. Граница
+только растёт: при обрезке ленты и когда подписка приносит больше постов,
+чем помещается.
+
+Новый пост раскладывается по лентам сразу, а дописывание постов автора
+после подписки и обрезка лент идут после коммита в пуле потоков.
+"""
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, Subquery
+
+from .counters import recount_users
+from .models import User, Post, Follow, TimelineEntry, UserStats
+from .paginator import CursorPaginator
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TIMELINE_WORKERS, thread_name_prefix='timeline',
+            )
+        return _executor
+
+
+def schedule(func, *args):
+    """
+    Выполняет func(*args) в пуле после коммита текущей транзакции.
+    """
+    transaction.on_commit(lambda: executor().submit(_run, func, *args))
+
+
+def _run(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Не удалось обновить ленты подписок: %s%r', func.__name__, args)
+    finally:
+        # у каждого потока пула своё соединение с базой
+        connection.close()
+
+
+def is_celebrity(author_id):
+    return UserStats.objects.filter(
+        user=author_id, follower_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS,
+    ).exists()
+
+
+def celebrity_followees(user):
+    """
+    Авторы из подписок пользователя, чьи посты не раскладываются по лентам.
+    """
+    return list(
+        Follow.objects
+        .filter(user=user, author__stats__follower_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS)
+        .values_list('author', flat=True)
+    )
+
+
+def horizon(user_id):
+    return UserStats.objects.filter(user=user_id).values_list('timeline_horizon', flat=True).first()
+
+
+def _insert_entries(entries):
+    # пачками, чтобы не держать в памяти ленты всех подписчиков сразу;
+    # размер одного INSERT Django подбирает сам под ограничения базы
+    entries = iter(entries)
+    total = 0
+    while True:
+        batch = list(itertools.islice(entries, settings.TIMELINE_BATCH_SIZE))
+        if not batch:
+            return total
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+
+
+def _advance(user_id, moment):
+    """
+    Сдвигает границу ленты к moment; строки не новее неё удаляются.
+    """
+    stats = UserStats.objects.filter(user=user_id)
+    if not stats.exists():
+        # строку создаёт пересчёт, как и в stats_for
+        recount_users(User.objects.filter(pk=user_id))
+    stats.filter(Q(timeline_horizon__isnull=True) | Q(timeline_horizon__lt=moment)).update(timeline_horizon=moment)
+    TimelineEntry.objects.filter(user=user_id, pub_date__lte=moment).delete()
+
+
+def trim(user_id):
+    """
+    Оставляет в ленте не больше TIMELINE_MAX_ENTRIES самых новых постов.
+    """
+    limit = settings.TIMELINE_MAX_ENTRIES
+    beyond = (
+        TimelineEntry.objects
+        .filter(user=user_id)
+        .order_by('-pub_date', '-post')
+        .values_list('pub_date', flat=True)[limit:limit + 1]
+    )
+    for moment in beyond:
+        _advance(user_id, moment)
+
+
+def _fill(user_id, posts):
+    """
+    Дописывает в ленту самые новые посты из posts, которые новее её границы.
+    Если их больше TIMELINE_MAX_ENTRIES, граница сдвигается, и остальные
+    читаются при показе ленты.
+    """
+    limit = settings.TIMELINE_MAX_ENTRIES
+    moment = horizon(user_id)
+    if moment is not None:
+        posts = posts.filter(pub_date__gt=moment)
+    rows = list(posts.order_by('-pub_date', '-id').values_list('id', 'pub_date')[:limit + 1])
+    if len(rows) > limit:
+        moment = rows[limit][1]
+        _advance(user_id, moment)
+        rows = [(post_id, pub_date) for post_id, pub_date in rows if pub_date > moment]
+    _insert_entries(
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for post_id, pub_date in rows
+    )
+    trim(user_id)
+
+
+def fan_out_post(post):
+    """
+    Раскладывает новый пост по лентам подписчиков автора (fan-out on write).
+    Посты «звёзд» не раскладываются: их читает FollowFeedPaginator.
+    """
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(author=post.author_id).values_list('user', flat=True)
+    if _insert_entries(
+        TimelineEntry(user_id=user_id, post_id=post.id, pub_date=post.pub_date)
+        for user_id in followers.iterator()
+    ):
+        schedule(trim_followers, post.author_id, post.id)
+
+
+def trim_followers(author_id, post_id):
+    # ленту обрезают не после каждого поста, а в среднем раз за TIMELINE_TRIM_EVERY
+    followers = Follow.objects.filter(author=author_id).values_list('user', flat=True)
+    for user_id in list(followers):
+        if (user_id + post_id) % settings.TIMELINE_TRIM_EVERY == 0:
+            trim(user_id)
+
+
+def add_author(user_id, author_id):
+    """
+    Дописывает в ленту пользователя самые новые посты автора, на которого
+    он подписался. Выполняется в пуле, поэтому подписка проверяется заново.
+    """
+    if is_celebrity(author_id) or not Follow.objects.filter(user=user_id, author=author_id).exists():
+        return
+    _fill(user_id, Post.objects.filter(author=author_id))
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(user=user_id, post__author=author_id).delete()
+
+
+def follower_removed(author_id):
+    """
+    Вызывается после отписки, когда счётчик подписчиков уже уменьшен.
+    Если автор только что перестал быть «звездой», его посты больше не читаются
+    при показе ленты, поэтому пул раскладывает их по лентам оставшихся подписчиков.
+    """
+    count = UserStats.objects.filter(user=author_id).values_list('follower_count', flat=True).first()
+    if count == settings.TIMELINE_CELEBRITY_FOLLOWERS - 1:
+        schedule(fan_out_author, author_id)
+
+
+def fan_out_author(author_id):
+    followers = Follow.objects.filter(author=author_id).values_list('user', flat=True)
+    posts = Post.objects.filter(author=author_id)
+    # уже разложенные посты пропускает ignore_conflicts
+    for user_id in list(followers):
+        _fill(user_id, posts)
+
+
+def rebuild_timeline(user_id):
+    """
+    Пересобирает ленту пользователя из таблиц Follow и Post.
+    """
+    TimelineEntry.objects.filter(user=user_id).delete()
+    UserStats.objects.filter(user=user_id).update(timeline_horizon=None)
+    celebrities = celebrity_followees(user_id)
+    _fill(user_id, Post.objects.filter(author__following__user=user_id).exclude(author__in=celebrities))
+
+
+class FollowFeedPaginator(CursorPaginator):
+    """
+    Курсорная пагинация ленты подписок.
+    Разложенные посты читаются из TimelineEntry одним проходом по индексу
+    (user, pub_date, post), а посты «звёзд» и посты не новее границы ленты -
+    одним запросом к Post по (author, pub_date). Обе выборки сливаются
+    по ключу (pub_date, id).
+    """
+
+    timeline_ordering = ('-pub_date', '-post')
+
+    def __init__(self, user, per_page):
+        super().__init__(Post.objects.select_related('author', 'group'), per_page)
+        self.user = user
+
+    def on_read(self):
+        """
+        Посты подписок, которых нет в TimelineEntry (fan-out on read).
+        """
+        moment = UserStats.objects.filter(user=self.user.pk).values('timeline_horizon')
+        return self.object_list.filter(author__following__user=self.user).filter(
+            Q(author__stats__follower_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS)
+            # без границы сравнение с NULL ложно: лента хранит все посты
+            | Q(pub_date__lte=Subquery(moment))
+        )
+
+    def _fetch(self, values, backwards, limit):
+        entries = TimelineEntry.objects.filter(user=self.user).select_related('post__author', 'post__group')
+        posts = self.on_read()
+        if values is not None:
+            entries = entries.filter(self._seek(values, backwards, self.timeline_ordering))
+            posts = posts.filter(self._seek(values, backwards))
+        entries = entries.order_by(*self._ordering(backwards, self.timeline_ordering))[:limit]
+        items = [entry.post for entry in entries]
+        items += list(posts.order_by(*self._ordering(backwards))[:limit])
+        # после смены статуса автора пост может оказаться в обеих выборках
+        items = list({post.id: post for post in items}.values())
+        items.sort(key=lambda post: (post.pub_date, post.id), reverse=not backwards)
+        return items[:limit]
@@ -0,0 +1,182 @@
+"""
+Приём картинок постов с ограничением по памяти.
+
+BoundedImageUploadHandler пишет загрузку на диск кусками и уже по первым
+байтам отбрасывает файлы, которые не похожи на картинку, а также всё,
+что длиннее IMAGE_UPLOAD_MAX_BYTES. Он подключается только к view с формой
+картинки декоратором image_uploads: остальные загрузки на сайте
+(админка, другие файловые поля) принимаются обычными обработчиками. BoundedImageField проверяет размер
+в пикселях по заголовку до декодирования (защита от «бомб»), уменьшает
+слишком большие оригиналы и пересохраняет картинку без EXIF.
+"""
+import os
+import warnings
+from functools import wraps
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image, ImageOps
+
+# сигнатуры допустимых форматов: смещение, байты, формат Pillow
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'JPEG'),
+    (0, b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (0, b'GIF87a', 'GIF'),
+    (0, b'GIF89a', 'GIF'),
+    (8, b'WEBP', 'WEBP'),
+)
+HEADER_SIZE = 12
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def sniff(header):
+    """
+    Формат картинки по первым байтам файла или None.
+    """
+    for offset, magic, image_format in SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            if image_format != 'WEBP' or header.startswith(b'RIFF'):
+                return image_format
+    return None
+
+
+class BoundedImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Всегда пишет загрузку во временный файл, не держа её в памяти.
+    Отклонённый файл дочитывается из запроса без записи,
+    а причина попадает в атрибут upload_error для BoundedImageField.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = b''
+        self.received = 0
+        self.file.upload_error = None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.file.upload_error:
+            return None
+        if len(self.header) < HEADER_SIZE:
+            self.header += raw_data[:HEADER_SIZE - len(self.header)]
+            if len(self.header) >= HEADER_SIZE and sniff(self.header) is None:
+                self.reject('invalid_image')
+                return None
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.reject('file_too_large')
+            return None
+        self.file.write(raw_data)
+        return None
+
+    def reject(self, code):
+        self.file.upload_error = code
+        self.file.seek(0)
+        self.file.truncate()
+
+    def file_complete(self, file_size):
+        if not self.file.upload_error and sniff(self.header) is None:
+            # файл короче заголовка
+            self.file.upload_error = 'invalid_image'
+        return super().file_complete(file_size)
+
+
+def image_uploads(view):
+    """
+    Декоратор view, принимающего картинку поста. Обработчики загрузки можно
+    заменить только до первого чтения request.POST, а CsrfViewMiddleware
+    читает его раньше view, поэтому проверка CSRF выполняется здесь, после замены.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [BoundedImageUploadHandler(request)]
+        return protected(request, *args, **kwargs)
+    return wrapper
+
+
+class BoundedImageField(forms.ImageField):
+    default_error_messages = {
+        'file_too_large': 'Файл больше %(limit)s МБ.',
+        'too_many_pixels': 'Картинка больше %(limit)s мегапикселей.',
+    }
+
+    def to_python(self, data):
+        if data in self.empty_values:
+            return super().to_python(data)
+        error = getattr(data, 'upload_error', None)
+        if error == 'file_too_large' or (error is None and data.size > settings.IMAGE_UPLOAD_MAX_BYTES):
+            raise ValidationError(
+                self.error_messages['file_too_large'], code='file_too_large',
+                params={'limit': settings.IMAGE_UPLOAD_MAX_BYTES // (1024 * 1024)},
+            )
+        if error or sniff(self._header(data)) is None:
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image')
+        self._check_pixels(data)
+        image_file = super().to_python(data)
+        return sanitize(image_file)
+
+    @staticmethod
+    def _header(data):
+        data.seek(0)
+        header = data.read(HEADER_SIZE)
+        data.seek(0)
+        return header
+
+    def _check_pixels(self, data):
+        # Image.open читает только заголовок, пиксели не декодируются
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                width, height = Image.open(data).size
+        except Image.DecompressionBombError:
+            width = height = float('inf')
+        except Exception as exc:
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+        finally:
+            data.seek(0)
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            raise ValidationError(
+                self.error_messages['too_many_pixels'], code='too_many_pixels',
+                params={'limit': settings.IMAGE_UPLOAD_MAX_PIXELS // 1000000},
+            )
+
+
+def sanitize(uploaded):
+    """
+    Пересохраняет картинку поверх загруженного файла: первый кадр, поворот по EXIF
+    применён, сами EXIF-данные не сохраняются, длинная сторона
+    не больше IMAGE_MAX_DIMENSION. JPEG декодируется сразу в уменьшенном масштабе.
+    """
+    limit = settings.IMAGE_MAX_DIMENSION
+    uploaded.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        image = Image.open(uploaded)
+        image_format = image.format
+        icc_profile = image.info.get('icc_profile')
+        image.draft('RGB', (limit, limit))
+        image = ImageOps.exif_transpose(image)
+    if max(image.size) > limit:
+        image.thumbnail((limit, limit), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+
+    # результат пишется в тот же временный файл: его закроет и удалит сам запрос
+    uploaded.seek(0)
+    uploaded.truncate()
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if image_format in ('JPEG', 'WEBP'):
+        options['quality'] = settings.IMAGE_UPLOAD_QUALITY
+    image.save(uploaded.file, image_format, **options)
+    uploaded.size = uploaded.tell()
+    uploaded.seek(0)
+    uploaded.name = '%s.%s' % (os.path.splitext(uploaded.name)[0], EXTENSIONS[image_format])
+    uploaded.content_type = Image.MIME[image_format]
+    uploaded.image = image
+    return uploaded
@@ -1,10 +1,29 @@
 from django.urls import path
-from . import views
+from . import api, live, pagecache, views
 
 urlpatterns = [
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
     path("group/<slug>/", views.group_posts, name="group_posts"),
+    path("search/", views.search, name="search"),
+    path("cache/purge/", pagecache.purge_view, name="cache_purge"),
+    # JSON API для чтения, см. posts.api
+    path("api/posts/", api.index, name="api_index"),
+    path("api/groups/<slug>/posts/", api.group_posts, name="api_group_posts"),
+    path("api/users/<str:username>/posts/", api.profile, name="api_profile"),
+    path("api/users/<str:username>/posts/<int:post_id>/", api.post_view, name="api_post"),
+    path("api/users/<str:username>/posts/<int:post_id>/comments/", api.comments, name="api_comments"),
+    path(
+        "api/users/<str:username>/posts/<int:post_id>/comments/<int:comment_id>/replies/",
+        api.comment_replies,
+        name="api_comment_replies",
+    ),
+    path("api/follow/", api.follow_index, name="api_follow_index"),
+    # живые ленты: server-sent events или long-poll, см. posts.live
+    path("events/", live.index_events, name="index_events"),
+    path("group/<slug>/events/", live.group_events, name="group_events"),
+    path("follow/events/", live.follow_events, name="follow_events"),
+    path("<str:username>/<int:post_id>/events/", live.post_events, name="post_events"),
     # Главная страница
     path('', views.index, name='index'),
     # Профайл пользователя
@@ -17,6 +36,11 @@ urlpatterns = [
         name='post_edit'
     ),
     path("<username>/<int:post_id>/comment", views.add_comment, name="add_comment"),
+    path(
+        "<str:username>/<int:post_id>/comments/<int:comment_id>/",
+        views.comment_thread,
+        name="comment_thread",
+    ),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
 ]
\ No newline at end of file
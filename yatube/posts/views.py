@@ -1,51 +1,59 @@
+from urllib.parse import urlencode
+
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
 
+from . import pages, writebehind
 from .forms import PostForm, CommentForm
-from .models import User, Post, Group, Comment, Follow
-
-
+from .cards import prefetch_cards
+from .conditional import conditional
+from .models import User, Post, Comment
+from .pagecache import page_cache
+from .profiling import query_budget
+from .search import SearchPaginator
+from .threads import depth, replies_paginator, reply_parent
+from .uploads import image_uploads
+
+
+@query_budget(4)
+@page_cache
+@conditional(lambda request: Post.objects.all())
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)  # показывать по 10 записей на странице.
-    page_number = request.GET.get('page')  # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number)  # получить записи с нужным смещением
-    return render(
-        request,
-        'index.html',
-        {'page': page, 'paginator': paginator}
-    )
+    paginator = pages.index_paginator(request)
+    page = paginator.get_page(request.GET.get('cursor'))  # записи после курсора, без OFFSET и COUNT
+    return render(request, 'index.html', pages.index_context(request, paginator, page))
 
 
+@query_budget(5)
+@page_cache
+@conditional(lambda request, slug: Post.objects.filter(group__slug=slug))
 def group_posts(request, slug):
-    # тут тело функции
-    group = get_object_or_404(Group, slug=slug)
-    # posts = (
-    #     Post.objects.filter(group=group)
-    #         .order_by("-pub_date")
-    #         .all()
-    # )
-    posts = (
-        Post.objects.filter(group=group)
-        .select_related("author")
-        .order_by("-pub_date")
-        .all()
-    )
-    paginator = Paginator(posts, 2)  # показывать по 2 записей на странице.
-    page_number = request.GET.get('page')  # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number)  # получить записи с нужным смещением
+    paginator = pages.group_paginator(request, slug)
+    group = pages.get_group(slug)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'group.html', pages.group_context(request, group, paginator, page))
+
+
+@query_budget(4)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page = paginator = None
+    if query:
+        paginator = SearchPaginator(query, 10)
+        page = paginator.get_page(request.GET.get('cursor'))
+        # карточки найденных постов одним запросом к кэшу
+        prefetch_cards(document.post for document in page if document.kind != 'group')
     context = {
-        "posts": posts,
-        "group": group,
+        'query': query,
         'page': page,
-        'paginator': paginator
+        'paginator': paginator,
+        'query_string': urlencode({'q': query}),
     }
-    return render(request, 'group.html', context)
+    return render(request, 'search.html', context)
 
 
 @login_required()
+@image_uploads
 def new_post(request):
     # проверим, пришёл ли к нам POST-запрос или какой-то другой:
     if request.method == 'POST':
@@ -81,63 +89,44 @@ def new_post(request):
     return render(request, 'new_post.html', {'form': form})
 
 
+@query_budget(6)
+@page_cache
+@conditional(lambda request, username: Post.objects.filter(author__username=username))
 def profile(request, username):
-    # тут тело функции
-    profile = get_object_or_404(User.objects.annotate(posts_count=Count("posts")), username=username)
-    post_list = (
-        Post
-            .objects
-            .filter(author=profile)
-            .order_by('-pub_date')
-            .all()
-    )
-    count_post = post_list.count()
-    paginator = Paginator(post_list, 5)  # показывать по 5 записей на странице.
-    page_number = request.GET.get('page')  # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number)  # получить записи с нужным смещением
-    followers = Follow.objects.filter(author=profile.id).count()
-    follows = Follow.objects.filter(user=profile.id).count()
-    following = Follow.objects.filter(user=request.user.id, author=profile.id).all()
-    context = {
-        "post_list": post_list,
-        "count_post": count_post,
-        "profile": profile,
-        'page': page,
-        'paginator': paginator,
-        "followers": followers,
-        "follows": follows,
-        "following": following,
-    }
-    return render(request, 'profile.html', context)
+    profile = pages.get_profile(request, username)
+    paginator = pages.profile_paginator(username)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'profile.html', pages.profile_context(request, profile, paginator, page))
 
 
+@query_budget(8)
+@page_cache
+@conditional(lambda request, username, post_id, form=None: Post.objects.filter(pk=post_id))
 def post_view(request, username, post_id, form=None):
-    profile = get_object_or_404(User.objects.annotate(posts_count=Count("posts")), username=username)
-    post = get_object_or_404(
-        Post.objects.select_related("author")
-            .select_related("group"),
-        pk=post_id, author=profile
-    )
-    if form is None:
-        form = CommentForm(request.POST or None)
-    # комментарии к посту
-    items = Comment.objects.select_related("post", "author").filter(post=post)
-    followers = Follow.objects.filter(author=profile.id).count()
-    follows = Follow.objects.filter(user=profile.id).count()
-    following = Follow.objects.filter(user=request.user.id, author=profile.id).all()
-    context = {
-        "profile": profile,
-        "post": post,
-        "items": items,
-        "form": form,
-        "followers": followers,
-        "follows": follows,
-        "following": following,
-    }
-    return render(request, "post.html", context)
+    paginator = pages.comments_paginator(request, post_id)
+    profile = pages.get_profile(request, username)
+    post = pages.get_post(username, post_id)
+    page = paginator.get_page(request.GET.get("cursor"))
+    return render(request, "post.html", pages.post_context(request, profile, post, paginator, page, form))
+
+
+@query_budget(5)
+@conditional(lambda request, username, post_id, comment_id: Post.objects.filter(pk=post_id))
+def comment_thread(request, username, post_id, comment_id):
+    """
+    Ветка комментария целиком, страницами в порядке обхода в глубину.
+    Без JavaScript сюда ведёт ссылка «Показать все ответы».
+    """
+    post = get_object_or_404(Post.objects.select_related("author", "group"), pk=post_id, author__username=username)
+    comment = get_object_or_404(Comment.objects.select_related("author"), pk=comment_id, post=post)
+    page = replies_paginator(comment).get_page(request.GET.get("cursor"))
+    for reply in page:
+        reply.depth = depth(reply) - depth(comment)
+    return render(request, "comment_thread.html", {"post": post, "comment": comment, "page": page})
 
 
 @login_required
+@image_uploads
 def post_edit(request, username, post_id):
     profile = get_object_or_404(User, username=username)
     post = get_object_or_404(Post, pk=post_id, author=profile)
@@ -167,35 +156,26 @@ def add_comment(request, username, post_id):
     if request.method == "POST":
         form = CommentForm(request.POST or None)
         if form.is_valid():
-            comment = form.save(commit=False)
-            comment.author = request.user
-            comment.post = post
-            comment.save()
+            parent = form.cleaned_data.get("parent")
+            # отвечать можно только на комментарии того же поста
+            parent = reply_parent(parent) if parent and parent.post_id == post.id else None
+            writebehind.comment(post.id, request.user.id, form.cleaned_data["text"], parent.id if parent else None)
             return redirect("post", username=username, post_id=post_id)
     else:
         form = CommentForm(request.POST or None)
     return post_view(request, username, post_id, form=form)
 
 
+@query_budget(5)
 @login_required
+@conditional(lambda request: Post.objects.filter(author__following__user=request.user), private=True)
 def follow_index(request):
     """
     View-функция страницы, куда будут выведены посты авторов, на которых подписан текущий пользователь.
     """
-    # информация о текущем пользователе доступна в переменной request.user
-    following = Follow.objects.filter(user=request.user).all()
-    author_list = []
-    for author in following:
-        author_list.append(author.author.id)
-    post_list = Post.objects.filter(author__in=author_list).order_by('-pub_date').all()
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    context = {
-        'page': page,
-        'paginator': paginator
-    }
-    return render(request, 'follow.html', context)
+    paginator = pages.follow_paginator(request)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'follow.html', pages.follow_context(request, paginator, page))
 
 
 @login_required
@@ -203,11 +183,10 @@ def profile_follow(request, username):
     """
     View-функция для подписки на автора
     """
-    user = request.user
     author = get_object_or_404(User, username=username)
-    following_check = Follow.objects.filter(user=user.id, author=author.id).count()
-    if following_check == 0 and author.id != user.id:
-        Follow.objects.create(user=request.user, author=author)
+    if author.id != request.user.id:
+        # повторная подписка ничего не меняет, см. posts.writebehind
+        writebehind.follow(request.user.id, author.id)
     return redirect('profile', username=username)
 
 
@@ -216,11 +195,8 @@ def profile_unfollow(request, username):
     """
     View-функция для отписки от автора
     """
-    user = request.user.id
     author = get_object_or_404(User, username=username)
-    follow_check = Follow.objects.filter(user=user, author=author.id).count()
-    if follow_check == 1:
-        Follow.objects.filter(user=request.user, author=author).delete()
+    writebehind.unfollow(request.user.id, author.id)
     return redirect("profile", username=username)
 
 
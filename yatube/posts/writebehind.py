@@ -0,0 +1,229 @@
+"""
+Запись подписок, отписок и комментариев с отложенным режимом.
+
+Прямая запись идемпотентна: подписка - это get_or_create на уникальном
+ограничении Follow, отписка - удаление по условию, так что повторный запрос
+или гонка двух запросов ничего не ломают.
+
+settings.WRITE_BEHIND:
+    'off'  - всегда писать сразу в базу;
+    'on'   - складывать действия в локальную очередь;
+    'auto' - писать сразу, а в очередь откладывать то, что не удалось записать
+             из-за занятой базы (всплеск нагрузки на SQLite).
+
+Очередь - файл SQLite WRITE_BEHIND_QUEUE на диске сервера. Команда writebehind
+разбирает её пачками в одной транзакции: подписки - через get_or_create,
+комментарии - через bulk_create, а их сигналы (счётчики, ленты, поиск)
+отправляются вручную. Номер последней применённой записи хранится
+в основной базе (QueuePosition) и сдвигается в той же транзакции, что и пачка,
+поэтому после сбоя ничего не применяется дважды.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+
+from . import rendering
+from .models import User, Post, Comment, Follow, QueuePosition
+
+logger = logging.getLogger(__name__)
+
+FOLLOW = 'follow'
+UNFOLLOW = 'unfollow'
+COMMENT = 'comment'
+
+_local = threading.local()
+
+
+def _queue():
+    """
+    Соединение с файлом очереди, своё у каждого потока и процесса.
+    """
+    path = settings.WRITE_BEHIND_QUEUE
+    if getattr(_local, 'key', None) != (path, os.getpid()):
+        queue = sqlite3.connect(path, timeout=30, isolation_level=None)
+        queue.execute('PRAGMA journal_mode=WAL')
+        # запись в очередь должна пережить не только падение процесса, но и сервера
+        queue.execute('PRAGMA synchronous=FULL')
+        # AUTOINCREMENT не выдаёт id повторно после удаления разобранных записей,
+        # иначе новые записи оказались бы «уже применёнными» по QueuePosition
+        queue.execute(
+            'CREATE TABLE IF NOT EXISTS queue ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, '
+            'payload TEXT NOT NULL, enqueued REAL NOT NULL)'
+        )
+        _local.connection, _local.key = queue, (path, os.getpid())
+    return _local.connection
+
+
+def enqueue(kind, **payload):
+    _queue().execute(
+        'INSERT INTO queue (kind, payload, enqueued) VALUES (?, ?, ?)',
+        (kind, json.dumps(payload), time.time()),
+    )
+
+
+# коды PostgreSQL: lock_timeout, конфликт сериализации, взаимная блокировка
+BUSY_PGCODES = {'55P03', '40001', '40P01'}
+
+
+def _busy(exc):
+    """
+    Ошибка от занятой базы, которую можно переждать в очереди. Остальные
+    (нет таблицы, оборвалось соединение, пуст пул) в очереди не исправятся.
+    """
+    if getattr(exc.__cause__, 'pgcode', None) in BUSY_PGCODES:
+        return True
+    message = str(exc)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def _write(kind, payload, apply):
+    """
+    Возвращает True, если действие отложено в очередь.
+    """
+    mode = settings.WRITE_BEHIND
+    if mode != 'on':
+        try:
+            with transaction.atomic():
+                apply()
+            return False
+        except OperationalError as exc:
+            if mode != 'auto' or not _busy(exc):
+                raise
+            logger.warning('База занята, %s отложен в очередь', kind)
+    enqueue(kind, **payload)
+    return True
+
+
+def follow(user_id, author_id):
+    return _write(
+        FOLLOW, {'user': user_id, 'author': author_id},
+        lambda: Follow.objects.get_or_create(user_id=user_id, author_id=author_id),
+    )
+
+
+def unfollow(user_id, author_id):
+    return _write(
+        UNFOLLOW, {'user': user_id, 'author': author_id},
+        lambda: Follow.objects.filter(user=user_id, author=author_id).delete(),
+    )
+
+
+def comment(post_id, author_id, text, parent_id=None):
+    return _write(
+        COMMENT, {'post': post_id, 'author': author_id, 'text': text, 'parent': parent_id},
+        lambda: Comment.objects.create(post_id=post_id, author_id=author_id, text=text, parent_id=parent_id),
+    )
+
+
+def _created(model, instance):
+    # bulk_create не отправляет сигналы, а от них зависят счётчики, ленты и поиск
+    post_save.send(
+        sender=model, instance=instance, created=True, update_fields=None, raw=False,
+        using=router.db_for_write(model),
+    )
+
+
+def _apply_follows(actions):
+    """
+    actions: {(user, author): FOLLOW или UNFOLLOW} - последнее действие по каждой паре.
+    """
+    users = {user for pair in actions for user in pair}
+    alive = set(User.objects.filter(pk__in=users).values_list('pk', flat=True))
+    wanted = [
+        pair for pair, kind in actions.items()
+        if kind == FOLLOW and pair[0] != pair[1] and set(pair) <= alive
+    ]
+    for user, author in wanted:
+        # по одной, а не bulk_create(ignore_conflicts=True): подписку мог уже создать прямой
+        # запрос или другой воркер, и тогда сигналы (счётчики, лента, граф) отправлять нельзя.
+        # get_or_create отправляет post_save только для действительно вставленной строки
+        Follow.objects.get_or_create(user_id=user, author_id=author)
+
+    unwanted = [pair for pair, kind in actions.items() if kind == UNFOLLOW]
+    if unwanted:
+        condition = Q()
+        for user, author in unwanted:
+            condition |= Q(user=user, author=author)
+        # delete() по выборке отправляет post_delete для каждой подписки
+        Follow.objects.filter(condition).delete()
+
+
+def _apply_comments(payloads):
+    posts = set(Post.objects.filter(pk__in={item['post'] for item in payloads}).values_list('pk', flat=True))
+    authors = set(User.objects.filter(pk__in={item['author'] for item in payloads}).values_list('pk', flat=True))
+    parents = dict(
+        Comment.objects
+        .filter(pk__in={item['parent'] for item in payloads if item['parent']})
+        .values_list('pk', 'post')
+    )
+    comments = [
+        Comment(
+            post_id=item['post'], author_id=item['author'], text=item['text'],
+            parent_id=item['parent'] if parents.get(item['parent']) == item['post'] else None,
+        )
+        # пост или автор могли быть удалены, пока запись ждала в очереди
+        for item in payloads if item['post'] in posts and item['author'] in authors
+    ]
+    if connection.features.can_return_ids_from_bulk_insert:
+        Comment.objects.bulk_create(rendering.render_instances(comments))
+        for instance in comments:
+            _created(Comment, instance)
+    else:
+        # SQLite не возвращает id из bulk_create, а сигналам они нужны (путь ветки, поиск);
+        # пачка всё равно пишется одной транзакцией
+        for instance in comments:
+            instance.save()
+
+
+def drain(batch_size=None):
+    """
+    Применяет одну пачку очереди. Возвращает число разобранных записей.
+    """
+    queue = _queue()
+    with transaction.atomic():
+        position, _ = QueuePosition.objects.select_for_update().get_or_create(queue=settings.WRITE_BEHIND_NAME)
+        rows = queue.execute(
+            'SELECT id, kind, payload FROM queue WHERE id > ? ORDER BY id LIMIT ?',
+            (position.last_id, batch_size or settings.WRITE_BEHIND_BATCH_SIZE),
+        ).fetchall()
+        if not rows:
+            return 0
+        follows, comments = {}, []
+        for _, kind, payload in rows:
+            payload = json.loads(payload)
+            if kind == COMMENT:
+                comments.append(payload)
+            else:
+                follows[(payload['user'], payload['author'])] = kind
+        _apply_follows(follows)
+        if comments:
+            _apply_comments(comments)
+        position.last_id = rows[-1][0]
+        position.save()
+    # применённое можно удалить: после сбоя до этой строки записи отсеет QueuePosition
+    queue.execute('DELETE FROM queue WHERE id <= ?', (position.last_id,))
+    return len(rows)
+
+
+def stats():
+    """
+    Метрики очереди: depth - сколько записей ждёт, lag - сколько секунд ждёт
+    самая старая из них, applied - номер последней применённой записи.
+    """
+    applied = (
+        QueuePosition.objects.filter(queue=settings.WRITE_BEHIND_NAME).values_list('last_id', flat=True).first()
+        or 0
+    )
+    depth, oldest = _queue().execute(
+        'SELECT COUNT(*), MIN(enqueued) FROM queue WHERE id > ?', (applied,),
+    ).fetchone()
+    return {'depth': depth, 'lag': time.time() - oldest if oldest else 0.0, 'applied': applied}
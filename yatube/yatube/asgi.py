@@ -0,0 +1,209 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named ``application``:
+
+    gunicorn yatube.asgi:application -k uvicorn.workers.UvicornWorker
+
+Django 2.2 не поддерживает ASGI, поэтому здесь свой небольшой обработчик.
+Чтение тела запроса и отправка ответа идут в цикле событий сервера и не
+занимают потоков, так что медленные клиенты не держат воркер. Сам запрос
+проходит обычный стек middleware Django в пуле из ASGI_THREADS потоков,
+а страницы для чтения обслуживают асинхронные view, см. yatube.asgi_urls.
+Ответы с async_content() (живые ленты, posts.live) ждут событий прямо
+в цикле событий и не держат поток, пока клиент подключён.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core import signals
+from django.core.handlers import base
+from django.core.handlers.wsgi import WSGIRequest, get_script_name
+from django.db import close_old_connections
+from django.urls import set_script_prefix
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+
+def build_environ(scope, body):
+    """
+    WSGI-окружение для ASGI-запроса; body - файл с телом запроса.
+    """
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode().decode('latin-1'),
+        # WSGI передаёт путь байтами в latin-1
+        'PATH_INFO': path.encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # живые ленты под ASGI не держат потоков, см. posts.live.enabled
+        'yatube.asgi': True,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    # тело уже прочитано целиком, в том числе при chunked-передаче без Content-Length
+    environ['CONTENT_LENGTH'] = str(body.seek(0, os.SEEK_END))
+    body.seek(0)
+    return environ
+
+
+def response_headers(response):
+    headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response.items()]
+    headers += [
+        (b'Set-Cookie', cookie.output(header='').strip().encode('latin-1'))
+        for cookie in response.cookies.values()
+    ]
+    return headers
+
+
+class ASGIHandler(base.BaseHandler):
+    def __init__(self):
+        super().__init__()
+        self.load_middleware()
+        self.executor = ThreadPoolExecutor(settings.ASGI_THREADS, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Неподдерживаемый тип соединения: %s' % scope['type'])
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        with body:
+            response = await loop.run_in_executor(self.executor, self.get_response_for, scope, body)
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers(response)})
+        if hasattr(response, 'async_content'):
+            await self.send_async_content(response, receive, send)
+            await loop.run_in_executor(self.executor, response.close)
+        elif response.streaming:
+            chunks = iter(response)
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+            await loop.run_in_executor(self.executor, response.close)
+        else:
+            await send({'type': 'http.response.body', 'body': response.content})
+
+    @staticmethod
+    async def send_async_content(response, receive, send):
+        """
+        Отправляет тело из async_content(), пока клиент не отключится.
+        """
+        async def disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnected = asyncio.ensure_future(disconnect())
+        chunks = response.async_content()
+        try:
+            while True:
+                chunk = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait({chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    chunk.cancel()
+                    # генератор можно закрыть, только когда отмена до него дошла
+                    await asyncio.wait({chunk})
+                    return
+                try:
+                    content = chunk.result()
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': response.make_bytes(content), 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            disconnected.cancel()
+            await chunks.aclose()
+
+    @staticmethod
+    async def read_body(receive):
+        """
+        Читает тело запроса целиком; большое уходит во временный файл.
+        Возвращает None, если клиент отключился.
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    def get_response_for(self, scope, body):
+        """
+        Выполняется в потоке пула: тот же путь запроса, что в WSGIHandler.
+        """
+        environ = build_environ(scope, body)
+        set_script_prefix(get_script_name(environ))
+        signals.request_started.send(sender=self.__class__, environ=environ)
+        request = WSGIRequest(environ)
+        request.urlconf = settings.ASGI_URLCONF
+        response = self.get_response(request)
+        response._handler_class = self.__class__
+        if hasattr(response, 'async_content'):
+            # тело ждёт событий в цикле событий, база ему больше не нужна
+            close_old_connections()
+        elif not response.streaming:
+            # подписчики request_finished закрывают соединения этого потока
+            response.close()
+        return response
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # граф подписок грузится в фоне, пока запросы отвечают из SQL, см. posts.followgraph
+                from posts import followgraph
+                followgraph.warm()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
+
+
+application = get_asgi_application()
+
+# шаблоны разбираются до первого запроса, см. posts.template_cache
+from posts.template_cache import precompile  # noqa: E402
+
+precompile()
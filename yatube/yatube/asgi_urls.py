@@ -0,0 +1,36 @@
+"""
+URLconf ASGI-входа: те же адреса и имена, что в yatube.urls,
+но страницы для чтения обслуживают асинхронные view из posts.async_views.
+"""
+from django.urls import URLPattern, URLResolver
+
+from posts import async_views, views
+from yatube import urls
+
+handler404 = urls.handler404
+handler500 = urls.handler500
+
+ASYNC_VIEWS = {
+    views.index: async_views.index,
+    views.group_posts: async_views.group_posts,
+    views.profile: async_views.profile,
+    views.post_view: async_views.post_view,
+    views.follow_index: async_views.follow_index,
+}
+
+
+def with_async_views(patterns):
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern, with_async_views(pattern.url_patterns),
+                pattern.default_kwargs, pattern.app_name, pattern.namespace,
+            )
+        elif isinstance(pattern, URLPattern) and pattern.callback in ASYNC_VIEWS:
+            pattern = URLPattern(pattern.pattern, ASYNC_VIEWS[pattern.callback], pattern.default_args, pattern.name)
+        result.append(pattern)
+    return result
+
+
+urlpatterns = with_async_views(urls.urlpatterns)
@@ -0,0 +1,230 @@
+"""
+Пул соединений с базой внутри процесса.
+
+Django без CONN_MAX_AGE открывает соединение на каждый запрос, а с ним
+держит по соединению на каждый поток. Бэкенды yatube.db.backends.* вместо
+этого берут соединение из общего пула процесса и возвращают его туда
+при close(), то есть в конце каждого запроса.
+
+Параметры в DATABASES[...]['OPTIONS']['POOL']:
+    MAX_SIZE               - сколько соединений пул держит одновременно;
+    MAX_LIFETIME           - через сколько секунд соединение закрывается и
+                             открывается заново (балансировщики, утечки памяти
+                             на стороне сервера);
+    HEALTH_CHECK_INTERVAL  - соединение, простоявшее дольше, проверяется
+                             запросом SELECT 1 перед выдачей;
+    TIMEOUT                - сколько ждать свободного соединения.
+
+После fork (gunicorn --preload) пул создаётся заново, как и пул кэша
+в yatube.redis_cache.
+"""
+import os
+import threading
+import time
+
+from django.db import OperationalError
+
+DEFAULTS = {
+    'MAX_SIZE': 20,
+    'MAX_LIFETIME': 30 * 60,
+    'HEALTH_CHECK_INTERVAL': 30,
+    'TIMEOUT': 10,
+}
+
+
+class PooledConnection:
+    __slots__ = ('raw', 'created', 'released')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created = self.released = time.monotonic()
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size, max_lifetime, health_check_interval, timeout):
+        self.connect = connect
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.lock = threading.Condition()
+        self.idle = []
+        self.in_use = {}
+        self.metrics = dict.fromkeys(
+            ('connects', 'reuses', 'recycled', 'failed_checks', 'discarded', 'timeouts', 'waits'), 0,
+        )
+        self.wait_time = 0.0
+
+    def acquire(self):
+        started = time.monotonic()
+        while True:
+            pooled = self._reserve(started)
+            if not isinstance(pooled, PooledConnection):
+                return self._connect(pooled)
+            # проверка идёт без блокировки: полумёртвый сокет не должен держать остальные потоки
+            problem = self._check(pooled)
+            with self.lock:
+                if problem is None:
+                    self.metrics['reuses'] += 1
+                    return pooled.raw
+                del self.in_use[id(pooled.raw)]
+                self.metrics[problem] += 1
+                self.lock.notify()
+            self._close(pooled.raw)
+
+    def _reserve(self, started):
+        """
+        Занимает свободное соединение или место под новое; ждёт, если пул полон.
+        """
+        with self.lock:
+            while True:
+                if self.idle:
+                    pooled = self.idle.pop()
+                    self.in_use[id(pooled.raw)] = pooled
+                    return pooled
+                if len(self.in_use) < self.max_size:
+                    # место под новое соединение занимаем заранее, а подключаемся без блокировки
+                    placeholder = object()
+                    self.in_use[id(placeholder)] = placeholder
+                    return placeholder
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise OperationalError(
+                        'Нет свободных соединений в пуле: занято %d из %d' % (len(self.in_use), self.max_size)
+                    )
+                self.metrics['waits'] += 1
+                waited = time.monotonic()
+                self.lock.wait(remaining)
+                self.wait_time += time.monotonic() - waited
+
+    def _connect(self, placeholder):
+        try:
+            raw = self.connect()
+        except Exception:
+            with self.lock:
+                del self.in_use[id(placeholder)]
+                self.lock.notify()
+            raise
+        with self.lock:
+            del self.in_use[id(placeholder)]
+            self.in_use[id(raw)] = PooledConnection(raw)
+            self.metrics['connects'] += 1
+        return raw
+
+    def _check(self, pooled):
+        """
+        Проверяет занятое соединение перед выдачей: None, если оно годно,
+        иначе имя метрики причины.
+        """
+        now = time.monotonic()
+        if now - pooled.created > self.max_lifetime:
+            return 'recycled'
+        if now - pooled.released > self.health_check_interval:
+            try:
+                cursor = pooled.raw.cursor()
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+                cursor.close()
+            except Exception:
+                return 'failed_checks'
+        return None
+
+    def release(self, raw, discard=False):
+        with self.lock:
+            pooled = self.in_use.pop(id(raw), None)
+            if pooled is None:
+                # соединение не из этого пула (например, открыто до fork)
+                discard = True
+            elif not discard:
+                try:
+                    # незавершённая транзакция не должна достаться следующему запросу
+                    raw.rollback()
+                except Exception:
+                    discard = True
+            if discard or time.monotonic() - pooled.created > self.max_lifetime:
+                self.metrics['discarded' if discard else 'recycled'] += 1
+                self._close(raw)
+            else:
+                pooled.released = time.monotonic()
+                self.idle.append(pooled)
+            self.lock.notify()
+
+    @staticmethod
+    def _close(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self.lock:
+            for pooled in self.idle:
+                self._close(pooled.raw)
+            self.idle = []
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                self.metrics,
+                size=len(self.in_use) + len(self.idle),
+                in_use=len(self.in_use),
+                idle=len(self.idle),
+                max_size=self.max_size,
+                wait_time=round(self.wait_time, 3),
+            )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options, connect):
+    key = (alias, os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            options = dict(DEFAULTS, **options)
+            _pools[key] = ConnectionPool(
+                connect,
+                max_size=options['MAX_SIZE'],
+                max_lifetime=options['MAX_LIFETIME'],
+                health_check_interval=options['HEALTH_CHECK_INTERVAL'],
+                timeout=options['TIMEOUT'],
+            )
+        return _pools[key]
+
+
+def stats():
+    """
+    Метрики всех пулов текущего процесса по алиасам баз.
+    """
+    with _pools_lock:
+        pools = [(alias, pool) for (alias, pid), pool in _pools.items() if pid == os.getpid()]
+    return {alias: pool.stats() for alias, pool in pools}
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Примесь к DatabaseWrapper конкретного бэкенда: соединение берётся из пула
+    и при close() возвращается в него, а не закрывается.
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('POOL', None)
+        return params
+
+    @property
+    def pool(self):
+        options = self.settings_dict['OPTIONS'].get('POOL', {})
+        params = self.get_connection_params()
+        return get_pool(self.alias, options, lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(params))
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire()
+
+    def _close(self):
+        if self.connection is not None:
+            # в сломанной транзакции или после ошибки соединение в пул не возвращаем
+            broken = self.in_atomic_block or (self.errors_occurred and not self.is_usable())
+            self.pool.release(self.connection, discard=broken)
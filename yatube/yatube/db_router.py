@@ -0,0 +1,90 @@
+"""
+Чтение с реплик, запись в основную базу.
+
+Реплики - алиасы из settings.DATABASE_REPLICAS (в settings.py они строятся
+из DATABASE_REPLICA_URLS). На реплику уходят только чтения GET-запросов,
+которые ещё ничего не записали и не находятся внутри транзакции; команды,
+воркеры и фоновые потоки всегда работают с основной базой.
+
+Чтобы автор сразу видел свой пост или комментарий, ReplicaPinningMiddleware
+после любой записи ставит cookie, и следующие REPLICA_PIN_SECONDS секунд
+все чтения этого браузера идут в основную базу, пока реплики догоняют её.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'pin_primary'
+
+_state = threading.local()
+
+
+def replica_reads():
+    """
+    Можно ли сейчас читать с реплики; нужно, чтобы передать это решение
+    в другой поток, см. posts.aio.
+    """
+    return getattr(_state, 'replica_reads', False)
+
+
+@contextmanager
+def replica_reads_allowed(allowed):
+    previous = replica_reads()
+    _state.replica_reads = allowed
+    try:
+        yield
+    finally:
+        _state.replica_reads = previous
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (
+            settings.DATABASE_REPLICAS
+            and getattr(_state, 'replica_reads', False)
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # после первой записи остаток запроса читает основную базу
+        _state.replica_reads = False
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # на репликах те же данные, что и в основной базе
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схему на реплики приносит репликация
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Должен стоять первым в MIDDLEWARE, чтобы видеть и запись сессии
+    в process_response SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica_reads = request.method in ('GET', 'HEAD') and PIN_COOKIE not in request.COOKIES
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.replica_reads = False
+            _state.wrote = False
+        if wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
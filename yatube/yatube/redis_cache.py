@@ -0,0 +1,343 @@
+"""
+Кэш-бэкенд Django поверх протокола Redis (RESP) без сторонних библиотек.
+
+Подключается из settings.py, если задана переменная окружения CACHE_URL
+вида redis://host:6379/0. Все воркеры gunicorn видят один и тот же кэш,
+поэтому сброс карточек, счётчики и сессии согласованы между процессами.
+Для локальной разработки и тестов есть сервер-заглушка yatube.redis_server.
+"""
+import os
+import pickle
+import queue
+import select
+import socket
+import threading
+from urllib.parse import urlparse
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+# INCRBY только для существующего ключа: проверка и изменение выполняются
+# на сервере одним шагом, другие клиенты не видят промежуточного состояния
+INCR_EXISTING = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return false
+"""
+
+
+class RedisError(Exception):
+    pass
+
+
+class NotSentError(ConnectionError):
+    """
+    Команды не ушли на сервер целиком: их можно безопасно повторить.
+    """
+
+
+class Connection:
+    def __init__(self, host, port, db=0, socket_timeout=None, password=None):
+        self.sock = socket.create_connection((host, port), timeout=socket_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def stale(self):
+        """
+        Простаивающее соединение, в котором есть что читать, сервер уже закрыл
+        (или прислал то, чего мы не ждали) - его нельзя использовать повторно.
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Сервер кэша закрыл соединение')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            return RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RedisError('Неизвестный ответ сервера: %r' % line)
+
+    def pipeline(self, commands):
+        """
+        Отправляет несколько команд одним пакетом и читает все ответы.
+        Ошибки сервера возвращаются как объекты RedisError.
+        """
+        try:
+            self.sock.sendall(b''.join(self.encode(args) for args in commands))
+        except OSError as exc:
+            raise NotSentError(str(exc)) from exc
+        return [self.read_reply() for _ in commands]
+
+    def execute(self, *args):
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений. После fork (gunicorn --preload)
+    соединения родителя не используются: пул создаётся заново.
+    """
+
+    def __init__(self, host, port, db=0, max_connections=50, socket_timeout=None, password=None):
+        self.params = dict(host=host, port=port, db=db, socket_timeout=socket_timeout, password=password)
+        self.max_connections = max_connections
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.max_connections)
+
+    def get(self):
+        if self.pid != os.getpid():
+            self._reset()
+        # все соединения заняты зависшими запросами - ошибка, как при недоступном сервере,
+        # а не вечное ожидание потока запроса
+        if not self.slots.acquire(timeout=self.params['socket_timeout']):
+            raise ConnectionError('Нет свободных соединений с сервером кэша: занято %d' % self.max_connections)
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if not connection.stale():
+                return connection
+            connection.close()
+        try:
+            return Connection(**self.params)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        if broken or self.pid != os.getpid():
+            connection.close()
+        else:
+            self.idle.put(connection)
+        self.slots.release()
+
+    def pipeline(self, commands):
+        # повторяем только то, что не дошло до сервера: после отправки ошибка чтения
+        # (например, таймаут) не говорит, выполнены ли команды, и повтор INCRBY
+        # применил бы его дважды. Закрытые сервером соединения отсеивает get()
+        for attempt in (1, 2):
+            connection = self.get()
+            try:
+                replies = connection.pipeline(commands)
+            except NotSentError:
+                self.release(connection, broken=True)
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                self.release(connection, broken=True)
+                raise
+            self.release(connection)
+            for reply in replies:
+                if isinstance(reply, RedisError):
+                    raise reply
+            return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def disconnect(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(location, options):
+    """
+    Один пул на адрес сервера и настройки пула в процессе, общий для алиасов кэша.
+    """
+    url = urlparse(location)
+    key = (location, options.get('MAX_CONNECTIONS', 50), options.get('SOCKET_TIMEOUT', 5))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                host=url.hostname or 'localhost',
+                port=url.port or 6379,
+                db=int((url.path or '/0').lstrip('/') or 0),
+                password=url.password,
+                max_connections=options.get('MAX_CONNECTIONS', 50),
+                socket_timeout=options.get('SOCKET_TIMEOUT', 5),
+            )
+        return _pools[key]
+
+
+class RedisCache(BaseCache):
+    """
+    Целые числа хранятся как есть, чтобы incr() выполнялся на сервере атомарно
+    скриптом INCR_EXISTING; остальные значения - в pickle.
+    Ключи получают KEY_PREFIX, и clear() удаляет только своё пространство имён.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        self.location = server
+        self.options = params.get('OPTIONS', {})
+        self.pool = get_pool(server, self.options)
+
+    @staticmethod
+    def serialize(value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def deserialize(data):
+        if data is None:
+            return None
+        try:
+            return int(data)
+        except ValueError:
+            return pickle.loads(data)
+
+    def _ttl_args(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return []
+        return ['PX', max(1, int(timeout * 1000))]
+
+    def _set_command(self, key, value, timeout, *flags):
+        return ['SET', key, self.serialize(value)] + self._ttl_args(timeout) + list(flags)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is not None and timeout is not DEFAULT_TIMEOUT and timeout <= 0:
+            return False
+        reply = self.pool.execute(*self._set_command(self._key(key, version), value, timeout, 'NX'))
+        return reply == 'OK'
+
+    def get(self, key, default=None, version=None):
+        value = self.deserialize(self.pool.execute('GET', self._key(key, version)))
+        return default if value is None else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        if timeout is not None and timeout is not DEFAULT_TIMEOUT and timeout <= 0:
+            self.pool.execute('DEL', key)
+            return
+        self.pool.execute(*self._set_command(key, value, timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        ttl = self._ttl_args(timeout)
+        if ttl:
+            return self.pool.execute('PEXPIRE', key, ttl[1]) == 1
+        exists, _ = self.pool.pipeline([['EXISTS', key], ['PERSIST', key]])
+        return exists == 1
+
+    def delete(self, key, version=None):
+        self.pool.execute('DEL', self._key(key, version))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        made = [self._key(key, version) for key in keys]
+        values = self.pool.execute('MGET', *made)
+        return {
+            key: self.deserialize(value)
+            for key, value in zip(keys, values) if value is not None
+        }
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        if timeout is not None and timeout is not DEFAULT_TIMEOUT and timeout <= 0:
+            self.delete_many(data.keys(), version=version)
+            return []
+        self.pool.pipeline([
+            self._set_command(self._key(key, version), value, timeout)
+            for key, value in data.items()
+        ])
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            self.pool.execute('DEL', *keys)
+
+    def has_key(self, key, version=None):
+        return self.pool.execute('EXISTS', self._key(key, version)) == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        value = self.pool.execute('EVAL', INCR_EXISTING, 1, key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def clear(self):
+        # SCAN обходит ключи порциями и, в отличие от KEYS, не блокирует общий сервер
+        pattern = '%s:*' % self.key_prefix if self.key_prefix else '*'
+        cursor = b'0'
+        while True:
+            cursor, keys = self.pool.execute('SCAN', cursor, 'MATCH', pattern, 'COUNT', 1000)
+            if keys:
+                self.pool.execute('DEL', *keys)
+            if cursor == b'0':
+                break
+
+    def close(self, **kwargs):
+        # соединения остаются в пуле между запросами
+        pass
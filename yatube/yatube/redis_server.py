@@ -0,0 +1,277 @@
+"""
+Локальная заглушка сервера Redis на чистом Python.
+
+Понимает подмножество команд, которое нужно yatube.redis_cache, и позволяет
+проверить согласованность общего кэша между несколькими воркерами
+без внешнего сервиса:
+
+    python -m yatube.redis_server --port 6379
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+from yatube.redis_cache import INCR_EXISTING
+
+
+class Store:
+    def __init__(self, databases=16):
+        self.lock = threading.Lock()
+        self.databases = [dict() for _ in range(databases)]
+        # незавершённые обходы SCAN: номер курсора -> последний выданный ключ
+        self.cursors = {}
+        self.next_cursor = 0
+
+    def alive(self, db, key):
+        entry = self.databases[db].get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.databases[db][key]
+            return None
+        return entry
+
+
+class CommandError(Exception):
+    pass
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.db = 0
+
+    def handle(self):
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, OSError, ValueError):
+                return
+            if args is None:
+                return
+            try:
+                reply = self.dispatch(args)
+            except CommandError as exc:
+                reply = exc
+            self.wfile.write(self.encode(reply))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # inline-команда, например из telnet
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def encode(reply):
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, CommandError):
+            return b'-ERR %s\r\n' % str(reply).encode()
+        if isinstance(reply, bool):
+            return b':%d\r\n' % reply
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, str):
+            return b'+%s\r\n' % reply.encode()
+        if isinstance(reply, bytes):
+            return b'$%d\r\n%s\r\n' % (len(reply), reply)
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(RedisHandler.encode(item) for item in reply)
+        raise TypeError(reply)
+
+    def dispatch(self, args):
+        name = args[0].decode().upper()
+        method = getattr(self, 'cmd_' + name.lower(), None)
+        if method is None:
+            raise CommandError("unknown command '%s'" % name)
+        store = self.server.store
+        with store.lock:
+            return method(store, *args[1:])
+
+    def cmd_ping(self, store, *args):
+        return args[0] if args else 'PONG'
+
+    def cmd_auth(self, store, *args):
+        return 'OK'
+
+    def cmd_select(self, store, db):
+        self.db = int(db)
+        return 'OK'
+
+    def cmd_get(self, store, key):
+        entry = store.alive(self.db, key)
+        return entry[0] if entry else None
+
+    def cmd_set(self, store, key, value, *options):
+        options = [option.upper() for option in options]
+        expires = None
+        if b'EX' in options:
+            expires = time.monotonic() + int(options[options.index(b'EX') + 1])
+        if b'PX' in options:
+            expires = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+        exists = store.alive(self.db, key) is not None
+        if (b'NX' in options and exists) or (b'XX' in options and not exists):
+            return None
+        store.databases[self.db][key] = (value, expires)
+        return 'OK'
+
+    def cmd_mget(self, store, *keys):
+        return [self.cmd_get(store, key) for key in keys]
+
+    def cmd_del(self, store, *keys):
+        deleted = 0
+        for key in keys:
+            if store.alive(self.db, key) is not None:
+                del store.databases[self.db][key]
+                deleted += 1
+        return deleted
+
+    def cmd_exists(self, store, *keys):
+        return sum(store.alive(self.db, key) is not None for key in keys)
+
+    def cmd_incrby(self, store, key, delta):
+        entry = store.alive(self.db, key)
+        value, expires = entry if entry else (b'0', None)
+        try:
+            value = int(value) + int(delta)
+        except ValueError:
+            raise CommandError('value is not an integer or out of range')
+        store.databases[self.db][key] = (str(value).encode(), expires)
+        return value
+
+    def cmd_eval(self, store, script, numkeys, *args):
+        # Lua здесь нет: известные скрипты клиента выполняются их аналогами на Python
+        scripts = {INCR_EXISTING.encode(): self.script_incr_existing}
+        if script not in scripts:
+            raise CommandError('script is not supported by the stand-in server')
+        numkeys = int(numkeys)
+        return scripts[script](store, args[:numkeys], args[numkeys:])
+
+    def script_incr_existing(self, store, keys, argv):
+        if store.alive(self.db, keys[0]) is None:
+            return None
+        return self.cmd_incrby(store, keys[0], argv[0])
+
+    def cmd_incr(self, store, key):
+        return self.cmd_incrby(store, key, b'1')
+
+    def cmd_decrby(self, store, key, delta):
+        return self.cmd_incrby(store, key, str(-int(delta)).encode())
+
+    def cmd_pexpire(self, store, key, milliseconds):
+        entry = store.alive(self.db, key)
+        if entry is None:
+            return 0
+        store.databases[self.db][key] = (entry[0], time.monotonic() + int(milliseconds) / 1000)
+        return 1
+
+    def cmd_expire(self, store, key, seconds):
+        return self.cmd_pexpire(store, key, int(seconds) * 1000)
+
+    def cmd_persist(self, store, key):
+        entry = store.alive(self.db, key)
+        if entry is None or entry[1] is None:
+            return 0
+        store.databases[self.db][key] = (entry[0], None)
+        return 1
+
+    def cmd_pttl(self, store, key):
+        entry = store.alive(self.db, key)
+        if entry is None:
+            return -2
+        if entry[1] is None:
+            return -1
+        return int((entry[1] - time.monotonic()) * 1000)
+
+    def cmd_keys(self, store, pattern):
+        pattern = pattern.decode()
+        return [
+            key for key in list(store.databases[self.db])
+            if store.alive(self.db, key) is not None and fnmatch.fnmatchcase(key.decode(), pattern)
+        ]
+
+    def cmd_debug(self, store, subcommand, *args):
+        # DEBUG SLEEP секунды: задержка ответа, как у настоящего сервера
+        if subcommand.upper() != b'SLEEP':
+            raise CommandError('DEBUG subcommand not supported')
+        time.sleep(float(args[0]))
+        return 'OK'
+
+    def cmd_scan(self, store, cursor, *options):
+        # курсор указывает на последний выданный ключ, поэтому удаление ключей
+        # во время обхода ничего не пропускает, как и у настоящего SCAN
+        options = [option.upper() if index % 2 == 0 else option for index, option in enumerate(options)]
+        pattern = options[options.index(b'MATCH') + 1].decode() if b'MATCH' in options else '*'
+        count = int(options[options.index(b'COUNT') + 1]) if b'COUNT' in options else 10
+        after = store.cursors.pop(int(cursor), None) if int(cursor) else None
+        keys = sorted(key for key in store.databases[self.db] if after is None or key > after)
+        batch = keys[:count]
+        matched = [
+            key for key in batch
+            if store.alive(self.db, key) is not None and fnmatch.fnmatchcase(key.decode(), pattern)
+        ]
+        if len(keys) <= count:
+            return [b'0', matched]
+        store.next_cursor += 1
+        store.cursors[store.next_cursor] = batch[-1]
+        return [str(store.next_cursor).encode(), matched]
+
+    def cmd_dbsize(self, store):
+        return len(self.cmd_keys(store, b'*'))
+
+    def cmd_flushdb(self, store):
+        store.databases[self.db].clear()
+        return 'OK'
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """
+    Сервер в отдельном потоке; port=0 выбирает свободный порт.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), RedisHandler)
+        self.store = Store()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'redis://%s:%d/0' % (host, port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    options = parser.parse_args()
+    server = LocalRedisServer(options.host, options.port)
+    print('Заглушка Redis слушает %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
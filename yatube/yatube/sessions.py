@@ -0,0 +1,152 @@
+"""
+Сессии и пользователь запроса из общего кэша.
+
+SESSION_ENGINE = 'yatube.sessions' читает сессию из кэша, а в базу пишет
+лениво: сразу - только новую сессию и смену входа (ключи auth и срок
+жизни), остальные изменения - не чаще раза в SESSION_DB_WRITE_INTERVAL
+секунд. Если кэш потерял запись, сессия читается из базы, и пропадают
+лишь изменения за последний интервал.
+
+CachedModelBackend держит в кэше пользователя, которого middleware
+аутентификации загружает на каждом запросе. Сигналы сохранения
+и удаления пользователя сбрасывают запись, см. posts.signals.
+
+Оба работают только с общим для всех воркеров кэшем (CACHE_URL): с
+отдельным LocMemCache в каждом процессе остальные воркеры видели бы
+устаревшие сессию и пользователя.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.sessions.backends import db
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.utils import timezone
+
+KEY_PREFIX = 'yatube.sessions.'
+USER_KEY_PREFIX = 'yatube.user.'
+
+# ключи сессии, изменение которых сразу пишется в базу
+DURABLE_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY, '_session_expiry')
+
+
+def durable_state(data):
+    return tuple(data.get(key) for key in DURABLE_KEYS)
+
+
+class SessionStore(db.SessionStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        # когда сессия последний раз записана в базу и какие ключи входа там лежат
+        self._synced = 0
+        self._db_state = None
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    def load(self):
+        if self.session_key is None:
+            return {}
+        try:
+            cached = self._cache.get(self.cache_key)
+        except Exception:
+            # кэш недоступен - сессия есть в базе
+            cached = None
+        if cached is not None:
+            self._synced, self._db_state = cached['synced'], cached['db_state']
+            return cached['data']
+        s = self._get_session_from_db()
+        if s is None:
+            return {}
+        data = self.decode(s.session_data)
+        self._synced, self._db_state = time.time(), durable_state(data)
+        self._cache_data(data, self.get_expiry_age(expiry=s.expire_date))
+        return data
+
+    def _cache_data(self, data, timeout):
+        self._cache.set(self.cache_key, {
+            'data': data,
+            'synced': self._synced,
+            'db_state': self._db_state,
+        }, timeout)
+
+    def exists(self, session_key):
+        return (
+            session_key and (self.cache_key_prefix + session_key) in self._cache
+            or super().exists(session_key)
+        )
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        now = time.time()
+        if (
+            must_create
+            or durable_state(data) != self._db_state
+            or now - self._synced >= settings.SESSION_DB_WRITE_INTERVAL
+        ):
+            super().save(must_create)
+            self._synced, self._db_state = now, durable_state(data)
+        self._cache_data(data, self.get_expiry_age())
+
+    def delete(self, session_key=None):
+        super().delete(session_key)
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+
+    @classmethod
+    def clear_expired(cls, batch_size=1000):
+        """
+        Удаляет истёкшие строки пачками, чтобы не держать долгую блокировку
+        на таблице. Строку, чья сессия ещё жива в кэше, не трогает: её срок
+        в базе отстаёт, потому что запись туда ленивая.
+        """
+        model = cls.get_model_class()
+        session_cache = caches[settings.SESSION_CACHE_ALIAS]
+        deleted, last = 0, ''
+        while True:
+            keys = list(
+                model.objects
+                .filter(expire_date__lt=timezone.now(), session_key__gt=last)
+                .order_by('session_key')
+                .values_list('session_key', flat=True)[:batch_size]
+            )
+            if not keys:
+                return deleted
+            last = keys[-1]
+            alive = session_cache.get_many([cls.cache_key_prefix + key for key in keys])
+            expired = [key for key in keys if cls.cache_key_prefix + key not in alive]
+            deleted += model.objects.filter(session_key__in=expired).delete()[0]
+
+
+def user_cache_key(user_id):
+    return '%s%s' % (USER_KEY_PREFIX, user_id)
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+def forget_user(user_id):
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    # параллельный запрос мог успеть закэшировать строку до коммита
+    transaction.on_commit(lambda: cache.delete(key))
@@ -8,11 +8,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
-
-# import dj_database_url
-#
-# db_from_env = dj_database_url.config()
-# DATABASE['default'].update(db_from_env)
+import socket
+from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -24,7 +21,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = 'jck4*@u$(6c_o3@z@4%d3x(bz=8m95pis*ud=aee_#_w9m81lq'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = [
         "localhost",
@@ -51,30 +48,47 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # чтение с реплик и привязка к основной базе после записи, см. yatube.db_router
+    'yatube.db_router.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # статика и картинки постов отдаются до сессий и остальных middleware, см. yatube.staticfiles
+    'yatube.staticfiles.StaticFilesMiddleware',
+    'yatube.staticfiles.MediaFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # профилировщик SQL и шаблонов, включается переменной окружения QUERY_PROFILER=1
+    'posts.profiling.QueryProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 
+# Кэширующий загрузчик шаблонов включён всегда, а не только при DEBUG = False:
+# каждый шаблон разбирается один раз на процесс (см. posts.template_cache).
+# Чтобы правки шаблонов подхватывались без перезапуска: TEMPLATE_CACHE=0
+TEMPLATE_CACHE = os.environ.get('TEMPLATE_CACHE', '1') == '1'
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)] if TEMPLATE_CACHE else TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'posts.context_processors.live',
                 'users.context.year',
             ],
         },
@@ -83,6 +97,14 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# ASGI-вход (yatube.asgi): адреса с асинхронными view для чтения,
+# потоки для стека middleware и для запросов к базе из async view.
+# Каждый запрос async view к базе берёт соединение заново, поэтому с ASGI
+# стоит включить пул соединений (DATABASE_POOL=1, см. ниже)
+ASGI_URLCONF = 'yatube.asgi_urls'
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 16))
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -93,6 +115,48 @@ DATABASES = {
     }
 }
 
+if os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_REPLICA_URLS'):
+    import dj_database_url
+
+if os.environ.get('DATABASE_URL'):
+    DATABASES['default'].update(dj_database_url.config())
+
+# Реплики только для чтения: DATABASE_REPLICA_URLS=postgres://...,postgres://...
+# В тестах они смотрят в тестовую основную базу (MIRROR)
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(dj_database_url.parse(url), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+# Повторное использование соединений.
+# DATABASE_CONN_MAX_AGE - сколько секунд поток gunicorn держит своё соединение
+# (0 - новое на каждый запрос, как раньше). DATABASE_POOL=1 вместо этого
+# включает общий пул процесса (yatube.db.pool): соединение возвращается в пул
+# в конце запроса, поэтому CONN_MAX_AGE с пулом оставляем 0. Пул полезен
+# с потоковыми воркерами: GUNICORN_CMD_ARGS="--worker-class gthread --threads 8".
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 0))
+DATABASE_POOL = os.environ.get('DATABASE_POOL', '0') == '1'
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'yatube.db.backends.postgresql',
+    'django.db.backends.postgresql_psycopg2': 'yatube.db.backends.postgresql',
+    'django.db.backends.sqlite3': 'yatube.db.backends.sqlite3',
+}
+for settings_dict in DATABASES.values():
+    settings_dict['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
+    if DATABASE_POOL and settings_dict['ENGINE'] in POOLED_ENGINES:
+        settings_dict['ENGINE'] = POOLED_ENGINES[settings_dict['ENGINE']]
+        settings_dict.setdefault('OPTIONS', {})['POOL'] = {
+            'MAX_SIZE': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 20)),
+            'MAX_LIFETIME': int(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 30 * 60)),
+            'HEALTH_CHECK_INTERVAL': int(os.environ.get('DATABASE_POOL_HEALTH_CHECK_INTERVAL', 30)),
+            'TIMEOUT': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        }
+
+DATABASE_ROUTERS = ['yatube.db_router.PrimaryReplicaRouter']
+# сколько секунд после записи браузер читает только основную базу
+REPLICA_PIN_SECONDS = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -111,11 +175,79 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Кэш. CACHE_URL=redis://host:6379/0 включает общий для всех воркеров gunicorn кэш
+# (страницы, карточки постов, счётчики и сессии). Без переменной каждый процесс
+# держит свой LocMemCache. Для разработки: python -m yatube.redis_server
+CACHE_URL = os.environ.get('CACHE_URL', '')
+
+if CACHE_URL.startswith('redis://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.redis_cache.RedisCache',
+            'LOCATION': CACHE_URL,
+            # пространство имён ключей, чтобы несколько сайтов могли делить один сервер
+            'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'yatube'),
+            'OPTIONS': {
+                'MAX_CONNECTIONS': int(os.environ.get('CACHE_MAX_CONNECTIONS', 50)),
+                'SOCKET_TIMEOUT': float(os.environ.get('CACHE_SOCKET_TIMEOUT', 1)),
+            },
+        }
     }
-}
+    # сессии и пользователь запроса читаются из кэша, см. yatube.sessions
+    SESSION_ENGINE = 'yatube.sessions'
+    AUTHENTICATION_BACKENDS = [
+        'yatube.sessions.CachedModelBackend',
+        # для сессий, открытых до включения кэша
+        'django.contrib.auth.backends.ModelBackend',
+    ]
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# изменения сессии, кроме входа и выхода, пишутся в базу не чаще раза за интервал
+SESSION_DB_WRITE_INTERVAL = 5 * 60
+AUTH_USER_CACHE_TIMEOUT = 60 * 60
+
+# ETag и 304 для лент и постов (posts.conditional). Версия контента живёт в кэше,
+# поэтому по умолчанию включены только с общим кэшем; один процесс с LocMemCache
+# может включить их явно: CONDITIONAL_GET=1
+CONDITIONAL_GET = os.environ.get('CONDITIONAL_GET', '1' if CACHE_URL else '0') == '1'
+
+# Кэш целых страниц для анонимных посетителей с суррогатными ключами, см. posts.pagecache.
+# Как и ETag, по умолчанию включён только с общим кэшем. Токен для POST /cache/purge/
+PAGE_CACHE = os.environ.get('PAGE_CACHE', '1' if CACHE_URL else '0') == '1'
+PAGE_CACHE_TIMEOUT = 5 * 60
+PAGE_CACHE_PURGE_TOKEN = os.environ.get('PAGE_CACHE_PURGE_TOKEN', '')
+
+# Отложенная запись подписок и комментариев, см. posts.writebehind:
+# off - сразу в базу, on - через очередь, auto - в очередь, только если база занята.
+# Очередь разбирает python manage.py writebehind
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', 'off')
+WRITE_BEHIND_QUEUE = os.environ.get('WRITE_BEHIND_QUEUE', os.path.join(BASE_DIR, 'writebehind.sqlite3'))
+# у каждого сервера своя очередь и своя позиция в основной базе
+WRITE_BEHIND_NAME = os.environ.get('WRITE_BEHIND_NAME', socket.gethostname())
+WRITE_BEHIND_BATCH_SIZE = 500
+# задержка очереди в секундах, после которой воркер пишет предупреждение
+WRITE_BEHIND_MAX_LAG = 30
+
+# Граф подписок в памяти процесса, см. posts.followgraph. Процесс догоняет
+# журнал подписок при смене версии в кэше и не реже раза за интервал в секундах
+FOLLOW_GRAPH = os.environ.get('FOLLOW_GRAPH', '1') == '1'
+FOLLOW_GRAPH_POLL_INTERVAL = 1
+# записи журнала старше удаляет prune_follow_log
+FOLLOW_GRAPH_LOG_RETENTION = timedelta(days=1)
+
+# Рекомендации «на кого подписаться»: сколько авторов хранит build_recommendations
+# для каждого пользователя и сколько показывается на страницах, см. posts.recommendations
+RECOMMENDATIONS_PER_USER = 20
+RECOMMENDATIONS_SHOWN = 5
+
+# Карточки постов кэшируются по (id, version) и сбрасываются сигналами,
+# поэтому срок жизни нужен только для вытеснения старых версий
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -138,13 +270,89 @@ STATIC_URL = '/static/'
 
 # задаём адрес директории, куда командой *collectstatic* будет собрана вся статика
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# имена с хэшем содержимого и сжатые .gz/.br копии, см. yatube.staticfiles
+STATICFILES_STORAGE = 'yatube.staticfiles.StaticFilesStorage'
+# срок кэша для статики без хэша в имени; с хэшем - immutable навсегда
+WHITENOISE_MAX_AGE = 60 * 60
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_MAX_AGE = 24 * 60 * 60
 
 # Идентификатор текущего сайта
 SITE_ID = 1
 
+# Лента подписок
+# авторы с таким числом подписчиков не раскладываются по лентам при публикации,
+# их посты подмешиваются в ленту при чтении
+TIMELINE_CELEBRITY_FOLLOWERS = 10000
+# размер пачки при записи строк материализованной ленты
+TIMELINE_BATCH_SIZE = 1000
+# в материализованной ленте хранится столько самых новых постов, более старые
+# страницы читаются из Follow и Post
+TIMELINE_MAX_ENTRIES = 800
+# ленту подписчика обрезают в среднем раз за столько разложенных в неё постов
+TIMELINE_TRIM_EVERY = 20
+# потоки, которые дописывают посты в ленты после подписки и обрезают их
+TIMELINE_WORKERS = int(os.environ.get('TIMELINE_WORKERS', 1))
+
+# Загрузка картинок постов: файл всегда пишется на диск кусками, см. posts.uploads
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get('IMAGE_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+# предел до декодирования, защищает от «бомб» с огромным числом пикселей
+IMAGE_UPLOAD_MAX_PIXELS = int(os.environ.get('IMAGE_UPLOAD_MAX_PIXELS', 40 * 1000 * 1000))
+# более крупные оригиналы уменьшаются по длинной стороне
+IMAGE_MAX_DIMENSION = 2048
+IMAGE_UPLOAD_QUALITY = 90
+
+# Миниатюры картинок постов, строятся в фоне пулом из posts.thumbnails.
+# имя размера: (геометрия, обрезка по центру); размеры совпадают с вёрсткой карточек
+THUMBNAIL_SIZES = {
+    'card': ('960x339', True),
+}
+# форматы, которые не умеет сохранять установленный Pillow, пропускаются
+THUMBNAIL_FORMATS = ('jpeg', 'webp', 'avif')
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+
+# Комментарии: страница верхнего уровня, ответы за один запрос и глубина веток
+COMMENTS_PER_PAGE = 20
+COMMENT_REPLIES_PER_PAGE = 100
+COMMENT_MAX_DEPTH = 8
+
+# Тексты постов и комментариев отрисовываются в HTML при сохранении, см. posts.rendering;
+# ссылки на @пользователей и #группы. После изменения - manage.py rerender_texts --all
+TEXT_LINKS = os.environ.get('TEXT_LINKS', '1') == '1'
+
+# Живые ленты (posts.live, posts.events). Под ASGI (yatube.asgi) включены всегда,
+# под WSGI - только с EVENTS_ENABLED=1: там каждый слушатель держит поток воркера
+# до конца потока событий
+EVENTS_ENABLED = os.environ.get('EVENTS_ENABLED', '0') == '1'
+# буфер событий на клиента, после переполнения клиент получает reset; комментарий-пинг
+# в потоке SSE; длина одного потока и long-poll-запроса; как часто процесс со
+# слушателями читает из базы посты и комментарии других процессов (0 - только свои сигналы)
+EVENTS_BUFFER_SIZE = 100
+EVENTS_HEARTBEAT = 15
+EVENTS_RETRY = 3
+EVENTS_STREAM_MAX_AGE = 5 * 60
+EVENTS_LONG_POLL_TIMEOUT = 25
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 1))
+
+# Профилирование запросов: заголовок Server-Timing и JSON-строки в логе posts.profiling
+QUERY_PROFILER = os.environ.get('QUERY_PROFILER') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'posts.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'posts.thumbnails': {'handlers': ['console'], 'level': 'WARNING'},
+        'posts.writebehind': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
 # Login
 LOGIN_URL = "/auth/login/"
 LOGIN_REDIRECT_URL = "index"
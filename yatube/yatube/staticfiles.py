@@ -0,0 +1,97 @@
+"""
+Раздача статики и картинок постов через WhiteNoise.
+
+collectstatic собирает статику под именами с хэшем содержимого
+(css/site.3f2a9c1e8b7d.css) и рядом кладёт сжатые копии .gz и .br, так что
+при запросе ничего не сжимается. Файлы с хэшем в имени отдаются с
+Cache-Control: immutable на десять лет, остальные - на WHITENOISE_MAX_AGE.
+
+WhiteNoise сам отвечает на Range и условные запросы, а тело ответа -
+файл, который gunicorn отправляет через sendfile без копирования
+в процесс (wsgi.file_wrapper).
+"""
+from http import HTTPStatus
+from urllib.parse import urlparse
+
+from whitenoise.middleware import WhiteNoiseFileResponse, WhiteNoiseMiddleware
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+from whitenoise.string_utils import ensure_leading_trailing_slash
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    Файл без записи в манифесте (collectstatic ещё не запускали, тесты)
+    отдаётся под исходным именем, а не роняет страницу с ошибкой 500.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+class PartialFile:
+    """
+    Часть файла от текущей позиции длиной length. WhiteNoise отдаёт на Range
+    файл до конца и полагается на то, что сервер оборвёт тело по
+    Content-Length; ASGI-обработчик и тестовый клиент этого не делают.
+    fileno() оставлен, чтобы gunicorn по-прежнему отправлял часть через sendfile.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    @staticmethod
+    def serve(static_file, request):
+        response = static_file.get_response(request.method, request.META)
+        headers = dict(response.headers)
+        body = response.file
+        if body is not None and response.status == HTTPStatus.PARTIAL_CONTENT:
+            body = PartialFile(body, int(headers['Content-Length']))
+        http_response = WhiteNoiseFileResponse(body or (), status=int(response.status))
+        del http_response['Content-Type']
+        for key, value in headers.items():
+            http_response[key] = value
+        return http_response
+
+
+class MediaFilesMiddleware(StaticFilesMiddleware):
+    """
+    Картинки постов и миниатюры из MEDIA_ROOT. Они появляются во время
+    работы, поэтому файл ищется на диске при каждом запросе, а не один раз
+    при запуске, как статика. Имена загруженных файлов могут повторяться
+    после удаления, поэтому кэшируются они на MEDIA_MAX_AGE, а не навсегда.
+    """
+
+    def configure_from_settings(self, settings):
+        super().configure_from_settings(settings)
+        self.autorefresh = True
+        self.use_finders = False
+        self.root = None
+        self.static_prefix = ensure_leading_trailing_slash(urlparse(settings.MEDIA_URL).path)
+        self.static_root = settings.MEDIA_ROOT
+        self.max_age = 0 if settings.DEBUG else settings.MEDIA_MAX_AGE
+
+    def immutable_file_test(self, path, url):
+        return False
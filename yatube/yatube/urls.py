@@ -15,8 +15,6 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 from django.contrib.flatpages import views
-from django.conf import settings
-from django.conf.urls.static import static
 from django.conf.urls import handler404, handler500
 
 handler404 = "posts.views.page_not_found" # noqa
@@ -44,8 +42,4 @@ urlpatterns += [
 urlpatterns += [
         # импорт из приложения posts
         path('', include('posts.urls')),
-]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
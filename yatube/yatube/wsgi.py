@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# шаблоны разбираются до первого запроса, см. posts.template_cache
+from posts.template_cache import precompile  # noqa: E402
+
+precompile()
+
+# граф подписок грузится в фоне, пока запросы отвечают из SQL, см. posts.followgraph
+from posts import followgraph  # noqa: E402
+
+followgraph.warm()